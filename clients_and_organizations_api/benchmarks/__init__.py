@@ -0,0 +1,11 @@
+"""
+Бенчмарки импорта и API.
+
+Каждый бенчмарк запускается из папки проекта как модуль, например:
+    python -m benchmarks.clients_join --clients 10000 --organizations 100000
+
+Бенчмарки работают на отдельной временной базе SQLite и не трогают db.sqlite3.
+
+Синтетические файлы для импорта создает benchmarks.generate, полный бенчмарк импорта
+с результатами в JSON - benchmarks.imports.
+"""
@@ -0,0 +1,78 @@
+"""
+Бенчмарк выдачи списка счетов (сериализация и рендеринг JSON).
+
+Сравнивает прежний путь (объекты Bill с select_related, BillSerializer со StringRelatedField
+и стандартный JSONRenderer) с быстрым (строки values() с именами клиента и организации,
+BillListSerializer и FastJSONRenderer). Таблица счетов читается страницами по --page-size записей,
+ответы обоих путей сверяются побайтно.
+
+Запуск:
+    python -m benchmarks.bills_list --bills 100000 --page-size 1000
+"""
+import argparse
+import datetime
+import random
+
+from benchmarks.common import setup_django, timer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bills", type=int, default=100000)
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    setup_django()
+    from rest_framework.renderers import JSONRenderer
+
+    from main_app.models import Client, Organization, Bill
+    from main_app.renderers import FastJSONRenderer, orjson
+    from main_app.serializers import BillSerializer, BillListSerializer
+
+    rng = random.Random(args.seed)
+    Client.objects.bulk_create([Client(name="client{}".format(idx)) for idx in range(args.clients)])
+    clients = list(Client.objects.all())
+    Organization.objects.bulk_create(
+        [Organization(name="org{}".format(idx), address="", client=client) for idx, client in enumerate(clients)]
+    )
+    organizations = list(Organization.objects.all())
+    Bill.objects.bulk_create(
+        [
+            Bill(
+                number=idx, summ=rng.randint(1, 100000),
+                date=datetime.date(2022, 1, 1) + datetime.timedelta(days=rng.randint(0, 365)),
+                service="лечение", fraud_score=round(rng.random(), 6), service_class=1, service_name="лечение",
+                client_id=organization.client_id, organization=organization,
+            )
+            for idx, organization in ((idx, rng.choice(organizations)) for idx in range(args.bills))
+        ],
+        batch_size=1000,
+    )
+
+    instances = Bill.objects.select_related("client", "organization").order_by("id")
+    rows = Bill.objects.order_by("id").values(*BillListSerializer.values_fields())
+    pages = range(0, args.bills, args.page_size)
+
+    timings = {}
+    with timer(timings, "legacy"):
+        legacy = [
+            JSONRenderer().render(BillSerializer(instances[start:start + args.page_size], many=True).data)
+            for start in pages
+        ]
+    with timer(timings, "fast"):
+        fast = [
+            FastJSONRenderer().render(BillSerializer(list(rows[start:start + args.page_size]), many=True).data)
+            for start in pages
+        ]
+    assert fast == legacy, "responses differ"
+
+    print("bills: {}, page size: {}, orjson: {}".format(args.bills, args.page_size, orjson is not None))
+    for name in ("legacy", "fast"):
+        print("{:<7} {:.3f} s, {:.0f} rows/s".format(name + ":", timings[name], args.bills / timings[name]))
+    print("speedup: ~{:.1f}x".format(timings["legacy"] / timings["fast"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Бенчмарк сопоставления организаций с клиентами при импорте client_org.xlsx.
+
+Сравнивает прежний алгоритм (для каждого клиента из Client.objects.all() - проход filter по всем
+организациям файла, O(клиенты × организации)) с hash join из importers.build_organizations.
+Прежний алгоритм на полном объеме работает часами, поэтому он замеряется на первых --legacy-clients
+клиентах, а результат линейно экстраполируется на всех клиентов.
+
+Запуск:
+    python -m benchmarks.clients_join --clients 10000 --organizations 100000
+"""
+import argparse
+import random
+
+from benchmarks.common import setup_django, timer
+
+
+def legacy_build_organizations(organizations_data, clients):
+    from main_app import utils
+    from main_app.models import Organization
+
+    organizations = []
+    for client_obj in clients:
+        orgs = list(filter(lambda x: x.get("client_name") == client_obj.name, organizations_data))
+        organizations.extend(
+            list(
+                map(
+                    lambda x: Organization(
+                        name=x.get("name"),
+                        address=utils.prepare_address(x.get("address")),
+                        client=client_obj,
+                    ),
+                    orgs
+                )
+            )
+        )
+    return organizations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=10000)
+    parser.add_argument("--organizations", type=int, default=100000)
+    parser.add_argument("--legacy-clients", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    setup_django()
+    from main_app import importers
+    from main_app.models import Client
+
+    rng = random.Random(args.seed)
+    client_names = ["client{}".format(idx) for idx in range(args.clients)]
+    organizations_data = [
+        {"client_name": rng.choice(client_names), "name": "org{}".format(idx), "address": "г Москва"}
+        for idx in range(args.organizations)
+    ]
+    Client.objects.bulk_create([Client(name=name) for name in client_names], batch_size=1000)
+
+    timings = {}
+    legacy_clients = list(Client.objects.all()[:args.legacy_clients])
+    with timer(timings, "legacy"):
+        legacy_build_organizations(organizations_data, legacy_clients)
+    legacy_total = timings["legacy"] * args.clients / max(len(legacy_clients), 1)
+
+    with timer(timings, "hash_join"):
+        organizations = importers.build_organizations(organizations_data)
+    assert len(organizations) == args.organizations
+
+    print("clients: {}, organizations: {}".format(args.clients, args.organizations))
+    print("legacy join: {:.3f} s for {} clients, ~{:.1f} s extrapolated for {} clients".format(
+        timings["legacy"], len(legacy_clients), legacy_total, args.clients
+    ))
+    print("hash join:   {:.3f} s".format(timings["hash_join"]))
+    print("speedup:     ~{:.0f}x".format(legacy_total / timings["hash_join"]))
+
+
+if __name__ == "__main__":
+    main()
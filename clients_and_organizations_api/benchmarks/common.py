@@ -0,0 +1,51 @@
+import logging
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+
+def setup_django(db_path: str = None) -> str:
+    """
+    Настраивает Django для бенчмарка: подключает временную базу SQLite и создает в ней таблицы
+    по текущим моделям (без миграций). Логи импорта (my_logger) отключаются.
+
+    Параметры
+    ---------
+    db_path: str, None
+        путь к файлу базы, по умолчанию - новый временный файл
+
+    Возвращаемое значение
+    ---------------------
+    str
+        путь к файлу базы
+    """
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "clients_and_organizations_api.settings")
+    import django
+    from django.conf import settings
+
+    if db_path is None:
+        db_path = os.path.join(tempfile.mkdtemp(prefix="bench_"), "bench.sqlite3")
+    settings.DATABASES["default"]["NAME"] = db_path
+    settings.MIGRATION_MODULES = {"main_app": None}
+    settings.MEDIA_ROOT = os.path.join(os.path.dirname(db_path), "media")
+    django.setup()
+
+    from django.core.management import call_command
+
+    call_command("migrate", run_syncdb=True, verbosity=0)
+    logging.getLogger("my_logger").disabled = True
+    return db_path
+
+
+@contextmanager
+def timer(results: Dict[str, float], name: str) -> Iterator[None]:
+    """
+    Контекстный менеджер, записывающий время выполнения блока (в секундах) в results[name]
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        results[name] = time.perf_counter() - started
@@ -0,0 +1,126 @@
+"""
+Бенчмарк записи импорта счетов: путь ORM (bulk_create по частям, транзакция на часть)
+против быстрого загрузчика SQLite (executemany в одной транзакции, synchronous = NORMAL,
+увеличенный кеш страниц и отложенное обновление индексов, см. main_app.sqlite_loader).
+
+Генерирует client_org.xlsx и bills_client1.xlsx (см. benchmarks.generate), импортирует клиентов,
+затем --repeat раз импортирует файл со счетами каждым способом (таблица счетов очищается перед импортом).
+Во время импорта отдельный поток читает первую страницу списка счетов, чтобы показать,
+что чтение в режиме WAL не ждет транзакцию импорта.
+
+Запуск:
+    python -m benchmarks.fast_load --bills 100000 --repeat 3
+"""
+import argparse
+import os
+import statistics
+import threading
+import time
+from typing import Dict, List
+
+from benchmarks import generate
+from benchmarks.common import setup_django
+
+
+def read_bills_while(stop: threading.Event, latencies: List[float], errors: List[str], page_size: int) -> None:
+    """
+    Функция для потока чтения: пока не выставлен stop, читает первую страницу списка счетов
+    (как /api/bills/) и записывает время каждого запроса
+    """
+    from django.db import connection, OperationalError
+
+    from main_app.models import Bill
+    from main_app.serializers import BillListSerializer
+
+    try:
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                list(Bill.objects.order_by("date", "id").values(*BillListSerializer.values_fields())[:page_size])
+            except OperationalError as error:
+                errors.append(str(error))
+            latencies.append(time.perf_counter() - started)
+    finally:
+        connection.close()
+
+
+def run_import(path: str, fast: bool, page_size: int) -> Dict:
+    """
+    Функция для импорта файла со счетами одним из способов с параллельным чтением списка счетов
+    """
+    from django.test import override_settings
+
+    from main_app.importers import import_bills
+    from main_app.models import Bill
+
+    Bill.objects.all().delete()
+    latencies, errors = [], []
+    stop = threading.Event()
+    reader = threading.Thread(target=read_bills_while, args=(stop, latencies, errors, page_size))
+    timings = {}
+    reader.start()
+    started = time.perf_counter()
+    try:
+        with override_settings(IMPORT_FAST_LOADER=fast), open(path, "rb") as file_obj:
+            result = import_bills(file_obj, timings=timings)
+    finally:
+        seconds = time.perf_counter() - started
+        stop.set()
+        reader.join()
+    return dict(
+        seconds=seconds,
+        insert_seconds=timings.get("insert", 0.0),
+        rows=result.rows_accepted,
+        reads=len(latencies),
+        read_errors=len(errors),
+        read_p50_ms=statistics.median(latencies) * 1000 if latencies else 0.0,
+        read_max_ms=max(latencies) * 1000 if latencies else 0.0,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    generate.add_arguments(parser)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.set_defaults(layouts=["client1"])
+    args = parser.parse_args()
+
+    db_path = setup_django()
+    from django.db import connection
+
+    from main_app.importers import import_clients
+
+    files = generate.generate_files(
+        os.path.join(os.path.dirname(db_path), "files"), args.clients, args.organizations, args.bills,
+        args.layouts[:1], args.invalid_share, args.seed,
+    )
+    with open(files["client_org.xlsx"]["path"], "rb") as file_obj:
+        import_clients(file_obj)
+    bills_path = files["bills_{}.xlsx".format(args.layouts[0])]["path"]
+
+    runs = {"orm": [], "fast": []}
+    for _ in range(args.repeat):
+        for name in runs:
+            runs[name].append(run_import(bills_path, fast=name == "fast", page_size=args.page_size))
+
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA journal_mode")
+        journal_mode = cursor.fetchone()[0]
+    print("bills: {}, repeat: {}, journal mode: {}".format(args.bills, args.repeat, journal_mode))
+    best = {}
+    for name, measurements in runs.items():
+        best[name] = min(measurements, key=lambda run: run["seconds"])
+        run = best[name]
+        print(
+            "{:<5} {:>8.2f} s total, {:>6.2f} s insert, {:>9.0f} rows/s insert | "
+            "reads during import: {} (errors {}), p50 {:.1f} ms, max {:.1f} ms".format(
+                name + ":", run["seconds"], run["insert_seconds"], run["rows"] / run["insert_seconds"],
+                run["reads"], run["read_errors"], run["read_p50_ms"], run["read_max_ms"],
+            )
+        )
+    print("insert stage speedup: ~{:.1f}x".format(best["orm"]["insert_seconds"] / best["fast"]["insert_seconds"]))
+
+
+if __name__ == "__main__":
+    main()
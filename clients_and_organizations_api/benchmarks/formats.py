@@ -0,0 +1,101 @@
+"""
+Бенчмарк чтения файлов со счетами в разных форматах: xlsx (openpyxl, read_only), CSV (pandas.read_csv частями)
+и Parquet (pyarrow, только колонки формата клиента).
+
+Генерирует bills_<формат>.xlsx (см. benchmarks.generate) и записывает те же строки в .csv и .parquet:
+колонки с однородными значениями в Parquet хранятся с типом (числа, даты), остальные - строками.
+Затем --repeat раз читает и проверяет каждый файл (importers.iter_parsed_bills, этапы parse и validate,
+без записи в базу) и выводит лучшее время, строк в секунду и размер файла.
+
+Запуск:
+    python -m benchmarks.formats --bills 100000 --repeat 3
+"""
+import argparse
+import csv
+import os
+from typing import Dict, List
+
+import openpyxl
+import pandas as pd
+
+from benchmarks import generate
+from benchmarks.common import setup_django
+
+
+def read_xlsx_rows(path: str) -> List[tuple]:
+    """
+    Функция для чтения всех строк первого листа xlsx файла (вместе с заголовком)
+    """
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        return list(workbook.worksheets[0].iter_rows(values_only=True))
+    finally:
+        workbook.close()
+
+
+def write_csv(path: str, rows: List[tuple]) -> None:
+    with open(path, "w", encoding="utf-8", newline="") as file_obj:
+        csv.writer(file_obj).writerows(["" if value is None else value for value in row] for row in rows)
+
+
+def write_parquet(path: str, rows: List[tuple]) -> None:
+    frame = pd.DataFrame(rows[1:], columns=list(rows[0]), dtype=object).infer_objects()
+    for column in frame.columns:
+        if frame[column].dtype == object:
+            frame[column] = frame[column].map(lambda value: None if value is None else str(value))
+    frame.to_parquet(path, index=False)
+
+
+def parse_file(path: str) -> Dict[str, float]:
+    """
+    Функция для чтения и валидации файла со счетами с замером этапов parse и validate
+
+    Возвращаемое значение
+    ---------------------
+    Dict[str, float]
+        время этапов и количество строк файла (rows)
+    """
+    from main_app.importers import iter_parsed_bills
+
+    timings = {}
+    with open(path, "rb") as file_obj:
+        rows = sum(chunk.rows for chunk in iter_parsed_bills(file_obj, timings))
+    return dict(timings, rows=rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bills", type=int, default=100000)
+    parser.add_argument("--layout", choices=generate.LAYOUTS, default="client1")
+    parser.add_argument("--invalid-share", type=float, default=0.05)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    db_path = setup_django()
+    from main_app import readers
+
+    out = os.path.join(os.path.dirname(db_path), "files")
+    os.makedirs(out, exist_ok=True)
+    paths = {"xlsx": os.path.join(out, "bills.xlsx")}
+    generate.write_bills_xlsx(paths["xlsx"], args.layout, args.bills, 1000, 5000, args.invalid_share)
+    rows = read_xlsx_rows(paths["xlsx"])
+    paths["csv"] = os.path.join(out, "bills.csv")
+    write_csv(paths["csv"], rows)
+    if readers.parquet_supported():
+        paths["parquet"] = os.path.join(out, "bills.parquet")
+        write_parquet(paths["parquet"], rows)
+    else:
+        print("pyarrow is not installed, parquet is skipped")
+
+    for file_format, path in paths.items():
+        runs = [parse_file(path) for _ in range(args.repeat)]
+        best = min(runs, key=lambda run: run["parse"] + run["validate"])
+        seconds = best["parse"] + best["validate"]
+        print("{:<8} {:>8} rows  {:>8.2f} s  {:>10.0f} rows/s  parse {:.2f} s, validate {:.2f} s  {:>7.1f} MB".format(
+            file_format, best["rows"], seconds, best["rows"] / seconds if seconds else 0,
+            best["parse"], best["validate"], os.path.getsize(path) / (1024 * 1024),
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""
+Генератор синтетических файлов для импорта: client_org.xlsx (листы client и organization)
+и bills_<формат>.xlsx в каждом из встроенных форматов счетов (client1, client2, client3).
+
+Клиенты называются client<n>, организации - org<n> (организация n принадлежит клиенту n % clients).
+Доля --invalid-share строк делается невалидной: у счетов - нечисловой номер или сумма, неполная дата,
+пустая услуга или неизвестная организация; у организаций - неизвестный клиент или пустое имя.
+Файлы пишутся openpyxl в режиме write_only, поэтому память не растет с количеством строк.
+
+Запуск:
+    python -m benchmarks.generate --out /tmp/bench_files --clients 10000 --organizations 50000 --bills 1000000
+"""
+import argparse
+import datetime
+import os
+import random
+from typing import Dict, List, Sequence
+
+from openpyxl import Workbook
+
+# Встроенные форматы счетов (заголовки колонок в порядке BILL_FIELDS)
+LAYOUTS = ("client1", "client2", "client3")
+BILL_DATE_FROM = datetime.datetime(2022, 1, 1)
+SERVICES = ("консультация", "лечение", "стационар", "диагностика", "лаборатория")
+
+
+def layout_header(layout: str) -> List[str]:
+    """
+    Возвращает заголовок файла со счетами в формате layout (колонки в порядке BILL_FIELDS)
+    """
+    from main_app.formats import BILL_FIELDS, BUILTIN_BILL_FORMATS
+
+    columns = {field: column for column, field in BUILTIN_BILL_FORMATS[layout].items()}
+    return [columns[field] for field in BILL_FIELDS]
+
+
+def write_clients_xlsx(
+        path: str,
+        clients: int,
+        organizations: int,
+        invalid_share: float = 0.0,
+        seed: int = 0,
+) -> Dict[str, int]:
+    """
+    Функция для записи файла client_org.xlsx
+
+    Параметры
+    ---------
+    path: str
+        путь к файлу
+    clients: int
+        количество клиентов
+    organizations: int
+        количество организаций
+    invalid_share: float
+        доля невалидных строк листа organization
+    seed: int
+        зерно генератора случайных чисел
+
+    Возвращаемое значение
+    ---------------------
+    Dict[str, int]
+        количество строк и невалидных строк файла
+    """
+    rng = random.Random(seed)
+    workbook = Workbook(write_only=True)
+    client_sheet = workbook.create_sheet("client")
+    client_sheet.append(["name"])
+    for idx in range(clients):
+        client_sheet.append(["client{}".format(idx)])
+
+    invalid = 0
+    organization_sheet = workbook.create_sheet("organization")
+    organization_sheet.append(["client_name", "name", "address"])
+    for idx in range(organizations):
+        row = ["client{}".format(idx % clients), "org{}".format(idx), "г Москва, ул Ленина, д {}".format(idx)]
+        if rng.random() < invalid_share:
+            invalid += 1
+            if rng.random() < 0.5:
+                row[0] = "unknown{}".format(idx)
+            else:
+                row[1] = None
+        organization_sheet.append(row)
+    workbook.save(path)
+    return dict(rows=clients + organizations, invalid_rows=invalid)
+
+
+def make_bill_row(rng: random.Random, number: int, clients: int, organizations: int, invalid: bool) -> list:
+    organization = rng.randrange(organizations)
+    row = [
+        "client{}".format(organization % clients),
+        "org{}".format(organization),
+        number,
+        round(rng.uniform(100, 100000), 2),
+        BILL_DATE_FROM + datetime.timedelta(days=rng.randrange(365)),
+        rng.choice(SERVICES),
+    ]
+    if invalid:
+        kind = rng.randrange(5)
+        if kind == 0:
+            row[2] = "n{}".format(number)
+        elif kind == 1:
+            row[3] = "n/a"
+        elif kind == 2:
+            row[4] = "2022-01"
+        elif kind == 3:
+            row[5] = "-"
+        else:
+            row[1] = "unknown{}".format(number)
+    return row
+
+
+def write_bills_xlsx(
+        path: str,
+        layout: str,
+        bills: int,
+        clients: int,
+        organizations: int,
+        invalid_share: float = 0.0,
+        seed: int = 0,
+        first_number: int = 1,
+) -> Dict[str, int]:
+    """
+    Функция для записи файла со счетами в формате layout
+
+    Параметры
+    ---------
+    path: str
+        путь к файлу
+    layout: str
+        формат файла (один из LAYOUTS)
+    bills: int
+        количество счетов
+    clients: int
+        количество клиентов в client_org.xlsx
+    organizations: int
+        количество организаций в client_org.xlsx
+    invalid_share: float
+        доля невалидных строк
+    seed: int
+        зерно генератора случайных чисел
+    first_number: int
+        номер первого счета (номера идут подряд)
+
+    Возвращаемое значение
+    ---------------------
+    Dict[str, int]
+        количество строк и невалидных строк файла
+    """
+    rng = random.Random(seed)
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("bills")
+    sheet.append(layout_header(layout))
+    invalid = 0
+    for idx in range(bills):
+        is_invalid = rng.random() < invalid_share
+        invalid += is_invalid
+        sheet.append(make_bill_row(rng, first_number + idx, clients, organizations, is_invalid))
+    workbook.save(path)
+    return dict(rows=bills, invalid_rows=invalid)
+
+
+def generate_files(
+        out: str,
+        clients: int,
+        organizations: int,
+        bills: int,
+        layouts: Sequence[str] = LAYOUTS,
+        invalid_share: float = 0.0,
+        seed: int = 0,
+) -> Dict[str, Dict]:
+    """
+    Функция для записи client_org.xlsx и файлов со счетами в папку out.
+    Номера счетов в разных файлах не пересекаются, поэтому все файлы можно импортировать в одну базу.
+
+    Возвращаемое значение
+    ---------------------
+    Dict[str, Dict]
+        {имя файла: {"path": путь, "rows": количество строк, "invalid_rows": количество невалидных строк}}
+    """
+    os.makedirs(out, exist_ok=True)
+    files = {}
+    path = os.path.join(out, "client_org.xlsx")
+    files["client_org.xlsx"] = dict(
+        path=path, **write_clients_xlsx(path, clients, organizations, invalid_share, seed)
+    )
+    for position, layout in enumerate(layouts):
+        name = "bills_{}.xlsx".format(layout)
+        path = os.path.join(out, name)
+        files[name] = dict(
+            path=path,
+            **write_bills_xlsx(
+                path, layout, bills, clients, organizations, invalid_share, seed, first_number=position * bills + 1,
+            )
+        )
+    return files
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--organizations", type=int, default=5000)
+    parser.add_argument("--bills", type=int, default=10000, help="строк в каждом файле со счетами (10k - 1M)")
+    parser.add_argument("--layouts", nargs="+", choices=LAYOUTS, default=list(LAYOUTS))
+    parser.add_argument("--invalid-share", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", required=True)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    import django
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "clients_and_organizations_api.settings")
+    django.setup()
+
+    files = generate_files(
+        args.out, args.clients, args.organizations, args.bills, args.layouts, args.invalid_share, args.seed
+    )
+    for name, info in files.items():
+        print("{}: {} rows, {} invalid -> {}".format(name, info["rows"], info["invalid_rows"], info["path"]))
+
+
+if __name__ == "__main__":
+    main()
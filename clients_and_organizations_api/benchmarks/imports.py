@@ -0,0 +1,157 @@
+"""
+Бенчмарк импорта файлов (то, что выполняет задача импорта после upload_xlsx).
+
+Генерирует client_org.xlsx и файлы со счетами в форматах client1, client2, client3
+(см. benchmarks.generate) или берет готовые из --files-dir, затем импортирует
+клиентов и по очереди каждый файл со счетами во временную базу.
+Для каждого импорта записываются время этапов parse, validate, resolve, score и insert,
+общее время, строк в секунду, пиковый RSS процесса импорта и результат (ImportResult).
+Каждый импорт выполняется в отдельном дочернем процессе, чтобы пиковый RSS не накапливался.
+Результаты сохраняются в JSON (--output) для сравнения между коммитами.
+
+Запуск:
+    python -m benchmarks.imports --bills 100000 --invalid-share 0.05 --output import_results.json
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from dataclasses import asdict
+from typing import Dict
+
+from benchmarks import generate
+from benchmarks.common import setup_django
+
+
+def peak_rss_mb() -> float:
+    """
+    Пиковый RSS текущего процесса в мегабайтах (ru_maxrss - в килобайтах на Linux и в байтах на macOS)
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_import(kind: str, path: str) -> Dict:
+    """
+    Функция для импорта одного файла с замером этапов
+
+    Параметры
+    ---------
+    kind: str
+        тип импорта (ImportJob.KIND_BILLS или ImportJob.KIND_CLIENTS)
+    path: str
+        путь к xlsx файлу
+
+    Возвращаемое значение
+    ---------------------
+    Dict
+        результаты замеров
+    """
+    from main_app.jobs import IMPORTERS
+
+    timings = {}
+    started = time.perf_counter()
+    with open(path, "rb") as file_obj:
+        result = IMPORTERS[kind](file_obj, timings=timings)
+    seconds = time.perf_counter() - started
+    return dict(
+        kind=kind,
+        file=os.path.basename(path),
+        seconds=round(seconds, 4),
+        rows_per_sec=round(result.rows_processed / seconds, 1) if seconds else None,
+        stages={stage: round(value, 4) for stage, value in timings.items()},
+        peak_rss_mb=round(peak_rss_mb(), 1),
+        result=asdict(result),
+    )
+
+
+def _run_import_in_child(queue, kind: str, path: str) -> None:
+    try:
+        queue.put(run_import(kind, path))
+    except BaseException as error:
+        queue.put(dict(kind=kind, file=os.path.basename(path), error=repr(error)))
+        raise
+
+
+def run_isolated(kind: str, path: str) -> Dict:
+    """
+    Функция для запуска run_import в дочернем процессе (fork) с той же базой
+    """
+    from django.db import connections
+
+    connections.close_all()
+    context = multiprocessing.get_context("fork")
+    queue = context.Queue()
+    process = context.Process(target=_run_import_in_child, args=(queue, kind, path))
+    process.start()
+    measurement = queue.get()
+    process.join()
+    return measurement
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    generate.add_arguments(parser)
+    parser.add_argument("--files-dir", help="папка с ранее сгенерированными файлами (по умолчанию - сгенерировать)")
+    parser.add_argument("--output", default="import_results.json")
+    args = parser.parse_args()
+
+    db_path = setup_django()
+    from main_app.models import ImportJob
+
+    files_dir = args.files_dir or os.path.join(os.path.dirname(db_path), "files")
+    started = time.perf_counter()
+    files = generate.generate_files(
+        files_dir, args.clients, args.organizations, args.bills, args.layouts, args.invalid_share, args.seed,
+    ) if args.files_dir is None else {
+        name: dict(path=os.path.join(files_dir, name))
+        for name in ["client_org.xlsx"] + ["bills_{}.xlsx".format(layout) for layout in args.layouts]
+    }
+    generate_seconds = time.perf_counter() - started
+
+    runs = [run_isolated(ImportJob.KIND_CLIENTS, files["client_org.xlsx"]["path"])]
+    for layout in args.layouts:
+        runs.append(run_isolated(ImportJob.KIND_BILLS, files["bills_{}.xlsx".format(layout)]["path"]))
+
+    for run, name in zip(runs, ["client_org.xlsx"] + ["bills_{}.xlsx".format(layout) for layout in args.layouts]):
+        run.update({key: value for key, value in files[name].items() if key != "path"})
+
+    report = dict(
+        revision=git_revision(),
+        created_at=datetime.datetime.now().isoformat(timespec="seconds"),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        parameters=dict(vars(args), generate_seconds=round(generate_seconds, 2)),
+        runs=runs,
+    )
+    with open(args.output, "w", encoding="utf-8") as output:
+        json.dump(report, output, ensure_ascii=False, indent=2)
+
+    for run in runs:
+        if "error" in run:
+            print("{:<20} error: {}".format(run["file"], run["error"]))
+            continue
+        print("{:<20} {:>8} rows  {:>8.2f} s  {:>10.0f} rows/s  peak RSS {:>7.1f} MB  {}".format(
+            run["file"], run["result"]["rows_processed"], run["seconds"], run["rows_per_sec"], run["peak_rss_mb"],
+            ", ".join("{} {:.2f} s".format(stage, value) for stage, value in run["stages"].items()),
+        ))
+    print("results written to {}".format(args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+Бенчмарк обслуживания списков /api/clients/ и /api/bills/ при --concurrency одновременных клиентах:
+WSGI (синхронные представления DRF, пул из --wsgi-threads потоков сервера)
+против ASGI (async-представления main_app.async_views, представления списков в пуле ASYNC_DB_THREADS потоков).
+
+Генерирует файлы (см. benchmarks.generate) и импортирует их, затем каждый клиент в течение --seconds секунд
+запрашивает страницы списков по кругу (первые страницы, страницы по курсору и фильтры по клиенту).
+С --no-cache кеш ответов отключается, и каждый запрос читает базу.
+Приложения вызываются в процессе, без HTTP-сервера: результат показывает разницу между путями обработки
+запроса в Django, а не между серверами. Для измерения с сервером запустите
+uvicorn clients_and_organizations_api.asgi:application и gunicorn clients_and_organizations_api.wsgi
+и нагрузите их внешним инструментом (например, wrk).
+
+Запуск:
+    python -m benchmarks.serving --bills 20000 --concurrency 200 --seconds 10
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Sequence, Tuple
+from urllib.parse import urlsplit
+
+from benchmarks import generate
+from benchmarks.common import setup_django
+
+# Ответ приложения: (статус-код, заголовки, тело)
+AppResponse = Tuple[int, Dict[str, str], bytes]
+
+
+async def asgi_request(
+        application,
+        method: str,
+        url: str,
+        headers: Sequence[Tuple[str, str]] = (),
+        body: bytes = b"",
+) -> AppResponse:
+    """
+    Функция для вызова ASGI-приложения одним HTTP-запросом в текущем цикле событий
+
+    Параметры
+    ---------
+    application
+        ASGI-приложение (например, django.core.asgi.get_asgi_application())
+    method: str
+        HTTP-метод
+    url: str
+        путь с query-строкой
+    headers: Sequence[Tuple[str, str]]
+        заголовки запроса (заголовок host добавляется автоматически)
+    body: bytes
+        тело запроса
+
+    Возвращаемое значение
+    ---------------------
+    AppResponse
+        статус-код, заголовки (имена в нижнем регистре) и тело ответа
+    """
+    parts = urlsplit(url)
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": parts.path,
+        "raw_path": parts.path.encode("ascii"),
+        "query_string": parts.query.encode("ascii"),
+        "root_path": "",
+        "headers": [(b"host", b"testserver"), (b"content-length", str(len(body)).encode("ascii"))] + [
+            (name.lower().encode("ascii"), value.encode("latin1")) for name, value in headers
+        ],
+        "client": ("127.0.0.1", 0),
+        "server": ("testserver", 80),
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    response = {"status": None, "headers": {}, "body": []}
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        # тело уже прочитано, клиент не отключается
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = {name.decode("latin1"): value.decode("latin1") for name, value in message["headers"]}
+        elif message["type"] == "http.response.body":
+            response["body"].append(message.get("body", b""))
+
+    await application(scope, receive, send)
+    return response["status"], response["headers"], b"".join(response["body"])
+
+
+def wsgi_request(application, method: str, url: str, headers: Sequence[Tuple[str, str]] = ()) -> AppResponse:
+    """
+    Функция для вызова WSGI-приложения одним HTTP-запросом (без тела) в текущем потоке
+    """
+    parts = urlsplit(url)
+    environ = {
+        "REQUEST_METHOD": method,
+        "SCRIPT_NAME": "",
+        "PATH_INFO": parts.path,
+        "QUERY_STRING": parts.query,
+        "SERVER_NAME": "testserver",
+        "SERVER_PORT": "80",
+        "SERVER_PROTOCOL": "HTTP/1.1",
+        "HTTP_HOST": "testserver",
+        "REMOTE_ADDR": "127.0.0.1",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": "http",
+        "wsgi.input": io.BytesIO(),
+        "wsgi.errors": io.StringIO(),
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in headers:
+        environ["HTTP_" + name.upper().replace("-", "_")] = value
+    response = {}
+
+    def start_response(status, response_headers, exc_info=None):
+        response["status"] = int(status.split(" ", 1)[0])
+        response["headers"] = {name.lower(): value for name, value in response_headers}
+
+    result = application(environ, start_response)
+    try:
+        body = b"".join(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    return response["status"], response["headers"], body
+
+
+def make_urls(client_names: Sequence[str], page_size: int) -> List[str]:
+    """
+    Функция для составления набора адресов нагрузки: первые страницы списков, фильтры по клиентам
+    и вторые страницы (по курсору из первых)
+    """
+    from django.core.handlers.wsgi import WSGIHandler
+
+    urls = ["/api/clients/?page_size={}".format(page_size), "/api/bills/?page_size={}".format(page_size)]
+    urls += ["/api/bills/?client={}&page_size={}".format(name, page_size) for name in client_names]
+    application = WSGIHandler()
+    for url in list(urls):
+        status, _, body = wsgi_request(application, "GET", url)
+        if status == 200:
+            next_url = json.loads(body)["next"]
+            if next_url:
+                parts = urlsplit(next_url)
+                urls.append("{}?{}".format(parts.path, parts.query))
+    return urls
+
+
+async def run_clients(request, urls: Sequence[str], concurrency: int, seconds: float) -> Dict:
+    """
+    Функция для запуска concurrency клиентов, которые seconds секунд отправляют запросы request(url) по кругу
+
+    Возвращаемое значение
+    ---------------------
+    Dict
+        количество запросов, ошибок, запросов в секунду и задержки (p50, p99, max) в миллисекундах
+    """
+    latencies: List[float] = []
+    errors = 0
+    deadline = time.perf_counter() + seconds
+
+    async def client(offset: int):
+        nonlocal errors
+        idx = offset
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            status, _, _ = await request(urls[idx % len(urls)])
+            latencies.append(time.perf_counter() - started)
+            if status != 200:
+                errors += 1
+            idx += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(offset) for offset in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return dict(
+        requests=len(latencies),
+        errors=errors,
+        rps=len(latencies) / elapsed,
+        p50_ms=statistics.median(latencies) * 1000,
+        p99_ms=latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        max_ms=latencies[-1] * 1000,
+    )
+
+
+async def run_wsgi(urls: Sequence[str], concurrency: int, seconds: float, threads: int) -> Dict:
+    from django.core.handlers.wsgi import WSGIHandler
+
+    application = WSGIHandler()
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="wsgi") as server:
+        async def request(url):
+            return await loop.run_in_executor(server, wsgi_request, application, "GET", url)
+
+        return await run_clients(request, urls, concurrency, seconds)
+
+
+async def run_asgi(urls: Sequence[str], concurrency: int, seconds: float) -> Dict:
+    from django.core.handlers.asgi import ASGIHandler
+
+    application = ASGIHandler()
+
+    async def request(url):
+        return await asgi_request(application, "GET", url)
+
+    return await run_clients(request, urls, concurrency, seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    generate.add_arguments(parser)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--wsgi-threads", type=int, default=32)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--filtered-clients", type=int, default=10)
+    parser.add_argument("--no-cache", action="store_true", help="отключить кеш ответов списков")
+    parser.set_defaults(layouts=["client1"])
+    args = parser.parse_args()
+
+    db_path = setup_django()
+    from django.conf import settings
+
+    from main_app.importers import import_bills, import_clients
+    from main_app.models import Client
+
+    if args.no_cache:
+        settings.CACHES[settings.RESPONSE_CACHE_ALIAS] = {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}
+    files = generate.generate_files(
+        os.path.join(os.path.dirname(db_path), "files"), args.clients, args.organizations, args.bills,
+        args.layouts[:1], args.invalid_share, args.seed,
+    )
+    with open(files["client_org.xlsx"]["path"], "rb") as file_obj:
+        import_clients(file_obj)
+    with open(files["bills_{}.xlsx".format(args.layouts[0])]["path"], "rb") as file_obj:
+        import_bills(file_obj)
+
+    client_names = list(Client.objects.order_by("id").values_list("name", flat=True)[:args.filtered_clients])
+    urls = make_urls(client_names, args.page_size)
+    print("bills: {}, urls: {}, concurrency: {}, seconds: {}, response cache: {}".format(
+        args.bills, len(urls), args.concurrency, args.seconds, "off" if args.no_cache else "on",
+    ))
+    results = {
+        "wsgi": asyncio.run(run_wsgi(urls, args.concurrency, args.seconds, args.wsgi_threads)),
+        "asgi": asyncio.run(run_asgi(urls, args.concurrency, args.seconds)),
+    }
+    for name, run in results.items():
+        print("{:<5} {:>8.0f} req/s | p50 {:>7.1f} ms, p99 {:>7.1f} ms, max {:>7.1f} ms | requests {}, errors {}".format(
+            name + ":", run["rps"], run["p50_ms"], run["p99_ms"], run["max_ms"], run["requests"], run["errors"],
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+"""
+Схема адресов для запросов через ASGI (подключается middleware main_app.middleware.ASGIURLConfMiddleware):
+списки клиентов и счетов и загрузка файлов обслуживаются async-представлениями (main_app.async_views),
+остальные адреса совпадают с ROOT_URLCONF.
+"""
+from django.urls import path, include
+
+from clients_and_organizations_api.urls import urlpatterns as sync_urlpatterns
+from main_app.urls import async_urlpatterns
+
+urlpatterns = [
+    path('api/', include(async_urlpatterns)),
+    *sync_urlpatterns,
+]
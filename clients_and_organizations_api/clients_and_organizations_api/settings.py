@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 import os
+import tempfile
 import uuid
 from pathlib import Path
 
@@ -41,6 +42,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'main_app.middleware.MetricsMiddleware',
+    'main_app.middleware.ASGIURLConfMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -51,6 +54,9 @@ MIDDLEWARE = [
 ]
 
 ROOT_URLCONF = 'clients_and_organizations_api.urls'
+# Схема адресов для запросов через ASGI: списки и загрузка файлов обслуживаются async-представлениями
+# (None - запросы через ASGI обслуживаются схемой ROOT_URLCONF)
+ASGI_URLCONF = 'clients_and_organizations_api.asgi_urls'
 
 TEMPLATES = [
     {
@@ -70,6 +76,12 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'clients_and_organizations_api.wsgi.application'
 
+# Пулы потоков async-представлений (main_app.async_views):
+# ASYNC_DB_THREADS - потоки представлений списков (запросы к базе и кешу ответов),
+# ASYNC_UPLOAD_THREADS - потоки для разбора загруженных файлов и создания задач импорта
+ASYNC_DB_THREADS = int(os.environ.get("ASYNC_DB_THREADS", 8))
+ASYNC_UPLOAD_THREADS = int(os.environ.get("ASYNC_UPLOAD_THREADS", 4))
+
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
@@ -77,8 +89,20 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # импорты пишут в базу из пула воркеров, поэтому ждем освобождения блокировки дольше
+            'timeout': 20,
+        },
+        # тестовая база - файл, а не общая база в памяти: в памяти SQLite блокирует таблицы без ожидания,
+        # и тесты параллельных импортов не воспроизводят поведение рабочей базы
+        'TEST': {
+            'NAME': os.path.join(tempfile.gettempdir(), 'clients_and_organizations_api_test.sqlite3'),
+        },
     }
 }
+# Режим журнала SQLite (main_app.sqlite_loader.configure_connection): в режиме WAL запросы на чтение
+# не ждут транзакций импорта (пустое значение - режим базы не меняется)
+SQLITE_JOURNAL_MODE = os.environ.get("SQLITE_JOURNAL_MODE", "WAL")
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -116,11 +140,84 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# Uploaded files (files of import jobs)
+
+MEDIA_ROOT = BASE_DIR / 'media'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Import jobs
+# IMPORT_JOBS_WORKERS - размер пула потоков, выполняющих импорты загруженных файлов
+# IMPORT_JOBS_EAGER - выполнять импорт сразу в потоке запроса (например, для тестов)
+# IMPORT_BATCH_SIZE - количество записей в одном INSERT/UPDATE запросе при импорте
+
+IMPORT_JOBS_WORKERS = int(os.environ.get("IMPORT_JOBS_WORKERS", 2))
+IMPORT_JOBS_EAGER = bool(int(os.environ.get("IMPORT_JOBS_EAGER", 0)))
+IMPORT_BATCH_SIZE = int(os.environ.get("IMPORT_BATCH_SIZE", 1000))
+# IMPORT_JOB_STALE_SECONDS - задача в состоянии running без сохранения прогресса дольше этого времени
+# считается прерванной (ее можно продолжить командой import_bills/import_clients --resume)
+IMPORT_JOB_STALE_SECONDS = int(os.environ.get("IMPORT_JOB_STALE_SECONDS", 600))
+# Загрузка нескольких файлов (или zip-архива) за один запрос:
+# IMPORT_PARSE_WORKERS - количество процессов, читающих и проверяющих файлы со счетами (0 - по очереди в воркере),
+# IMPORT_UPLOAD_MAX_FILES - максимальное количество файлов в одной загрузке,
+# IMPORT_UPLOAD_MAX_FILE_SIZE - максимальный размер файла в zip-архиве после распаковки (в байтах),
+# IMPORT_UPLOAD_MAX_UNPACKED_SIZE - максимальный размер всех импортируемых файлов zip-архива после распаковки (в байтах)
+IMPORT_PARSE_WORKERS = int(os.environ.get("IMPORT_PARSE_WORKERS", 2))
+IMPORT_UPLOAD_MAX_FILES = int(os.environ.get("IMPORT_UPLOAD_MAX_FILES", 100))
+IMPORT_UPLOAD_MAX_FILE_SIZE = int(os.environ.get("IMPORT_UPLOAD_MAX_FILE_SIZE", 100 * 1024 * 1024))
+IMPORT_UPLOAD_MAX_UNPACKED_SIZE = int(os.environ.get("IMPORT_UPLOAD_MAX_UNPACKED_SIZE", 500 * 1024 * 1024))
+# Быстрый загрузчик SQLite (main_app.sqlite_loader): файл записывается через executemany в одной транзакции,
+# с настройками соединения для массовой записи и отложенным обновлением индексов.
+# IMPORT_SQLITE_CACHE_KB - размер кеша страниц на время загрузки (в килобайтах),
+# IMPORT_DEFER_INDEXES_MAX_ROWS - индексы пересоздаются после загрузки, только если в таблице не больше записей
+IMPORT_FAST_LOADER = bool(int(os.environ.get("IMPORT_FAST_LOADER", 0)))
+IMPORT_SQLITE_CACHE_KB = int(os.environ.get("IMPORT_SQLITE_CACHE_KB", 65536))
+IMPORT_DEFER_INDEXES_MAX_ROWS = int(os.environ.get("IMPORT_DEFER_INDEXES_MAX_ROWS", 100000))
+# Оценщик счетов (main_app.scoring.BillScorer): путь к классу, аргументы конструктора
+# и количество процессов для оценки (0 - оценка в потоке импорта)
+BILL_SCORER = os.environ.get("BILL_SCORER", "main_app.scoring.RandomBillScorer")
+BILL_SCORER_OPTIONS = {"seed": int(os.environ["BILL_SCORER_SEED"])} if os.environ.get("BILL_SCORER_SEED") else {}
+BILL_SCORER_WORKERS = int(os.environ.get("BILL_SCORER_WORKERS", 0))
+# Размер кеша оценок услуг в памяти процесса (0 - без кеша); оценки также сохраняются в таблицу ServiceScore
+BILL_SCORE_CACHE_SIZE = int(os.environ.get("BILL_SCORE_CACHE_SIZE", 100000))
+
+# Запросы дольше SLOW_REQUEST_SECONDS секунд пишутся в лог вместе с SQL-запросами (не задано - лог выключен)
+SLOW_REQUEST_SECONDS = float(os.environ["SLOW_REQUEST_SECONDS"]) if os.environ.get("SLOW_REQUEST_SECONDS") else None
+# Адреса, с которых доступны метрики /metrics
+METRICS_ALLOWED_IPS = os.environ.get("METRICS_ALLOWED_IPS", "127.0.0.1,::1").split(",")
+
+# JSON-ответы API рендерятся через orjson, если он установлен (результат совпадает с JSONRenderer)
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'main_app.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# Кеш ответов списков /api/clients/ и /api/bills/.
+# LocMemCache вытесняет давно не использованные записи (LRU) при превышении MAX_ENTRIES.
+# Кеш локален для процесса, а версия данных в ключе ответа хранится в базе (DataVersion),
+# поэтому импорт в любом процессе делает устаревшими ответы во всех процессах.
+# Общий для процессов бэкенд (например, Redis) задается через RESPONSE_CACHE_BACKEND.
+# RESPONSE_CACHE_TIMEOUT - время жизни ответа в кеше в секундах
+RESPONSE_CACHE_ALIAS = 'responses'
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    RESPONSE_CACHE_ALIAS: {
+        'BACKEND': os.environ.get('RESPONSE_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('RESPONSE_CACHE_LOCATION', 'responses'),
+        'TIMEOUT': int(os.environ.get('RESPONSE_CACHE_TIMEOUT', 300)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 1000)),
+        },
+    },
+}
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -5,6 +5,7 @@ from drf_yasg.views import get_schema_view
 from rest_framework import permissions
 
 from main_app.urls import router as main_router
+from main_app.views import metrics_view
 
 schema_view = get_schema_view(
     openapi.Info(
@@ -25,4 +26,5 @@ urlpatterns = [
     re_path(r'^swagger/$', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     re_path(r'^redoc/$', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
     path('api/', include(main_router.urls)),
+    path('metrics', metrics_view, name='metrics'),
 ]
@@ -1,3 +1,8 @@
 from django.contrib import admin
 
-# Register your models here.
+from main_app.models import BillColumnMapping
+
+
+@admin.register(BillColumnMapping)
+class BillColumnMappingAdmin(admin.ModelAdmin):
+    list_display = ("name", "columns")
@@ -0,0 +1,128 @@
+import datetime
+from typing import Dict, List, Tuple
+
+from django.db.models import Avg, Count, F, Min, Q, Sum
+from django.db.models.functions import TruncMonth
+from rest_framework.exceptions import ParseError
+
+from main_app import utils
+
+# Измерения группировки: {имя в group_by: (поле группировки, {колонка ответа: поле или выражение})}.
+# Клиент и организация группируются по id (по индексам (client_id, date) и (organization_id, date)),
+# а имя выбирается агрегатом Min по группе - так имя не входит в GROUP BY.
+# Имена организаций повторяются у разных клиентов, поэтому в ответе есть и id организации.
+DIMENSIONS = {
+    "client": ("client_id", {"client": Min("client__name")}),
+    "organization": ("organization_id", {"organization_id": F("organization_id"),
+                                         "organization": Min("organization__name")}),
+    "service_class": ("service_class", {"service_class": F("service_class")}),
+    "month": ("month", {"month": F("month")}),
+}
+# Агрегаты каждой группы в порядке колонок ответа (fraud_rate вычисляется по bills_count и high_fraud_bills_count)
+AGGREGATES = ("bills_count", "total_summ", "avg_fraud_score", "high_fraud_bills_count", "fraud_rate")
+
+
+def parse_group_by(value: str) -> Tuple[str, ...]:
+    """
+    Функция для разбора query-параметра group_by: имена измерений из DIMENSIONS через запятую
+
+    Исключения
+    ----------
+    ParseError
+        если параметр пустой, содержит неизвестное или повторяющееся измерение
+    """
+    dimensions = tuple(name.strip() for name in (value or "").split(",") if name.strip())
+    if not dimensions or len(set(dimensions)) != len(dimensions) or not set(dimensions) <= set(DIMENSIONS):
+        raise ParseError("\"group_by\" must be a comma-separated list of: {}".format(", ".join(DIMENSIONS)))
+    return dimensions
+
+
+def parse_date(params, name: str):
+    value = params.get(name)
+    if value is None:
+        return None
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise ParseError("\"{}\" must be a date in YYYY-MM-DD format".format(name))
+
+
+def parse_fraud_score(params, name: str):
+    value = params.get(name)
+    if value is None:
+        return None
+    try:
+        score = float(value)
+    except ValueError:
+        score = None
+    if score is None or not 0.0 <= score <= 1.0:
+        raise ParseError("\"{}\" must be a number from 0 to 1".format(name))
+    return score
+
+
+def filter_bills(queryset, params):
+    """
+    Функция для фильтрации счетов по query-параметрам отчета:
+    date_from и date_to - диапазон дат (включительно),
+    min_fraud_score и max_fraud_score - диапазон fraud_score (включительно)
+    """
+    date_from, date_to = parse_date(params, "date_from"), parse_date(params, "date_to")
+    min_score, max_score = parse_fraud_score(params, "min_fraud_score"), parse_fraud_score(params, "max_fraud_score")
+    if date_from is not None:
+        queryset = queryset.filter(date__gte=date_from)
+    if date_to is not None:
+        queryset = queryset.filter(date__lte=date_to)
+    if min_score is not None:
+        queryset = queryset.filter(fraud_score__gte=min_score)
+    if max_score is not None:
+        queryset = queryset.filter(fraud_score__lte=max_score)
+    return queryset
+
+
+def bill_stats(queryset, dimensions: Tuple[str, ...]) -> Dict:
+    """
+    Функция для расчета агрегатов счетов по группам одним GROUP BY запросом.
+    Ответ колоночный: для каждой колонки - список значений по группам в порядке измерений,
+    поэтому имена колонок не повторяются в каждой строке.
+
+    Параметры
+    ---------
+    queryset: QuerySet
+        отфильтрованные счета
+    dimensions: Tuple[str, ...]
+        измерения группировки (ключи DIMENSIONS)
+
+    Возвращаемое значение
+    ---------------------
+    Dict
+        {"group_by": [измерения], "columns": {колонка: [значения]}}
+    """
+    group_fields = [DIMENSIONS[name][0] for name in dimensions]
+    columns = {key: value for name in dimensions for key, value in DIMENSIONS[name][1].items()}
+    if "month" in dimensions:
+        queryset = queryset.annotate(month=TruncMonth("date"))
+    rows = (
+        queryset.order_by()
+        .values(*group_fields)
+        .annotate(
+            **{"_{}".format(key): value for key, value in columns.items()},
+            bills_count=Count("id"),
+            total_summ=Sum("summ"),
+            avg_fraud_score=Avg("fraud_score"),
+            high_fraud_bills_count=Count("id", filter=Q(fraud_score__gte=utils.FRAUD_SCORE_THRESHOLD)),
+        )
+        .order_by(*group_fields)
+        .values_list(*("_{}".format(key) for key in columns), *AGGREGATES[:-1])
+    )
+
+    keys = list(columns) + list(AGGREGATES[:-1])
+    result: Dict[str, List] = {key: [] for key in keys + [AGGREGATES[-1]]}
+    for row in rows:
+        for key, value in zip(keys, row):
+            if key == "month":
+                value = value.strftime("%Y-%m")
+            elif key == "avg_fraud_score":
+                value = round(value, 4)
+            result[key].append(value)
+        result["fraud_rate"].append(round(row[-1] / row[-4], 4))
+    return dict(group_by=list(dimensions), columns=result)
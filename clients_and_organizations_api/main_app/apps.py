@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class MainAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'main_app'
+
+    def ready(self):
+        # регистрация обработчиков сигналов, сбрасывающих кеш форматов файлов со счетами
+        # и настраивающих соединения SQLite
+        from main_app import formats, sqlite_loader  # noqa: F401
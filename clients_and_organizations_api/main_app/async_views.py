@@ -0,0 +1,144 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import close_old_connections
+from django.dispatch import receiver
+from django.urls import URLPattern
+
+# Пулы потоков async-представлений: {имя пула: настройка с количеством потоков}
+EXECUTOR_DB = "db"
+EXECUTOR_UPLOAD = "upload"
+EXECUTOR_SETTINGS = {
+    EXECUTOR_DB: "ASYNC_DB_THREADS",
+    EXECUTOR_UPLOAD: "ASYNC_UPLOAD_THREADS",
+}
+
+# Адреса роутера, которые обслуживаются async-представлениями (имена как в main_app.urls.router)
+ASYNC_LIST_URL_NAMES = ("client-list", "bill-list")
+ASYNC_UPLOAD_URL_NAMES = ("client-upload_clients_data", "bill-upload_bills_data")
+
+_executors: Dict[str, ThreadPoolExecutor] = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(name: str) -> ThreadPoolExecutor:
+    """
+    Возвращает общий для процесса пул потоков async-представлений, создавая его при первом обращении:
+    EXECUTOR_DB (ASYNC_DB_THREADS потоков) - представления списков (запросы к базе и кешу ответов),
+    EXECUTOR_UPLOAD (ASYNC_UPLOAD_THREADS потоков) - разбор загруженных файлов и создание задач импорта.
+    Отдельный пул для загрузок не дает медленным загрузкам занять потоки, нужные спискам.
+    """
+    with _executors_lock:
+        executor = _executors.get(name)
+        if executor is None:
+            executor = _executors[name] = ThreadPoolExecutor(
+                max_workers=getattr(settings, EXECUTOR_SETTINGS[name]),
+                thread_name_prefix="async-{}".format(name),
+            )
+    return executor
+
+
+def shutdown_executors() -> None:
+    """
+    Функция для остановки пулов потоков async-представлений (например, после изменения настроек)
+    """
+    with _executors_lock:
+        for executor in _executors.values():
+            executor.shutdown()
+        _executors.clear()
+
+
+@receiver(setting_changed)
+def shutdown_executors_on_setting_changed(sender, setting, **kwargs):
+    if setting in EXECUTOR_SETTINGS.values():
+        shutdown_executors()
+
+
+def run_in_thread(func: Callable, executor: str = EXECUTOR_DB) -> Callable:
+    """
+    Обертка синхронной функции для вызова из async-представления: функция выполняется в пуле потоков executor.
+    Соединения с базой потока закрываются по правилам CONN_MAX_AGE до и после вызова,
+    как в начале и в конце синхронного запроса.
+    sync_to_async с thread_sensitive=True здесь не подходит: в Django 3.2 такие вызовы всех запросов
+    выполняются в одном потоке.
+
+    Параметры
+    ---------
+    func: Callable
+        синхронная функция
+    executor: str
+        имя пула потоков (EXECUTOR_DB или EXECUTOR_UPLOAD)
+
+    Возвращаемое значение
+    ---------------------
+    Callable
+        корутинная функция с теми же аргументами
+    """
+    def run(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return sync_to_async(run, thread_sensitive=False, executor=get_executor(executor))
+
+
+def async_list_view(sync_view: Callable) -> Callable:
+    """
+    Функция для построения async-представления списка по представлению роутера sync_view
+    (list вьюсета с CachedListMixin и KeysetPagination: ClientsViewSet, BillsViewSet).
+    sync_view целиком выполняется в пуле потоков EXECUTOR_DB: аутентификация, права доступа, ограничение частоты
+    запросов, выбор формата ответа и обработка ошибок остаются за APIView.dispatch, поэтому ответ совпадает
+    с ответом синхронного представления при любых настройках DRF и вьюсета. Цикл событий не ждет базу
+    и продолжает обслуживать другие запросы, а количество одновременных запросов к базе ограничено ASYNC_DB_THREADS.
+
+    Параметры
+    ---------
+    sync_view: Callable
+        представление роутера DRF (ViewSet.as_view({"get": "list"}))
+
+    Возвращаемое значение
+    ---------------------
+    Callable
+        async-представление
+    """
+    async def view(request, *args, **kwargs):
+        return await run_in_thread(sync_view, EXECUTOR_DB)(request, *args, **kwargs)
+
+    view.csrf_exempt = True
+    return view
+
+
+def async_upload_view(sync_view: Callable) -> Callable:
+    """
+    Функция для построения async-представления загрузки файлов по представлению роутера sync_view (upload_xlsx).
+    Разбор multipart-тела, распаковка архивов, сохранение файлов и создание задач импорта -
+    синхронные операции с диском и базой, поэтому sync_view целиком выполняется в пуле потоков EXECUTOR_UPLOAD,
+    а цикл событий продолжает обслуживать другие запросы.
+    """
+    async def view(request, *args, **kwargs):
+        return await run_in_thread(sync_view, EXECUTOR_UPLOAD)(request, *args, **kwargs)
+
+    view.csrf_exempt = True
+    return view
+
+
+def async_urlpatterns(patterns: List[URLPattern]) -> List[URLPattern]:
+    """
+    Функция для построения схемы адресов ASGI по адресам роутера:
+    списки (ASYNC_LIST_URL_NAMES) и загрузка файлов (ASYNC_UPLOAD_URL_NAMES) заменяются async-представлениями,
+    шаблоны и имена адресов сохраняются
+    """
+    result = []
+    for pattern in patterns:
+        if pattern.name in ASYNC_LIST_URL_NAMES:
+            pattern = URLPattern(pattern.pattern, async_list_view(pattern.callback), name=pattern.name)
+        elif pattern.name in ASYNC_UPLOAD_URL_NAMES:
+            pattern = URLPattern(pattern.pattern, async_upload_view(pattern.callback), name=pattern.name)
+        result.append(pattern)
+    return result
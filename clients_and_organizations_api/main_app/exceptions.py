@@ -0,0 +1,21 @@
+class ImportDataError(Exception):
+    """
+    Базовое исключение ошибок разбора загружаемых файлов
+    """
+
+
+class UnknownBillFormatError(ImportDataError):
+    """
+    Исключение, возникающее, если по заголовку файла со счетами не удалось определить формат клиента
+    """
+
+    def __init__(self, header):
+        self.header = list(header)
+        super().__init__("Unknown bills file format, header: {}".format(self.header))
+
+
+class UnsupportedFileFormatError(ImportDataError):
+    """
+    Исключение, возникающее, если формат загружаемого файла не поддерживается
+    (неизвестное расширение или не установлен пакет для чтения формата)
+    """
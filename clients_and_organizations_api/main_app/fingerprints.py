@@ -0,0 +1,87 @@
+import hashlib
+from typing import IO, Iterable, Optional
+
+import pandas as pd
+
+from main_app.models import ImportBatch, ImportJob
+
+# Разделитель значений строки при вычислении ее хеша (не встречается в данных файлов)
+ROW_VALUES_SEPARATOR = "\x1f"
+# Размер части файла, читаемой за один раз при вычислении хеша содержимого
+FILE_HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def file_hash(file_obj: IO) -> str:
+    """
+    Функция для вычисления sha256 содержимого файла. Файл читается частями, после чтения позиция сбрасывается в начало
+    """
+    digest = hashlib.sha256()
+    file_obj.seek(0)
+    for block in iter(lambda: file_obj.read(FILE_HASH_BLOCK_SIZE), b""):
+        digest.update(block)
+    file_obj.seek(0)
+    return digest.hexdigest()
+
+
+def row_hash(values: Iterable) -> str:
+    """
+    Функция для вычисления хеша строки файла по значениям ее полей (blake2b, 32 шестнадцатеричных символа)
+    """
+    text = ROW_VALUES_SEPARATOR.join(str(value) for value in values)
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def frame_row_hashes(frame: pd.DataFrame) -> pd.Series:
+    """
+    Функция для вычисления хешей всех строк таблицы (row_hash по значениям колонок в их порядке)
+
+    Параметры
+    ---------
+    frame: pd.DataFrame
+        таблица с приведенными типами (например, normalize_bills_frame)
+
+    Возвращаемое значение
+    ---------------------
+    pd.Series
+        хеши строк с тем же индексом
+    """
+    return pd.Series(
+        [row_hash(row) for row in frame.itertuples(index=False, name=None)], index=frame.index, dtype=object
+    )
+
+
+def find_imported_job(kind: str, content_hash: str, on_conflict: str) -> Optional[ImportJob]:
+    """
+    Функция для поиска задачи, которая уже импортировала (или импортирует) файл с тем же отпечатком.
+    Задачи, завершившиеся ошибкой, не учитываются.
+
+    Параметры
+    ---------
+    kind: str
+        тип импорта (ImportJob.KIND_BILLS или ImportJob.KIND_CLIENTS)
+    content_hash: str
+        sha256 содержимого файла (file_hash)
+    on_conflict: str
+        режим обработки конфликтов загрузки
+
+    Возвращаемое значение
+    ---------------------
+    Optional[ImportJob]
+        задача импорта или None, если файл нужно импортировать
+    """
+    batch = (
+        ImportBatch.objects.filter(kind=kind, content_hash=content_hash, on_conflict=on_conflict)
+        .exclude(job__state=ImportJob.STATE_FAILED)
+        .select_related("job")
+        .first()
+    )
+    return batch.job if batch is not None else None
+
+
+def register_batch(job: ImportJob, content_hash: str) -> None:
+    """
+    Функция для сохранения отпечатка файла задачи импорта (заменяет отпечаток задачи, завершившейся ошибкой)
+    """
+    ImportBatch.objects.update_or_create(
+        kind=job.kind, content_hash=content_hash, on_conflict=job.on_conflict, defaults=dict(job=job),
+    )
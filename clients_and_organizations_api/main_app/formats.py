@@ -0,0 +1,174 @@
+import threading
+from typing import NamedTuple, Dict, FrozenSet, Iterable, List, Optional
+
+import pandas as pd
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from main_app.exceptions import UnknownBillFormatError
+from main_app.models import BillColumnMapping
+
+# Поля общей структуры данных о счете
+BILL_FIELDS = ("client_name", "client_org", "number", "summ", "date", "service")
+
+# Встроенные форматы файлов со счетами: {имя формата: {колонка файла: поле счета}}
+BUILTIN_BILL_FORMATS = {
+    "client1": {
+        "client_name": "client_name",
+        "client_org": "client_org",
+        "№": "number",
+        "sum": "summ",
+        "date": "date",
+        "service": "service",
+    },
+    "client2": {
+        "client": "client_name",
+        "organization": "client_org",
+        "bill_number": "number",
+        "total_sum": "summ",
+        "created_date": "date",
+        "service_name": "service",
+    },
+    "client3": {
+        "client_code": "client_name",
+        "client_org_name": "client_org",
+        "number": "number",
+        "total": "summ",
+        "created": "date",
+        "service": "service",
+    },
+}
+
+
+class BillFormat(NamedTuple):
+    """
+    Класс, представляющий формат файла со счетами
+
+    Атрибуты
+    ---------
+    name: str
+        имя формата
+    columns: Dict[str, str]
+        соответствие колонок файла полям общей структуры счета
+    """
+    name: str
+    columns: Dict[str, str]
+
+    @property
+    def signature(self) -> FrozenSet[str]:
+        """
+        Сигнатура заголовка - множество колонок файла, по которому определяется формат
+        """
+        return frozenset(self.columns)
+
+    def normalize(self, frame: pd.DataFrame) -> pd.DataFrame:
+        """
+        Приводит часть файла к общей структуре одним выбором и переименованием колонок
+
+        Параметры
+        ---------
+        frame: pd.DataFrame
+            часть файла со счетами в формате клиента
+
+        Возвращаемое значение
+        ---------------------
+        pd.DataFrame
+            часть файла с колонками из BILL_FIELDS
+        """
+        return frame[list(self.columns)].rename(columns=self.columns)[list(BILL_FIELDS)]
+
+
+class BillFormatRegistry:
+    """
+    Реестр форматов файлов со счетами: встроенные форматы и форматы из таблицы BillColumnMapping.
+    Форматы загружаются из базы один раз и хранятся в памяти, пока реестр не будет сброшен
+    (это происходит автоматически при изменении BillColumnMapping).
+    """
+
+    def __init__(self, builtin_formats: Dict[str, Dict[str, str]]):
+        self._builtin_formats = builtin_formats
+        self._by_signature: Optional[Dict[FrozenSet[str], BillFormat]] = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[FrozenSet[str], BillFormat]:
+        formats = dict(self._builtin_formats)
+        formats.update(BillColumnMapping.objects.values_list("name", "columns"))
+        by_signature = {}
+        for name, columns in formats.items():
+            bill_format = BillFormat(name=name, columns=dict(columns))
+            by_signature[bill_format.signature] = bill_format
+        return by_signature
+
+    def _get(self) -> Dict[FrozenSet[str], BillFormat]:
+        with self._lock:
+            if self._by_signature is None:
+                self._by_signature = self._load()
+            return self._by_signature
+
+    def __getstate__(self):
+        return dict(_builtin_formats=self._builtin_formats, _by_signature=self._by_signature)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def snapshot(self) -> "BillFormatRegistry":
+        """
+        Возвращает копию реестра с уже загруженными форматами, которая не обращается к базе.
+        Копия передается в процессы разбора файлов (pickle).
+        """
+        registry = BillFormatRegistry(self._builtin_formats)
+        registry._by_signature = self._get()
+        return registry
+
+    def formats(self) -> List[BillFormat]:
+        """
+        Возвращает список всех известных форматов
+        """
+        return list(self._get().values())
+
+    def invalidate(self) -> None:
+        """
+        Сбрасывает закешированные форматы, при следующем обращении они будут прочитаны из базы заново
+        """
+        with self._lock:
+            self._by_signature = None
+
+    def detect(self, header: Iterable[str]) -> BillFormat:
+        """
+        Определяет формат файла по заголовку: сначала ищется формат с точно такой же сигнатурой,
+        затем - наиболее специфичный формат, все колонки которого есть в заголовке.
+
+        Параметры
+        ---------
+        header: Iterable[str]
+            список заголовков файла
+
+        Возвращаемое значение
+        ---------------------
+        BillFormat
+            формат файла
+
+        Исключения
+        ----------
+        UnknownBillFormatError
+            если ни один формат не подходит к заголовку
+        """
+        header = list(header)
+        signature = frozenset(header)
+        by_signature = self._get()
+        if signature in by_signature:
+            return by_signature[signature]
+        candidates = [bill_format for bill_format in by_signature.values() if bill_format.signature <= signature]
+        if not candidates:
+            raise UnknownBillFormatError(header)
+        return max(candidates, key=lambda bill_format: len(bill_format.signature))
+
+
+bill_formats = BillFormatRegistry(BUILTIN_BILL_FORMATS)
+
+
+@receiver(post_save, sender=BillColumnMapping)
+@receiver(post_delete, sender=BillColumnMapping)
+def invalidate_bill_formats(**kwargs):
+    bill_formats.invalidate()
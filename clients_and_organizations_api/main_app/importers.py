@@ -0,0 +1,629 @@
+import logging
+import time
+from collections import Counter
+from contextlib import closing, contextmanager, ExitStack
+from dataclasses import astuple, dataclass
+from typing import List, Dict, Callable, Optional, IO, Iterable, Iterator, TypeVar, NamedTuple, Tuple
+
+import pandas as pd
+from django.conf import settings
+
+from main_app import fingerprints, sqlite_loader, utils
+from main_app.formats import BillFormatRegistry, bill_formats
+from main_app.models import Client, Organization, Bill, ImportJob
+from main_app.response_cache import bump_data_version_on_commit
+from main_app.scoring import get_scorer
+from main_app.stats import ClientStatsDelta, ensure_client_stats
+from main_app.utils import UpsertResult
+from main_app.validation import validate_bills_frame, normalize_bills_frame, format_reasons
+
+my_logger = logging.getLogger("my_logger")
+
+
+@dataclass
+class ImportResult:
+    """
+    Класс, представляющий результат (или текущий прогресс) импорта файла
+
+    Атрибуты
+    ---------
+    rows_processed: int
+        количество обработанных строк файла
+    rows_accepted: int
+        количество строк, записанных в базу (добавленных или обновленных)
+    rows_rejected: int
+        количество отброшенных строк (невалидных или без клиента/организации в базе)
+    rows_inserted: int
+        количество добавленных записей
+    rows_updated: int
+        количество обновленных записей
+    rows_skipped: int
+        количество строк, пропущенных из-за конфликта с существующими записями
+    rows_unchanged: int
+        количество строк, которые уже записаны в базу с теми же значениями (не оцениваются и не записываются)
+    """
+    rows_processed: int = 0
+    rows_accepted: int = 0
+    rows_rejected: int = 0
+    rows_inserted: int = 0
+    rows_updated: int = 0
+    rows_skipped: int = 0
+    rows_unchanged: int = 0
+
+    def add(self, processed: int, inserted: int, updated: int = 0, skipped: int = 0, unchanged: int = 0) -> None:
+        self.rows_processed += processed
+        self.rows_accepted += inserted + updated
+        self.rows_rejected += processed - inserted - updated - skipped - unchanged
+        self.rows_inserted += inserted
+        self.rows_updated += updated
+        self.rows_skipped += skipped
+        self.rows_unchanged += unchanged
+
+    def __add__(self, other: "ImportResult") -> "ImportResult":
+        # результат продолженного импорта: прогресс прерванного запуска плюс результат нового
+        return ImportResult(*(a + b for a, b in zip(astuple(self), astuple(other))))
+
+
+ProgressCallback = Callable[[ImportResult], None]
+
+# Суммарное время этапов импорта в секундах: {этап: время}
+StageTimings = Dict[str, float]
+
+# Этапы импорта: чтение файла, валидация, сопоставление с клиентами и организациями в базе,
+# оценка счетов (scoring.get_scorer), запись в базу
+STAGE_PARSE = "parse"
+STAGE_VALIDATE = "validate"
+STAGE_RESOLVE = "resolve"
+STAGE_SCORE = "score"
+STAGE_INSERT = "insert"
+
+T = TypeVar("T")
+
+
+@contextmanager
+def timed_stage(timings: Optional[StageTimings], stage: str) -> Iterator[None]:
+    """
+    Контекстный менеджер, прибавляющий время выполнения блока к timings[stage] (если timings передан)
+    """
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - started
+
+
+def timed_iter(iterable: Iterable[T], timings: Optional[StageTimings], stage: str) -> Iterator[T]:
+    """
+    Генератор, прибавляющий к timings[stage] время получения каждого элемента iterable
+    (для чтения файла частями)
+    """
+    iterator = iter(iterable)
+    while True:
+        with timed_stage(timings, stage):
+            item = next(iterator, None)
+        if item is None:
+            return
+        yield item
+
+
+# Поля счета, обновляемые при повторной загрузке в режиме update
+BILL_UPDATE_FIELDS = (
+    "summ", "date", "service", "fraud_score", "service_class", "service_name", "client", "row_hash",
+)
+
+
+class ParsedBillsChunk(NamedTuple):
+    """
+    Класс, представляющий прочитанную и проверенную часть файла со счетами
+
+    Атрибуты
+    ---------
+    rows: int
+        количество строк части файла
+    frame: pd.DataFrame
+        валидные строки (normalize_bills_frame), индекс - номер строки файла
+    rejected: Dict[int, str]
+        невалидные строки: {номер строки: список невалидных полей}
+    row_hashes: pd.Series
+        хеши валидных строк (fingerprints.frame_row_hashes) с индексом frame
+    """
+    rows: int
+    frame: pd.DataFrame
+    rejected: Dict[int, str]
+    row_hashes: pd.Series
+
+
+def iter_parsed_bills(
+        file_obj: IO,
+        timings: Optional[StageTimings] = None,
+        formats: BillFormatRegistry = bill_formats,
+        chunk_size: int = utils.XLSX_CHUNK_SIZE,
+) -> Iterator[ParsedBillsChunk]:
+    """
+    Генератор для чтения файла со счетами частями с валидацией каждой части целыми колонками.
+    Не обращается к базе, если передан реестр форматов с загруженными форматами (BillFormatRegistry.snapshot),
+    поэтому может выполняться в отдельном процессе.
+
+    Параметры
+    ---------
+    file_obj: IO
+        объект xlsx файла
+    timings: StageTimings, None
+        словарь, в котором накапливается время этапов parse и validate
+    formats: BillFormatRegistry
+        реестр форматов файлов со счетами
+    chunk_size: int
+        количество строк в одной части
+
+    Возвращаемое значение
+    ---------------------
+    Iterator[ParsedBillsChunk]
+        проверенные части файла
+    """
+    for frame in timed_iter(utils.iter_bills_frames(file_obj, chunk_size=chunk_size, formats=formats), timings, STAGE_PARSE):
+        with timed_stage(timings, STAGE_VALIDATE):
+            accepted, reasons = validate_bills_frame(frame)
+            normalized = normalize_bills_frame(frame[accepted])
+            chunk = ParsedBillsChunk(
+                rows=len(frame),
+                frame=normalized,
+                rejected=format_reasons(reasons),
+                row_hashes=fingerprints.frame_row_hashes(normalized),
+            )
+        yield chunk
+
+
+def parse_bills_file(
+        path: str,
+        formats: BillFormatRegistry,
+        chunk_size: int = utils.XLSX_CHUNK_SIZE,
+) -> Tuple[List[ParsedBillsChunk], StageTimings]:
+    """
+    Функция для чтения и валидации всего файла со счетами в пуле процессов (jobs.run_job_group, jobs.run_file_jobs)
+
+    Параметры
+    ---------
+    path: str
+        путь к файлу со счетами
+    formats: BillFormatRegistry
+        реестр форматов с загруженными форматами (BillFormatRegistry.snapshot)
+    chunk_size: int
+        количество строк в одной части
+
+    Возвращаемое значение
+    ---------------------
+    Tuple[List[ParsedBillsChunk], StageTimings]
+        проверенные части файла и время этапов parse и validate
+    """
+    timings = {}
+    with open(path, "rb") as file_obj:
+        return list(iter_parsed_bills(file_obj, timings, formats, chunk_size)), timings
+
+
+def skip_processed_rows(chunk: ParsedBillsChunk, offset: int, skip_rows: int) -> ParsedBillsChunk:
+    """
+    Функция для отбрасывания строк части файла, которые уже обработал прерванный импорт
+    (первые skip_rows строк файла; индекс frame - номер строки файла)
+
+    Параметры
+    ---------
+    chunk: ParsedBillsChunk
+        проверенная часть файла со счетами
+    offset: int
+        количество строк файла до этой части
+    skip_rows: int
+        количество обработанных строк файла
+
+    Возвращаемое значение
+    ---------------------
+    ParsedBillsChunk
+        необработанные строки части (пустая часть, если обработаны все строки)
+    """
+    if skip_rows <= offset:
+        return chunk
+    return ParsedBillsChunk(
+        rows=max(0, offset + chunk.rows - skip_rows),
+        frame=chunk.frame[chunk.frame.index > skip_rows],
+        rejected={idx: fields for idx, fields in chunk.rejected.items() if idx > skip_rows},
+        row_hashes=chunk.row_hashes[chunk.row_hashes.index > skip_rows],
+    )
+
+
+def build_bills(chunk: ParsedBillsChunk, timings: Optional[StageTimings] = None) -> Tuple[List[Bill], int]:
+    """
+    Функция для построения объектов Bill из проверенной части файла со счетами.
+    Клиенты и организации всей части сопоставляются с базой одним набором запросов,
+    счета, которые уже записаны в базу из строки с тем же хешем, отбрасываются (utils.exclude_unchanged),
+    а оценка остальных счетов выполняется сразу для всей части.
+
+    Параметры
+    ---------
+    chunk: ParsedBillsChunk
+        проверенная часть файла со счетами
+    timings: StageTimings, None
+        словарь, в котором накапливается время этапов resolve и score
+
+    Возвращаемое значение
+    ---------------------
+    Tuple[List[Bill], int]
+        список новых и измененных счетов для сохранения в базу и количество неизмененных счетов
+    """
+    for idx, fields in chunk.rejected.items():
+        my_logger.error(f'Строка #{idx} | невалидные поля: {fields}')
+    bills_frame = chunk.frame
+    row_hashes = chunk.row_hashes
+
+    with timed_stage(timings, STAGE_RESOLVE):
+        resolved = utils.resolve_clients_and_organizations(
+            zip(bills_frame["client_name"], bills_frame["client_org"])
+        )
+        bills = []
+        for idx, client_name, client_org, number, summ, date, service in bills_frame.itertuples(name=None):
+            ids = resolved.get((client_name, client_org))
+            if ids is None:
+                my_logger.warning(
+                    f"Строка файла xlsx #{idx} | Организации {client_org} клиента {client_name} нет в базе"
+                )
+                continue
+            client_id, organization_id = ids
+            bills.append(
+                Bill(
+                    number=number,
+                    summ=summ,
+                    date=date,
+                    service=service,
+                    client_id=client_id,
+                    organization_id=organization_id,
+                    row_hash=row_hashes[idx],
+                )
+            )
+        bills, unchanged = utils.exclude_unchanged(Bill, bills, ("number", "organization_id"))
+
+    with timed_stage(timings, STAGE_SCORE):
+        if bills:
+            scores = get_scorer().score([bill.service for bill in bills])
+            for bill, fraud_score, service_class, service_name in zip(
+                    bills, scores.fraud_score.tolist(), scores.service_class.tolist(), scores.service_name.tolist()
+            ):
+                bill.fraud_score = fraud_score
+                bill.service_class = service_class
+                bill.service_name = service_name
+    return bills, unchanged
+
+
+def save_bills(bills: List[Bill], on_conflict: str, batch_size: int, fast: bool = False) -> UpsertResult:
+    """
+    Функция для записи счетов в базу в одной транзакции вместе с обновлением fraud_weight организаций
+    и агрегированных данных клиентов (ClientStats). Транзакция сразу берет блокировку базы на запись
+    (sqlite_loader.write_transaction), поэтому параллельные импорты записывают свои части по очереди.
+    Счета с высоким fraud_score подсчитываются по организациям, и все увеличения применяются одним запросом.
+    Для обновленных счетов учитывается разница между старыми и новыми значениями.
+
+    Параметры
+    ---------
+    bills: List[Bill]
+        счета для записи
+    on_conflict: str
+        поведение при конфликте с существующими счетами (ImportJob.ON_CONFLICT_CHOICES)
+    batch_size: int
+        количество счетов в одном INSERT/UPDATE запросе
+    fast: bool
+        записывать счета и обновлять счетчики через executemany (sqlite_loader)
+
+    Возвращаемое значение
+    ---------------------
+    UpsertResult
+        результат записи счетов
+    """
+    with sqlite_loader.write_transaction():
+        result = utils.upsert_objects(
+            Bill,
+            bills,
+            key_fields=("number", "organization_id"),
+            update_fields=BILL_UPDATE_FIELDS,
+            on_conflict=on_conflict,
+            batch_size=batch_size,
+            fetch_fields=("fraud_score", "summ", "client_id"),
+            fast=fast,
+        )
+        fraud_increments = Counter()
+        stats_delta = ClientStatsDelta()
+        for bill in result.inserted:
+            fraud_increments[bill.organization_id] += bill.fraud_score >= utils.FRAUD_SCORE_THRESHOLD
+            stats_delta.add_bill(bill)
+        for bill in result.updated:
+            previous_score, previous_summ, previous_client_id = result.previous[(bill.number, bill.organization_id)]
+            fraud_increments[bill.organization_id] += (
+                (bill.fraud_score >= utils.FRAUD_SCORE_THRESHOLD) - (previous_score >= utils.FRAUD_SCORE_THRESHOLD)
+            )
+            stats_delta.add_bill(
+                Bill(client_id=previous_client_id, summ=previous_summ, fraud_score=previous_score), sign=-1
+            )
+            stats_delta.add_bill(bill)
+        utils.increment_fraud_weights(fraud_increments, fast=fast)
+        stats_delta.apply(fast=fast)
+        bump_data_version_on_commit()
+    return result
+
+
+def fast_loader_enabled() -> bool:
+    """
+    Возвращает True, если импорт выполняется быстрым загрузчиком SQLite (настройка IMPORT_FAST_LOADER)
+    """
+    return settings.IMPORT_FAST_LOADER and sqlite_loader.is_supported()
+
+
+def write_bills(
+        chunks: Iterable[ParsedBillsChunk],
+        progress: Optional[ProgressCallback] = None,
+        on_conflict: str = ImportJob.ON_CONFLICT_ERROR,
+        batch_size: Optional[int] = None,
+        timings: Optional[StageTimings] = None,
+        skip_rows: int = 0,
+) -> ImportResult:
+    """
+    Функция для записи проверенных частей файла со счетами в базу данных.
+    Каждая часть файла записывается в отдельной транзакции вместе с обновлением fraud_weight,
+    поэтому блокировка базы на запись не держится на всё время импорта.
+    Поэтому импорт, прерванный ошибкой (например, IntegrityError при конфликте в режиме error), частичный:
+    записанные части остаются в базе вместе с их fraud_weight и ClientStats, а прогресс задачи указывает
+    на последнюю записанную часть. Импорт продолжается повторной загрузкой того же файла (записанные строки
+    учитываются как неизмененные) или командой import_bills --resume (записанные строки пропускаются).
+    Если включен быстрый загрузчик (fast_loader_enabled), весь файл записывается в одной транзакции
+    через executemany с отложенным обновлением индексов (sqlite_loader.bulk_load).
+
+    Параметры
+    ---------
+    chunks: Iterable[ParsedBillsChunk]
+        проверенные части файла (iter_parsed_bills или parse_bills_file)
+    progress: ProgressCallback, None
+        функция, вызываемая после записи каждой части с текущим результатом импорта
+    on_conflict: str
+        поведение при конфликте с существующими счетами (ImportJob.ON_CONFLICT_CHOICES)
+    batch_size: int, None
+        количество записей в одном запросе, по умолчанию - настройка IMPORT_BATCH_SIZE
+    timings: StageTimings, None
+        словарь, в котором накапливается время этапов resolve, score и insert
+    skip_rows: int
+        количество первых строк файла, уже записанных прерванным импортом (не учитываются в результате)
+
+    Возвращаемое значение
+    ---------------------
+    ImportResult
+        итоговый результат импорта
+    """
+    batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+    fast = fast_loader_enabled()
+    result = ImportResult()
+    with ExitStack() as loader:
+        if fast:
+            loader.enter_context(sqlite_loader.bulk_load([Bill]))
+        offset = 0
+        for chunk in chunks:
+            chunk, offset = skip_processed_rows(chunk, offset, skip_rows), offset + chunk.rows
+            if not chunk.rows:
+                continue
+            bills, unchanged = build_bills(chunk, timings=timings)
+            with timed_stage(timings, STAGE_INSERT):
+                saved = save_bills(bills, on_conflict=on_conflict, batch_size=batch_size, fast=fast)
+            result.add(
+                processed=chunk.rows,
+                inserted=len(saved.inserted),
+                updated=len(saved.updated),
+                skipped=saved.skipped,
+                unchanged=unchanged,
+            )
+            if progress is not None:
+                progress(result)
+        # фиксация транзакции быстрой загрузки и пересоздание индексов относятся к этапу insert
+        with timed_stage(timings, STAGE_INSERT):
+            loader.close()
+    return result
+
+
+def import_bills(
+        file_obj: IO,
+        progress: Optional[ProgressCallback] = None,
+        on_conflict: str = ImportJob.ON_CONFLICT_ERROR,
+        batch_size: Optional[int] = None,
+        timings: Optional[StageTimings] = None,
+        chunk_size: int = utils.XLSX_CHUNK_SIZE,
+        skip_rows: int = 0,
+) -> ImportResult:
+    """
+    Функция для импорта счетов из файла в базу данных: файл читается и проверяется частями
+    (iter_parsed_bills), и каждая часть сразу записывается (write_bills)
+
+    Параметры
+    ---------
+    file_obj: IO
+        объект xlsx файла
+    progress: ProgressCallback, None
+        функция, вызываемая после записи каждой части с текущим результатом импорта
+    on_conflict: str
+        поведение при конфликте с существующими счетами (ImportJob.ON_CONFLICT_CHOICES)
+    batch_size: int, None
+        количество записей в одном запросе, по умолчанию - настройка IMPORT_BATCH_SIZE
+    timings: StageTimings, None
+        словарь, в котором накапливается время этапов импорта (STAGE_PARSE, STAGE_VALIDATE, ...)
+    chunk_size: int
+        количество строк в одной части (одной транзакции записи)
+    skip_rows: int
+        количество первых строк файла, уже записанных прерванным импортом
+
+    Возвращаемое значение
+    ---------------------
+    ImportResult
+        итоговый результат импорта
+    """
+    # при ошибке чтение файла останавливается до закрытия файла
+    with closing(iter_parsed_bills(file_obj, timings, chunk_size=chunk_size)) as chunks:
+        return write_bills(
+            chunks,
+            progress=progress,
+            on_conflict=on_conflict,
+            batch_size=batch_size,
+            timings=timings,
+            skip_rows=skip_rows,
+        )
+
+
+def build_organizations(organizations_chunk: List[Dict], offset: int = 0) -> List[Organization]:
+    """
+    Функция для построения объектов Organization из части листа organization.
+    Клиенты, упомянутые в части, сопоставляются с базой одним набором запросов,
+    после чего каждая строка находит id своего клиента в словаре (hash join),
+    поэтому время работы линейно зависит от размера файла, а не от размера базы.
+
+    Параметры
+    ---------
+    organizations_chunk: List[Dict]
+        часть списка словарей с данными организаций
+    offset: int
+        количество строк файла, обработанных до этой части (для сообщений в логе)
+
+    Возвращаемое значение
+    ---------------------
+    List[Organization]
+        список организаций для сохранения в базу
+    """
+    client_ids = utils.resolve_clients(row.get("client_name") for row in organizations_chunk)
+    organizations = []
+    for idx, row in enumerate(organizations_chunk, start=offset + 1):
+        client_name, name = row.get("client_name"), row.get("name")
+        client_id = client_ids.get(client_name)
+        if client_id is None or name is None:
+            my_logger.warning(f"Строка листа organization #{idx} | Клиента {client_name} нет в базе или пустое имя")
+            continue
+        address = utils.prepare_address(row.get("address")) or ""
+        organizations.append(
+            Organization(
+                name=name,
+                address=address,
+                client_id=client_id,
+                row_hash=fingerprints.row_hash((client_name, name, address)),
+            )
+        )
+    return organizations
+
+
+def import_clients(
+        file_obj: IO,
+        progress: Optional[ProgressCallback] = None,
+        on_conflict: str = ImportJob.ON_CONFLICT_ERROR,
+        batch_size: Optional[int] = None,
+        timings: Optional[StageTimings] = None,
+        chunk_size: int = utils.XLSX_CHUNK_SIZE,
+        skip_rows: int = 0,
+) -> ImportResult:
+    """
+    Функция для импорта клиентов и их организаций из файла в базу данных.
+    Уже существующие клиенты и организации, записанные из строки с тем же хешем (utils.exclude_unchanged),
+    считаются неизмененными и не записываются.
+    Если включен быстрый загрузчик (fast_loader_enabled), весь файл записывается в одной транзакции
+    (sqlite_loader.bulk_load).
+
+    Параметры
+    ---------
+    file_obj: IO
+        объект xlsx файла
+    progress: ProgressCallback, None
+        функция, вызываемая после записи каждой части с текущим результатом импорта
+    on_conflict: str
+        поведение при конфликте с существующими клиентами и организациями (ImportJob.ON_CONFLICT_CHOICES)
+    batch_size: int, None
+        количество записей в одном запросе, по умолчанию - настройка IMPORT_BATCH_SIZE
+    timings: StageTimings, None
+        словарь, в котором накапливается время этапов импорта (у клиентов нет этапа валидации)
+    chunk_size: int
+        количество строк в одной части (одной транзакции записи)
+    skip_rows: int
+        количество первых строк файла (сначала клиенты, затем организации), уже записанных прерванным импортом
+
+    Возвращаемое значение
+    ---------------------
+    ImportResult
+        итоговый результат импорта
+    """
+    batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+    fast = fast_loader_enabled()
+    result = ImportResult()
+    with ExitStack() as loader:
+        if fast:
+            loader.enter_context(sqlite_loader.bulk_load([Client, Organization]))
+        # при ошибке чтение файла останавливается до закрытия файла
+        clients_chunks = loader.enter_context(
+            closing(timed_iter(utils.iter_clients_chunks(file_obj, chunk_size), timings, STAGE_PARSE))
+        )
+        offset = 0
+        for clients_chunk in clients_chunks:
+            clients_chunk, offset = clients_chunk[max(0, skip_rows - offset):], offset + len(clients_chunk)
+            if not clients_chunk:
+                continue
+            with timed_stage(timings, STAGE_RESOLVE):
+                # строка листа client содержит только имя клиента, поэтому существующий клиент не изменился
+                existing = utils.resolve_clients(clients_chunk)
+                clients = [Client(name=client_name) for client_name in clients_chunk if client_name not in existing]
+            with timed_stage(timings, STAGE_INSERT), sqlite_loader.write_transaction():
+                saved = utils.upsert_objects(
+                    Client,
+                    clients,
+                    key_fields=("name",),
+                    on_conflict=on_conflict,
+                    batch_size=batch_size,
+                    fast=fast,
+                )
+                ensure_client_stats(utils.resolve_clients(client.name for client in saved.inserted).values())
+                bump_data_version_on_commit()
+            result.add(
+                processed=len(clients_chunk),
+                inserted=len(saved.inserted),
+                skipped=saved.skipped,
+                unchanged=len(clients_chunk) - len(clients),
+            )
+            if progress is not None:
+                progress(result)
+        organizations_offset = 0
+        organizations_chunks = loader.enter_context(
+            closing(timed_iter(utils.iter_organizations_chunks(file_obj, chunk_size), timings, STAGE_PARSE))
+        )
+        for organizations_chunk in organizations_chunks:
+            skipped = min(len(organizations_chunk), max(0, skip_rows - offset))
+            offset += len(organizations_chunk)
+            organizations_offset += skipped
+            organizations_chunk = organizations_chunk[skipped:]
+            if not organizations_chunk:
+                continue
+            with timed_stage(timings, STAGE_RESOLVE):
+                organizations = build_organizations(organizations_chunk, offset=organizations_offset)
+                organizations, unchanged = utils.exclude_unchanged(Organization, organizations, ("name", "client_id"))
+            organizations_offset += len(organizations_chunk)
+            with timed_stage(timings, STAGE_INSERT), sqlite_loader.write_transaction():
+                saved = utils.upsert_objects(
+                    Organization,
+                    organizations,
+                    key_fields=("name", "client_id"),
+                    update_fields=("address", "row_hash"),
+                    on_conflict=on_conflict,
+                    batch_size=batch_size,
+                    fast=fast,
+                )
+                stats_delta = ClientStatsDelta()
+                stats_delta.add_organizations(saved.inserted)
+                stats_delta.apply(fast=fast)
+                bump_data_version_on_commit()
+            result.add(
+                processed=len(organizations_chunk),
+                inserted=len(saved.inserted),
+                updated=len(saved.updated),
+                skipped=saved.skipped,
+                unchanged=unchanged,
+            )
+            if progress is not None:
+                progress(result)
+        with timed_stage(timings, STAGE_INSERT):
+            loader.close()
+    return result
@@ -0,0 +1,497 @@
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict
+from datetime import timedelta
+from multiprocessing import get_context
+from typing import Callable, Dict, Iterator, Optional, Sequence, Tuple
+
+import django
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connection
+from django.db.models import Q
+from django.dispatch import receiver
+from django.utils import timezone
+
+from main_app import fingerprints, importers, metrics, utils
+from main_app.formats import bill_formats
+from main_app.importers import ImportResult, ProgressCallback, StageTimings
+from main_app.models import ImportBatch, ImportJob
+from main_app.scoring import get_scorer
+
+my_logger = logging.getLogger("my_logger")
+
+IMPORTERS = {
+    ImportJob.KIND_BILLS: importers.import_bills,
+    ImportJob.KIND_CLIENTS: importers.import_clients,
+}
+
+_executor: Optional[ThreadPoolExecutor] = None
+_parse_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+# Функция, вызываемая после записи каждой части файла задачи импорта с накопленным результатом задачи
+JobProgressCallback = Callable[[ImportJob, ImportResult], None]
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    Возвращает общий для процесса пул воркеров импорта, создавая его при первом обращении.
+    Размер пула ограничен настройкой IMPORT_JOBS_WORKERS, чтобы импорты не занимали
+    все потоки сервера и не мешали обработке запросов на чтение.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.IMPORT_JOBS_WORKERS,
+                thread_name_prefix="import-job",
+            )
+    return _executor
+
+
+def enqueue(job: ImportJob) -> None:
+    """
+    Функция для постановки задачи импорта в пул воркеров.
+    Если включена настройка IMPORT_JOBS_EAGER, задача выполняется сразу в текущем потоке.
+
+    Параметры
+    ---------
+    job: ImportJob
+        сохраненная задача импорта
+    """
+    if settings.IMPORT_JOBS_EAGER:
+        run_job(job.id)
+    else:
+        get_executor().submit(_run_in_worker, run_job, job.id)
+
+
+def enqueue_group(jobs: Sequence[ImportJob]) -> None:
+    """
+    Функция для постановки в пул воркеров группы задач из одной загрузки (run_job_group).
+    Если включена настройка IMPORT_JOBS_EAGER, задачи выполняются сразу в текущем потоке.
+
+    Параметры
+    ---------
+    jobs: Sequence[ImportJob]
+        сохраненные задачи импорта
+    """
+    job_ids = [job.id for job in jobs]
+    if settings.IMPORT_JOBS_EAGER:
+        run_job_group(job_ids)
+    else:
+        get_executor().submit(_run_in_worker, run_job_group, job_ids)
+
+
+def _run_in_worker(run: Callable, *args) -> None:
+    try:
+        run(*args)
+    finally:
+        # у каждого потока пула свое соединение с базой, его нужно закрыть после задачи
+        connection.close()
+
+
+def _save_progress(job_id: int, result: ImportResult) -> None:
+    ImportJob.objects.filter(id=job_id).update(heartbeat_at=timezone.now(), **asdict(result))
+
+
+def _claim(job_id: int) -> Optional[ImportJob]:
+    """
+    Захватывает задачу атомарным переводом из состояния pending в running,
+    поэтому одну задачу не выполнят два воркера одновременно. Возвращает None, если задача уже захвачена.
+    """
+    now = timezone.now()
+    claimed = ImportJob.objects.filter(id=job_id, state=ImportJob.STATE_PENDING).update(
+        state=ImportJob.STATE_RUNNING,
+        started_at=now,
+        heartbeat_at=now,
+    )
+    return ImportJob.objects.get(id=job_id) if claimed else None
+
+
+def _execute(job: ImportJob, run: Callable[[ProgressCallback, StageTimings], ImportResult]) -> None:
+    """
+    Выполняет захваченную задачу: run(progress, timings) импортирует файл задачи,
+    результат, ошибка и метрики импорта записываются так же для любого способа импорта
+    """
+    my_logger.info(f"Начат импорт {job}")
+    timings = {}
+    started = time.perf_counter()
+    try:
+        result = run(lambda r: _save_progress(job.id, r), timings)
+    except Exception as e:
+        my_logger.exception(f"Ошибка импорта {job}")
+        ImportJob.objects.filter(id=job.id).update(
+            state=ImportJob.STATE_FAILED,
+            error=str(e),
+            finished_at=timezone.now(),
+        )
+        metrics.observe_import(job.kind, ImportJob.STATE_FAILED, time.perf_counter() - started, timings)
+    else:
+        ImportJob.objects.filter(id=job.id).update(
+            state=ImportJob.STATE_DONE,
+            finished_at=timezone.now(),
+            **asdict(result),
+        )
+        metrics.observe_import(job.kind, ImportJob.STATE_DONE, time.perf_counter() - started, timings, result)
+        stages = ", ".join(f"{stage} {seconds:.2f} s" for stage, seconds in timings.items())
+        my_logger.info(
+            f"Завершен импорт {job}: принято {result.rows_accepted}, отброшено {result.rows_rejected} строк "
+            f"({stages})"
+        )
+        scorer = get_scorer()
+        if job.kind == ImportJob.KIND_BILLS and hasattr(scorer, "hit_ratio"):
+            my_logger.info(f"Доля попаданий в кеш оценок услуг: {scorer.hit_ratio:.1%}")
+
+
+def _import_file(job: ImportJob) -> Callable[[ProgressCallback, StageTimings], ImportResult]:
+    def run(progress, timings):
+        with job.file.open("rb") as file_obj:
+            return IMPORTERS[job.kind](file_obj, progress=progress, on_conflict=job.on_conflict, timings=timings)
+
+    return run
+
+
+def run_job(job_id: int) -> bool:
+    """
+    Функция для выполнения задачи импорта.
+    Задача захватывается атомарным переводом из состояния pending в running,
+    поэтому одну задачу не выполнят два воркера одновременно.
+
+    Параметры
+    ---------
+    job_id: int
+        id задачи импорта
+
+    Возвращаемое значение
+    ---------------------
+    bool
+        True, если задача была захвачена и выполнена этим воркером
+    """
+    job = _claim(job_id)
+    if job is None:
+        return False
+    _execute(job, _import_file(job))
+    return True
+
+
+def get_parse_executor() -> ProcessPoolExecutor:
+    """
+    Возвращает общий для процесса пул процессов (IMPORT_PARSE_WORKERS) для чтения и валидации файлов со счетами.
+    Используется spawn: fork процесса с потоками сервера небезопасен.
+    Процессы пула настраивают Django (django.setup), но к базе не обращаются.
+    """
+    global _parse_executor
+    with _executor_lock:
+        if _parse_executor is None:
+            _parse_executor = create_parse_executor(settings.IMPORT_PARSE_WORKERS)
+    return _parse_executor
+
+
+def create_parse_executor(workers: int) -> ProcessPoolExecutor:
+    """
+    Функция для создания пула из workers процессов для чтения файлов со счетами (см. get_parse_executor)
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"), initializer=django.setup)
+
+
+def shutdown_parse_executor() -> None:
+    """
+    Функция для остановки пула процессов чтения файлов (например, после изменения настроек)
+    """
+    global _parse_executor
+    with _executor_lock:
+        if _parse_executor is not None:
+            _parse_executor.shutdown()
+            _parse_executor = None
+
+
+@receiver(setting_changed)
+def shutdown_parse_executor_on_setting_changed(sender, setting, **kwargs):
+    if setting == "IMPORT_PARSE_WORKERS":
+        shutdown_parse_executor()
+
+
+def _write_parsed_bills(job: ImportJob, parsed: Future, batch_size: Optional[int] = None) -> Callable:
+    def run(progress, timings, skip_rows=0):
+        chunks, parse_timings = parsed.result()
+        for stage, seconds in parse_timings.items():
+            timings[stage] = timings.get(stage, 0.0) + seconds
+        return importers.write_bills(
+            chunks,
+            progress=progress,
+            on_conflict=job.on_conflict,
+            batch_size=batch_size,
+            timings=timings,
+            skip_rows=skip_rows,
+        )
+
+    return run
+
+
+def _iter_parsed_files(
+        jobs: Sequence[ImportJob],
+        paths: Callable[[ImportJob], str],
+        window: int,
+        get_pool: Callable[[], ProcessPoolExecutor],
+        reset_pool: Callable[[], None],
+        chunk_size: int = utils.XLSX_CHUNK_SIZE,
+) -> Iterator[Tuple[ImportJob, Future]]:
+    """
+    Генератор, читающий и проверяющий файлы со счетами задач в пуле процессов (importers.parse_bills_file)
+    и возвращающий задачи по мере готовности их файлов. В пуле одновременно находится не больше window файлов.
+    Если процесс пула аварийно завершился (например, из-за нехватки памяти), ошибку BrokenProcessPool получают
+    все файлы, которые были в пуле: пул создается заново один раз, а эти файлы читаются повторно по одному,
+    чтобы файл, из-за которого завершился процесс, не приводил к ошибке соседних файлов.
+    Файл, на котором пул аварийно завершился и при повторном чтении, возвращается с ошибкой.
+    """
+    formats = bill_formats.snapshot()
+    queued = iter(jobs)
+    retries = deque()
+    retried = set()
+    pending: Dict[Future, Tuple[ImportJob, ProcessPoolExecutor]] = {}
+    executor = get_pool()
+
+    def submit(job):
+        future = executor.submit(importers.parse_bills_file, paths(job), formats, chunk_size)
+        pending[future] = (job, executor)
+
+    while True:
+        if retries:
+            if not pending:
+                submit(retries.popleft())
+        else:
+            for job in itertools.islice(queued, window - len(pending)):
+                submit(job)
+        if not pending:
+            break
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        # готовые файлы обрабатываются в порядке отправки в пул, поэтому повторное чтение идет в том же порядке
+        for future in [future for future in pending if future in done]:
+            job, pool = pending.pop(future)
+            if isinstance(future.exception(), BrokenProcessPool):
+                if pool is executor:
+                    reset_pool()
+                    executor = get_pool()
+                if job.id not in retried:
+                    retried.add(job.id)
+                    retries.append(job)
+                    continue
+            yield job, future
+
+
+def run_job_group(job_ids: Sequence[int]) -> int:
+    """
+    Функция для выполнения группы задач импорта из одной загрузки (несколько файлов или zip-архив).
+    Файлы со счетами читаются и проверяются параллельно в пуле процессов (get_parse_executor),
+    а запись в базу выполняет один писатель - текущий поток - по мере готовности файлов,
+    поэтому записи разных файлов не конкурируют за блокировку базы.
+    Одновременно в пуле находится не больше 2 * IMPORT_PARSE_WORKERS файлов,
+    чтобы в памяти не копились прочитанные, но еще не записанные файлы.
+    Если IMPORT_PARSE_WORKERS = 0, а также для файлов клиентов задачи выполняются по очереди (run_job).
+
+    Параметры
+    ---------
+    job_ids: Sequence[int]
+        id задач импорта
+
+    Возвращаемое значение
+    ---------------------
+    int
+        количество задач, выполненных этим воркером
+    """
+    jobs = [job for job in map(_claim, job_ids) if job is not None]
+    parallel = [job for job in jobs if job.kind == ImportJob.KIND_BILLS] if settings.IMPORT_PARSE_WORKERS > 0 else []
+    if parallel:
+        parsed_files = _iter_parsed_files(
+            parallel,
+            paths=lambda job: job.file.path,
+            window=2 * settings.IMPORT_PARSE_WORKERS,
+            get_pool=get_parse_executor,
+            reset_pool=shutdown_parse_executor,
+        )
+        for job, parsed in parsed_files:
+            _execute(job, _write_parsed_bills(job, parsed))
+    for job in jobs:
+        if job not in parallel:
+            _execute(job, _import_file(job))
+    return len(jobs)
+
+
+def enqueue_pending_jobs() -> int:
+    """
+    Функция для постановки в пул всех задач, ожидающих выполнения (например, после перезапуска сервера)
+
+    Возвращаемое значение
+    ---------------------
+    int
+        количество поставленных задач
+    """
+    jobs = list(ImportJob.objects.filter(state=ImportJob.STATE_PENDING).order_by("id"))
+    for job in jobs:
+        enqueue(job)
+    return len(jobs)
+
+
+def open_file_job(kind: str, path: str, on_conflict: str, resume: bool = False) -> Tuple[ImportJob, bool]:
+    """
+    Функция для создания задачи импорта файла на диске (команды import_bills и import_clients).
+    Файл не копируется в MEDIA_ROOT: у задачи пустое поле file, а file_name - абсолютный путь к файлу.
+    Если файл с тем же содержимым уже импортирован (fingerprints.register_batch) или импортируется сейчас
+    (задача в очереди или выполняется и сохраняла прогресс не раньше IMPORT_JOB_STALE_SECONDS назад),
+    новая задача не создается, чтобы два процесса не записывали один файл.
+    С resume задача того же файла, завершившаяся ошибкой или прерванная (running без сохранения прогресса
+    дольше IMPORT_JOB_STALE_SECONDS), продолжается: ее счетчики строк - прогресс, сохраненный после последней
+    записанной части (run_file_jobs). Задача захватывается условным UPDATE по ожидаемому состоянию,
+    поэтому ее не продолжат два процесса одновременно.
+
+    Параметры
+    ---------
+    kind: str
+        тип импорта (ImportJob.KIND_BILLS или ImportJob.KIND_CLIENTS)
+    path: str
+        путь к файлу
+    on_conflict: str
+        поведение при конфликте с существующими записями (ImportJob.ON_CONFLICT_CHOICES)
+    resume: bool
+        продолжить незавершенную задачу того же файла
+
+    Возвращаемое значение
+    ---------------------
+    Tuple[ImportJob, bool]
+        задача импорта и False, если файл уже импортирован или импортируется этой задачей
+    """
+    with open(path, "rb") as file_obj:
+        content_hash = fingerprints.file_hash(file_obj)
+    batch = (
+        ImportBatch.objects.filter(kind=kind, content_hash=content_hash, on_conflict=on_conflict)
+        .select_related("job")
+        .first()
+    )
+    now = timezone.now()
+    if batch is not None:
+        job = batch.job
+        stale = Q(state=ImportJob.STATE_FAILED) | Q(
+            state=ImportJob.STATE_RUNNING, heartbeat_at__lt=now - timedelta(seconds=settings.IMPORT_JOB_STALE_SECONDS),
+        )
+        if not ImportJob.objects.filter(stale, id=job.id).exists():
+            return job, False
+        if resume:
+            claimed = ImportJob.objects.filter(stale, id=job.id, state=job.state).update(
+                state=ImportJob.STATE_RUNNING, error="", finished_at=None, heartbeat_at=now,
+            )
+            job.refresh_from_db()
+            return job, bool(claimed)
+    job = ImportJob.objects.create(
+        kind=kind,
+        file_name=os.path.abspath(path),
+        on_conflict=on_conflict,
+        state=ImportJob.STATE_RUNNING,
+        started_at=now,
+        heartbeat_at=now,
+    )
+    fingerprints.register_batch(job, content_hash)
+    return job, True
+
+
+def _resumed(
+        job: ImportJob,
+        run: Callable[[ProgressCallback, StageTimings, int], ImportResult],
+        report: Optional[JobProgressCallback],
+) -> Callable[[ProgressCallback, StageTimings], ImportResult]:
+    """
+    Продолжает задачу с сохраненного прогресса: run(progress, timings, skip_rows) пропускает уже обработанные строки,
+    а к его результату прибавляются счетчики задачи
+    """
+    previous = ImportResult(**{field: getattr(job, field) for field in asdict(ImportResult())})
+
+    def run_resumed(progress, timings):
+        def on_progress(result):
+            progress(previous + result)
+            if report is not None:
+                report(job, previous + result)
+
+        return previous + run(on_progress, timings, previous.rows_processed)
+
+    return run_resumed
+
+
+def _import_path(job: ImportJob, batch_size: Optional[int], chunk_size: int) -> Callable:
+    def run(progress, timings, skip_rows):
+        with open(job.file_name, "rb") as file_obj:
+            return IMPORTERS[job.kind](
+                file_obj,
+                progress=progress,
+                on_conflict=job.on_conflict,
+                batch_size=batch_size,
+                timings=timings,
+                chunk_size=chunk_size,
+                skip_rows=skip_rows,
+            )
+
+    return run
+
+
+def run_file_jobs(
+        jobs: Sequence[ImportJob],
+        workers: int,
+        batch_size: Optional[int] = None,
+        chunk_size: int = utils.XLSX_CHUNK_SIZE,
+        report: Optional[JobProgressCallback] = None,
+) -> None:
+    """
+    Функция для выполнения задач импорта файлов на диске (open_file_job) в текущем процессе.
+    Как и в run_job_group, файлы со счетами читаются и проверяются в пуле из workers процессов,
+    а записывает их текущий поток. Каждая часть файла (chunk_size строк) записывается в отдельной транзакции,
+    после чего прогресс задачи сохраняется, поэтому прерванный импорт продолжается с последней записанной части.
+    Продолженная задача пропускает уже обработанные строки файла (importers.write_bills, skip_rows).
+    Если workers = 0, а также для файлов клиентов файлы читаются потоково по очереди.
+
+    Параметры
+    ---------
+    jobs: Sequence[ImportJob]
+        задачи импорта в состоянии running
+    workers: int
+        количество процессов, читающих файлы со счетами
+    batch_size: int, None
+        количество записей в одном запросе, по умолчанию - настройка IMPORT_BATCH_SIZE
+    chunk_size: int
+        количество строк в одной части файла
+    report: JobProgressCallback, None
+        функция, вызываемая после записи каждой части с накопленным результатом задачи
+    """
+    parallel = [job for job in jobs if job.kind == ImportJob.KIND_BILLS] if workers > 0 else []
+    if parallel:
+        pools = []
+
+        def get_pool():
+            if not pools:
+                pools.append(create_parse_executor(workers))
+            return pools[0]
+
+        def reset_pool():
+            pools.pop().shutdown()
+
+        try:
+            parsed_files = _iter_parsed_files(
+                parallel,
+                paths=lambda job: job.file_name,
+                window=2 * workers,
+                get_pool=get_pool,
+                reset_pool=reset_pool,
+                chunk_size=chunk_size,
+            )
+            for job, parsed in parsed_files:
+                _execute(job, _resumed(job, _write_parsed_bills(job, parsed, batch_size), report))
+        finally:
+            if pools:
+                reset_pool()
+    for job in jobs:
+        if job not in parallel:
+            _execute(job, _resumed(job, _import_path(job, batch_size, chunk_size), report))
@@ -0,0 +1,111 @@
+import os
+import time
+from typing import Dict, List
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from main_app import jobs, readers, utils
+from main_app.importers import ImportResult
+from main_app.models import ImportJob
+
+
+class ImportFilesCommand(BaseCommand):
+    """
+    Базовый класс команд импорта файлов с диска (import_bills, import_clients) для первоначальной загрузки
+    больших объемов данных без веб-сервера. Каждый файл импортируется отдельной задачей ImportJob
+    (jobs.open_file_job, jobs.run_file_jobs), после каждой записанной части выводится прогресс.
+    """
+    kind: str = ""
+    # читать файлы в пуле процессов (параметр --workers)
+    parallel: bool = False
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", help="Files or directories with files to import")
+        if self.parallel:
+            parser.add_argument(
+                "--workers", type=int, default=settings.IMPORT_PARSE_WORKERS,
+                help="Number of processes parsing files (0 - parse files one by one while writing)",
+            )
+        parser.add_argument(
+            "--on-conflict", choices=[value for value, _ in ImportJob.ON_CONFLICT_CHOICES],
+            default=ImportJob.ON_CONFLICT_ERROR, help="How to handle rows that already exist",
+        )
+        parser.add_argument("--batch-size", type=int, default=None, help="Rows per INSERT/UPDATE query")
+        parser.add_argument(
+            "--chunk-size", type=int, default=utils.XLSX_CHUNK_SIZE, help="Rows committed in one transaction",
+        )
+        parser.add_argument(
+            "--resume", action="store_true", help="Continue interrupted imports from the last committed chunk",
+        )
+
+    def handle(self, *args, **options):
+        paths = self._collect_paths(options["paths"])
+        file_jobs: List[ImportJob] = []
+        for path in paths:
+            job, started = jobs.open_file_job(self.kind, path, options["on_conflict"], resume=options["resume"])
+            if not started and job.state == ImportJob.STATE_DONE:
+                self.stdout.write(f"{path}: already imported by job #{job.id}, skipped")
+                continue
+            if not started:
+                self.stderr.write(f"{path}: is being imported by job #{job.id} ({job.state}), skipped")
+                continue
+            if job.rows_processed:
+                self.stdout.write(f"{path}: resuming job #{job.id} after {job.rows_processed} rows")
+            file_jobs.append(job)
+
+        self._started = time.perf_counter()
+        self._resumed_rows = {job.id: job.rows_processed for job in file_jobs}
+        self._processed: Dict[int, int] = dict(self._resumed_rows)
+        jobs.run_file_jobs(
+            file_jobs,
+            workers=options["workers"] if self.parallel else 0,
+            batch_size=options["batch_size"],
+            chunk_size=options["chunk_size"],
+            report=self._report,
+        )
+
+        failed = 0
+        for job in ImportJob.objects.filter(id__in=[job.id for job in file_jobs]).order_by("id"):
+            if job.state == ImportJob.STATE_DONE:
+                self.stdout.write(self.style.SUCCESS(
+                    f"{job.file_name}: processed {job.rows_processed}, accepted {job.rows_accepted}, "
+                    f"rejected {job.rows_rejected}, unchanged {job.rows_unchanged}, skipped {job.rows_skipped} rows"
+                ))
+            else:
+                failed += 1
+                self.stderr.write(f"{job.file_name}: failed after {job.rows_processed} rows: {job.error}")
+        if failed:
+            raise CommandError(f"{failed} of {len(file_jobs)} files failed, rerun with --resume to continue")
+        self.stdout.write(self.style.SUCCESS(f"Imported {len(file_jobs)} files in {self._elapsed():.1f} s"))
+
+    @staticmethod
+    def _collect_paths(paths: List[str]) -> List[str]:
+        """
+        Возвращает пути к импортируемым файлам: файлы каталога выбираются по расширению (readers.supported_extensions)
+        """
+        extensions = tuple(readers.supported_extensions())
+        collected = []
+        for path in paths:
+            if os.path.isdir(path):
+                collected.extend(
+                    os.path.join(path, name) for name in sorted(os.listdir(path)) if name.lower().endswith(extensions)
+                )
+            elif os.path.isfile(path):
+                collected.append(path)
+            else:
+                raise CommandError(f"File not found: {path}")
+        return collected
+
+    def _elapsed(self) -> float:
+        return time.perf_counter() - self._started
+
+    def _report(self, job: ImportJob, result: ImportResult) -> None:
+        # скорость считается по строкам, обработанным этим запуском команды во всех файлах
+        self._processed[job.id] = result.rows_processed
+        rows = sum(self._processed.values()) - sum(self._resumed_rows.values())
+        elapsed = self._elapsed()
+        self.stdout.write(
+            f"{os.path.basename(job.file_name)}: {result.rows_processed} rows, {result.rows_rejected} rejected | "
+            f"{rows / elapsed if elapsed else 0:.0f} rows/s"
+        )
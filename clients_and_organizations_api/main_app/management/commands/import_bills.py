@@ -0,0 +1,12 @@
+from main_app.management.commands._import_files import ImportFilesCommand
+from main_app.models import ImportJob
+
+
+class Command(ImportFilesCommand):
+    """
+    Команда для импорта файлов со счетами с диска (xlsx, CSV, Parquet).
+    Файлы читаются и проверяются в пуле процессов (--workers), а записываются частями по --chunk-size строк.
+    """
+    help = "Import bills files from disk"
+    kind = ImportJob.KIND_BILLS
+    parallel = True
@@ -0,0 +1,11 @@
+from main_app.management.commands._import_files import ImportFilesCommand
+from main_app.models import ImportJob
+
+
+class Command(ImportFilesCommand):
+    """
+    Команда для импорта файлов с клиентами и организациями с диска (xlsx, CSV, Parquet).
+    Файлы импортируются по очереди: организации сопоставляются с клиентами, уже записанными в базу.
+    """
+    help = "Import clients and organizations files from disk"
+    kind = ImportJob.KIND_CLIENTS
@@ -0,0 +1,36 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from main_app import jobs
+from main_app.models import ImportJob
+
+
+class Command(BaseCommand):
+    """
+    Команда для выполнения задач импорта, ожидающих в очереди (таблице ImportJob).
+    Позволяет обрабатывать очередь отдельным процессом, без веб-сервера.
+    """
+    help = "Process pending import jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=1, help="Number of worker threads")
+
+    def handle(self, *args, **options):
+        job_ids = list(
+            ImportJob.objects.filter(state=ImportJob.STATE_PENDING).order_by("id").values_list("id", flat=True)
+        )
+        if options["workers"] > 1:
+            with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+                processed = sum(executor.map(self._run_job, job_ids))
+        else:
+            processed = sum(jobs.run_job(job_id) for job_id in job_ids)
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} import jobs"))
+
+    @staticmethod
+    def _run_job(job_id: int) -> bool:
+        try:
+            return jobs.run_job(job_id)
+        finally:
+            connection.close()
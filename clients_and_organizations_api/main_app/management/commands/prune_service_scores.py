@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from main_app.score_cache import invalidate_service_scores
+from main_app.scoring import get_scorer
+
+
+class Command(BaseCommand):
+    """
+    Команда для удаления сохраненных оценок услуг (ServiceScore) устаревших версий оценщика
+    """
+    help = "Delete cached service scores of outdated scorer versions (or all of them with --all)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Delete cached scores of the current scorer version too",
+        )
+
+    def handle(self, *args, **options):
+        keep_version = None if options["all"] else get_scorer().version
+        deleted = invalidate_service_scores(keep_version=keep_version)
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} cached service scores"))
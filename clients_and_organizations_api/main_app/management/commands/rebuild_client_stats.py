@@ -0,0 +1,19 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from main_app.stats import rebuild_client_stats
+
+my_logger = logging.getLogger("my_logger")
+
+
+class Command(BaseCommand):
+    """
+    Команда для полного пересчета агрегированных данных клиентов (ClientStats) по организациям и счетам
+    """
+    help = "Rebuild ClientStats rollup from organizations and bills"
+
+    def handle(self, *args, **options):
+        rebuilt = rebuild_client_stats()
+        my_logger.info(f"Пересчитаны агрегированные данные {rebuilt} клиентов")
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt stats for {rebuilt} clients"))
@@ -0,0 +1,32 @@
+import logging
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from main_app import utils
+from main_app.models import Organization, Bill
+from main_app.response_cache import bump_data_version
+
+my_logger = logging.getLogger("my_logger")
+
+
+class Command(BaseCommand):
+    """
+    Команда для пересчета поля fraud_weight всех организаций по сохраненным счетам.
+    Пересчет выполняется одним UPDATE-запросом с агрегирующим подзапросом по Bill.fraud_score.
+    """
+    help = "Recompute Organization.fraud_weight from Bill.fraud_score"
+
+    def handle(self, *args, **options):
+        high_fraud_bills = (
+            Bill.objects.filter(organization=OuterRef("pk"), fraud_score__gte=utils.FRAUD_SCORE_THRESHOLD)
+            .order_by()
+            .values("organization")
+            .annotate(total=Count("id"))
+            .values("total")
+        )
+        updated = Organization.objects.update(fraud_weight=Coalesce(Subquery(high_fraud_bills), Value(0)))
+        bump_data_version()
+        my_logger.info(f"Пересчитано поле fraud_weight у {updated} организаций")
+        self.stdout.write(self.style.SUCCESS(f"Recomputed fraud_weight for {updated} organizations"))
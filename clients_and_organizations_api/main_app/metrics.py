@@ -0,0 +1,233 @@
+import threading
+from bisect import bisect_left
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Границы корзин гистограмм
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+IMPORT_STAGE_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    escaped = (
+        str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        for value in values
+    )
+    return "{" + ",".join('{}="{}"'.format(name, value) for name, value in zip(names, escaped)) + "}"
+
+
+class Metric:
+    """
+    Базовый класс метрики с метками (аналог метрик prometheus_client, значения хранятся в памяти процесса)
+
+    Атрибуты
+    ---------
+    name: str
+        имя метрики
+    documentation: str
+        описание метрики (строка HELP)
+    labelnames: Tuple[str, ...]
+        имена меток
+    """
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> List[Tuple[str, Sequence[str], Sequence[str], float]]:
+        """
+        Возвращает значения метрики: (суффикс имени, имена меток, значения меток, значение)
+        """
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            "# HELP {} {}".format(self.name, self.documentation),
+            "# TYPE {} {}".format(self.name, self.kind),
+        ]
+        for suffix, names, values, value in self.samples():
+            lines.append("{}{}{} {}".format(self.name, suffix, _format_labels(names, values), _format_value(value)))
+        return "\n".join(lines) + "\n"
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [("", self.labelnames, key, value) for key, value in items]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram(Metric):
+    """
+    Гистограмма: количество наблюдений по корзинам (накопительно, как в Prometheus), сумма и количество
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # {значения меток: [количество наблюдений в каждой корзине, сумма, количество]}
+        self._values: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            state[0][idx] += 1
+            state[1] += value
+            state[2] += 1
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return state[2] if state is not None else 0
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, ([*state[0]], state[1], state[2])) for key, state in self._values.items())
+        samples = []
+        bucket_labels = self.labelnames + ("le",)
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append(("_bucket", bucket_labels, key + (_format_value(bound),), cumulative))
+            samples.append(("_sum", self.labelnames, key, total))
+            samples.append(("_count", self.labelnames, key, count))
+        return samples
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+class Registry:
+    """
+    Реестр метрик процесса, отдающий их в текстовом формате Prometheus
+    """
+
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "".join(metric.render() for metric in self.metrics)
+
+    def clear(self) -> None:
+        for metric in self.metrics:
+            metric.clear()
+
+
+registry = Registry()
+
+REQUEST_LATENCY = registry.register(Histogram(
+    "http_request_duration_seconds", "Request latency by view", ("view", "method"), LATENCY_BUCKETS,
+))
+REQUESTS = registry.register(Counter(
+    "http_requests_total", "Requests by view and status code", ("view", "method", "status"),
+))
+REQUEST_QUERIES = registry.register(Histogram(
+    "http_request_db_queries", "SQL queries per request by view", ("view",), QUERY_COUNT_BUCKETS,
+))
+REQUEST_QUERY_SECONDS = registry.register(Histogram(
+    "http_request_db_duration_seconds", "SQL time per request by view", ("view",), LATENCY_BUCKETS,
+))
+IMPORT_STAGE_SECONDS = registry.register(Histogram(
+    "import_stage_duration_seconds", "Import stage duration per upload", ("kind", "stage"), IMPORT_STAGE_BUCKETS,
+))
+IMPORT_SECONDS = registry.register(Histogram(
+    "import_duration_seconds", "Import duration per upload", ("kind", "state"), IMPORT_STAGE_BUCKETS,
+))
+IMPORT_ROWS = registry.register(Counter(
+    "import_rows_total", "Imported rows by outcome", ("kind", "outcome"),
+))
+SCORE_CACHE_LOOKUPS = registry.register(Counter(
+    "score_cache_lookups_total", "Unique service descriptions by scoring cache tier (memory, database, miss)",
+    ("tier",),
+))
+
+
+def observe_request(
+        view: str,
+        method: str,
+        status: int,
+        seconds: float,
+        queries: Optional[int],
+        query_seconds: Optional[float],
+) -> None:
+    """
+    Функция для записи метрик обработанного запроса
+    (queries=None - SQL-запросы не учитывались, например в async-представлениях)
+    """
+    REQUEST_LATENCY.observe(seconds, view=view, method=method)
+    REQUESTS.inc(view=view, method=method, status=status)
+    if queries is not None:
+        REQUEST_QUERIES.observe(queries, view=view)
+        REQUEST_QUERY_SECONDS.observe(query_seconds, view=view)
+
+
+def observe_import(kind: str, state: str, seconds: float, timings: Dict[str, float], result=None) -> None:
+    """
+    Функция для записи метрик выполненной задачи импорта
+
+    Параметры
+    ---------
+    kind: str
+        тип импорта
+    state: str
+        итоговое состояние задачи (done или failed)
+    seconds: float
+        общее время импорта
+    timings: Dict[str, float]
+        время этапов импорта (importers.StageTimings)
+    result: ImportResult, None
+        результат импорта (None, если импорт завершился ошибкой)
+    """
+    IMPORT_SECONDS.observe(seconds, kind=kind, state=state)
+    for stage, stage_seconds in timings.items():
+        IMPORT_STAGE_SECONDS.observe(stage_seconds, kind=kind, stage=stage)
+    if result is not None:
+        for outcome in ("inserted", "updated", "skipped", "unchanged", "rejected"):
+            IMPORT_ROWS.inc(getattr(result, "rows_{}".format(outcome)), kind=kind, outcome=outcome)
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import time
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connection
+
+from main_app import metrics
+
+my_logger = logging.getLogger("my_logger")
+
+# Максимальное количество SQL-запросов, сохраняемых для лога медленных запросов
+SLOW_REQUEST_MAX_QUERIES = 50
+
+
+class QueryRecorder:
+    """
+    Обертка выполнения SQL-запросов (connection.execute_wrapper), считающая количество и время запросов.
+    Если keep_sql=True, сохраняет текст и время первых SLOW_REQUEST_MAX_QUERIES запросов.
+    """
+
+    def __init__(self, keep_sql: bool = False):
+        self.keep_sql = keep_sql
+        self.count = 0
+        self.seconds = 0.0
+        self.queries: List[Tuple[str, float]] = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.count += 1
+            self.seconds += duration
+            if self.keep_sql and len(self.queries) < SLOW_REQUEST_MAX_QUERIES:
+                self.queries.append((sql, duration))
+
+
+class MetricsMiddleware:
+    """
+    Middleware для сбора метрик запросов: время обработки по view, количество и время SQL-запросов.
+    Если задана настройка SLOW_REQUEST_SECONDS, запросы дольше этого времени пишутся в лог
+    вместе с выполненными SQL-запросами.
+    Для потоковых ответов учитывается время до начала отдачи ответа.
+    Middleware работает и в асинхронном режиме (ASGI), чтобы не переводить async-представления
+    в поток. В этом режиме SQL-запросы выполняются в других потоках и не учитываются.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # как в django.utils.deprecation.MiddlewareMixin: обработчик запроса становится корутиной
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        recorder = QueryRecorder(keep_sql=settings.SLOW_REQUEST_SECONDS is not None)
+        started = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        self.observe(request, response, time.perf_counter() - started, recorder)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.observe(request, response, time.perf_counter() - started)
+        return response
+
+    def observe(self, request, response, seconds: float, recorder: Optional[QueryRecorder] = None) -> None:
+        """
+        Метод для записи метрик запроса и лога медленного запроса (recorder=None - SQL-запросы не учитывались)
+        """
+        slow_request_seconds = settings.SLOW_REQUEST_SECONDS
+        match = getattr(request, "resolver_match", None)
+        view = match.view_name if match is not None else "<unresolved>"
+        metrics.observe_request(
+            view=view,
+            method=request.method,
+            status=response.status_code,
+            seconds=seconds,
+            queries=recorder.count if recorder is not None else None,
+            query_seconds=recorder.seconds if recorder is not None else None,
+        )
+        if slow_request_seconds is not None and seconds >= slow_request_seconds:
+            if recorder is None:
+                my_logger.warning(
+                    f"Медленный запрос {request.method} {request.get_full_path()} ({view}): {seconds:.3f} s"
+                )
+                return
+            queries = "\n".join("  {:.4f} s | {}".format(duration, sql) for sql, duration in recorder.queries)
+            my_logger.warning(
+                f"Медленный запрос {request.method} {request.get_full_path()} ({view}): {seconds:.3f} s, "
+                f"SQL-запросов {recorder.count} ({recorder.seconds:.3f} s)\n{queries}"
+            )
+
+
+class ASGIURLConfMiddleware:
+    """
+    Middleware, подключающий для запросов, пришедших через ASGI, схему адресов ASGI_URLCONF:
+    в ней списки /api/clients/ и /api/bills/ и загрузка файлов обслуживаются async-представлениями
+    (main_app.async_views). Запросы через WSGI обслуживаются схемой ROOT_URLCONF.
+    Middleware не переходит в поток в асинхронном режиме (в отличие от MiddlewareMixin).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        # в асинхронном режиме get_response возвращает корутину, которую ожидает вызывающий обработчик
+        if settings.ASGI_URLCONF and isinstance(request, ASGIRequest):
+            request.urlconf = settings.ASGI_URLCONF
+        return self.get_response(request)
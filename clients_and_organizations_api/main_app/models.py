@@ -1,5 +1,7 @@
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
+from django.utils import timezone
 
 
 class Client(models.Model):
@@ -23,11 +25,16 @@ class Organization(models.Model):
         related_name="organizations",
         verbose_name="client_name"
     )
+    # хеш строки файла, из которой записана организация (fingerprints.row_hash), для импорта только изменений
+    row_hash = models.CharField(max_length=32, blank=True, default="", verbose_name="row_hash")
 
     class Meta:
         verbose_name = "organization"
         verbose_name_plural = "organizations"
         unique_together = ('name', 'client',)
+        indexes = [
+            models.Index(fields=('name',), name='organization_name_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -56,11 +63,213 @@ class Bill(models.Model):
         related_name="bill",
         verbose_name="organization's_bill"
     )
+    # хеш строки файла, из которой записан счет (fingerprints.row_hash), для импорта только изменений
+    row_hash = models.CharField(max_length=32, blank=True, default="", verbose_name="row_hash")
 
     class Meta:
         verbose_name = "bill"
         verbose_name_plural = "bills"
         unique_together = ('number', 'organization',)
+        indexes = [
+            # список счетов отсортирован по (date, id), с фильтрами по клиенту и/или организации
+            models.Index(fields=('date',), name='bill_date_idx'),
+            models.Index(fields=('client', 'date'), name='bill_client_date_idx'),
+            models.Index(fields=('organization', 'date'), name='bill_organization_date_idx'),
+            # отчет /api/bills/stats группирует счета по клиенту, организации или классу услуги
+            models.Index(fields=('service_class', 'date'), name='bill_service_class_date_idx'),
+        ]
 
     def __str__(self):
         return "Bill №{}".format(self.number)
+
+
+class BillColumnMapping(models.Model):
+    """
+    Формат файла со счетами клиента: соответствие колонок файла полям общей структуры счета.
+    Дополняет (или переопределяет по имени) встроенные форматы из main_app.formats.
+    """
+    name = models.CharField(max_length=128, unique=True, verbose_name="format_name")
+    columns = models.JSONField(verbose_name="columns", help_text="{\"колонка файла\": \"поле счета\"}")
+
+    class Meta:
+        verbose_name = "bill column mapping"
+        verbose_name_plural = "bill column mappings"
+
+    def __str__(self):
+        return self.name
+
+    def clean(self):
+        from main_app.formats import BILL_FIELDS
+
+        if not isinstance(self.columns, dict) or sorted(self.columns.values()) != sorted(BILL_FIELDS):
+            raise ValidationError(
+                {"columns": "Columns must map file columns to each of the fields: {}".format(", ".join(BILL_FIELDS))}
+            )
+
+
+class ImportJob(models.Model):
+    """
+    Задача на импорт загруженного файла. Таблица задач одновременно служит очередью для воркеров.
+    """
+    KIND_BILLS = "bills"
+    KIND_CLIENTS = "clients"
+    KIND_CHOICES = (
+        (KIND_BILLS, "bills"),
+        (KIND_CLIENTS, "clients"),
+    )
+
+    ON_CONFLICT_ERROR = "error"
+    ON_CONFLICT_SKIP = "skip"
+    ON_CONFLICT_UPDATE = "update"
+    ON_CONFLICT_CHOICES = (
+        (ON_CONFLICT_ERROR, "error"),
+        (ON_CONFLICT_SKIP, "skip"),
+        (ON_CONFLICT_UPDATE, "update"),
+    )
+
+    STATE_PENDING = "pending"
+    STATE_RUNNING = "running"
+    STATE_DONE = "done"
+    STATE_FAILED = "failed"
+    STATE_CHOICES = (
+        (STATE_PENDING, "pending"),
+        (STATE_RUNNING, "running"),
+        (STATE_DONE, "done"),
+        (STATE_FAILED, "failed"),
+    )
+
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES, verbose_name="kind")
+    state = models.CharField(
+        max_length=16, choices=STATE_CHOICES, default=STATE_PENDING, db_index=True, verbose_name="state"
+    )
+    file = models.FileField(upload_to="imports/", verbose_name="file")
+    file_name = models.CharField(max_length=255, blank=True, default="", verbose_name="file_name")
+    on_conflict = models.CharField(
+        max_length=16, choices=ON_CONFLICT_CHOICES, default=ON_CONFLICT_ERROR, verbose_name="on_conflict"
+    )
+    rows_processed = models.IntegerField(default=0, verbose_name="rows_processed")
+    rows_accepted = models.IntegerField(default=0, verbose_name="rows_accepted")
+    rows_rejected = models.IntegerField(default=0, verbose_name="rows_rejected")
+    rows_inserted = models.IntegerField(default=0, verbose_name="rows_inserted")
+    rows_updated = models.IntegerField(default=0, verbose_name="rows_updated")
+    rows_skipped = models.IntegerField(default=0, verbose_name="rows_skipped")
+    rows_unchanged = models.IntegerField(default=0, verbose_name="rows_unchanged")
+    error = models.TextField(blank=True, default="", verbose_name="error")
+    duplicate_of = models.ForeignKey(
+        "self",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="duplicates",
+        verbose_name="duplicate_of",
+        help_text="Задача, которая уже импортировала файл с тем же содержимым",
+    )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="created_at")
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name="started_at")
+    # время захвата задачи или последнего сохранения прогресса: по нему определяется прерванная задача
+    heartbeat_at = models.DateTimeField(null=True, blank=True, verbose_name="heartbeat_at")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="finished_at")
+
+    class Meta:
+        verbose_name = "import job"
+        verbose_name_plural = "import jobs"
+
+    def __str__(self):
+        return "Import job №{} ({})".format(self.id, self.kind)
+
+    @property
+    def throughput(self) -> float:
+        """
+        Скорость обработки задачи в строках в секунду
+        """
+        if self.started_at is None:
+            return 0.0
+        elapsed = ((self.finished_at or timezone.now()) - self.started_at).total_seconds()
+        return round(self.rows_processed / elapsed, 2) if elapsed > 0 else 0.0
+
+
+class ImportBatch(models.Model):
+    """
+    Отпечаток импортированного файла: sha256 содержимого файла, тип импорта и режим on_conflict.
+    Файл с тем же отпечатком не импортируется повторно, пока задача импорта, на которую ссылается запись,
+    не завершилась ошибкой.
+    """
+    kind = models.CharField(max_length=16, choices=ImportJob.KIND_CHOICES, verbose_name="kind")
+    content_hash = models.CharField(max_length=64, verbose_name="content_hash")
+    on_conflict = models.CharField(max_length=16, choices=ImportJob.ON_CONFLICT_CHOICES, verbose_name="on_conflict")
+    job = models.ForeignKey(ImportJob, on_delete=models.CASCADE, related_name="batches", verbose_name="job")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="created_at")
+
+    class Meta:
+        verbose_name = "import batch"
+        verbose_name_plural = "import batches"
+        unique_together = ('kind', 'content_hash', 'on_conflict',)
+
+    def __str__(self):
+        return "{} ({})".format(self.content_hash, self.kind)
+
+
+class DataVersion(models.Model):
+    """
+    Версия данных для кеша ответов (response_cache): случайный токен, который меняется после каждой записи
+    клиентов, организаций или счетов. Хранится в базе (одна запись), поэтому смену версии видят все процессы
+    сервера, в том числе после импорта командами (process_import_jobs, import_bills и т.д.).
+    """
+    token = models.CharField(max_length=32, verbose_name="token")
+
+    class Meta:
+        verbose_name = "data version"
+        verbose_name_plural = "data versions"
+
+    def __str__(self):
+        return self.token
+
+
+class ClientStats(models.Model):
+    """
+    Агрегированные данные клиента для списка клиентов.
+    Обновляются импортами счетов и организаций, полностью пересчитываются командой rebuild_client_stats.
+    """
+    client = models.OneToOneField(
+        Client,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="stats",
+        verbose_name="client",
+    )
+    organizations_count = models.IntegerField(default=0, verbose_name="organizations_count")
+    bills_count = models.IntegerField(default=0, verbose_name="bills_count")
+    total_summ = models.BigIntegerField(default=0, verbose_name="total_summ")
+    high_fraud_bills_count = models.IntegerField(default=0, verbose_name="high_fraud_bills_count")
+
+    class Meta:
+        verbose_name = "client stats"
+        verbose_name_plural = "client stats"
+
+    def __str__(self):
+        return "Stats of {}".format(self.client_id)
+
+
+class ServiceScore(models.Model):
+    """
+    Сохраненный результат оценки описания услуги (кеш оценщика счетов).
+    Ключ - sha256 нормализованного текста услуги и версия оценщика,
+    поэтому при смене версии оценщика старые записи не используются.
+    """
+    text_hash = models.CharField(max_length=64, verbose_name="text_hash")
+    scorer_version = models.CharField(max_length=64, verbose_name="scorer_version")
+    fraud_score = models.FloatField(
+        validators=[MinValueValidator(0.0), MaxValueValidator(1.0)],
+        verbose_name="fraud_score"
+    )
+    service_class = models.IntegerField(validators=[MinValueValidator(0)], verbose_name="service_class")
+    service_name = models.CharField(max_length=128, verbose_name="service_name")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="created_at")
+
+    class Meta:
+        verbose_name = "service score"
+        verbose_name_plural = "service scores"
+        unique_together = ('scorer_version', 'text_hash',)
+
+    def __str__(self):
+        return "{} ({})".format(self.text_hash, self.scorer_version)
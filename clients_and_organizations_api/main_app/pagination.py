@@ -0,0 +1,159 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from typing import List, NamedTuple, Optional, Tuple
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetCursor(NamedTuple):
+    """
+    Класс, представляющий курсор keyset-пагинации
+
+    Атрибуты
+    ---------
+    position: Tuple
+        значения полей сортировки граничной записи
+    reverse: bool
+        True - курсор указывает на предыдущую страницу (записи до position)
+    """
+    position: Tuple
+    reverse: bool
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Keyset (курсорная) пагинация по составному ключу сортировки.
+    Страница выбирается условием (поле1, поле2, ...) > (значения последней записи) по индексу,
+    без OFFSET, поэтому стоимость запроса не зависит от глубины страницы.
+    Курсор - непрозрачная base64-строка со значениями полей ключа последней (или первой) записи страницы.
+    Последнее поле в ordering должно быть уникальным (например id).
+    """
+    ordering = ("id",)
+    page_size = 100
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.set_page(list(self.page_queryset(queryset, request)))
+
+    def page_queryset(self, queryset, request):
+        """
+        Метод для построения запроса страницы (без обращения к базе): сортировка по ordering,
+        условие курсора и ограничение page_size + 1 записей (лишняя запись показывает, есть ли следующая страница).
+        Прочитанные записи передаются в set_page. Разделение нужно async-представлениям,
+        которые читают записи без блокировки цикла событий (см. async_views).
+        """
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.ordering = tuple(self.ordering)
+        model = queryset.model
+
+        self.cursor = cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor.reverse
+        queryset = queryset.order_by(*("-{}".format(field) if reverse else field for field in self.ordering))
+        if cursor is not None:
+            position = self._parse_position(model, cursor.position)
+            queryset = queryset.filter(self._keyset_filter(position, reverse))
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, results: List) -> List:
+        """
+        Метод для формирования страницы из записей, прочитанных по запросу page_queryset
+        """
+        cursor = self.cursor
+        reverse = cursor is not None and cursor.reverse
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+
+        if reverse:
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        if self.page:
+            self.first_position = self._get_position(self.page[0])
+            self.last_position = self._get_position(self.page[-1])
+        else:
+            self.first_position = self.last_position = cursor.position if cursor is not None else None
+            self.has_next = self.has_next and cursor is not None
+            self.has_previous = self.has_previous and cursor is not None
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def get_next_link(self) -> Optional[str]:
+        if not self.has_next or self.last_position is None:
+            return None
+        return self.encode_cursor(KeysetCursor(position=self.last_position, reverse=False))
+
+    def get_previous_link(self) -> Optional[str]:
+        if not self.has_previous or self.first_position is None:
+            return None
+        return self.encode_cursor(KeysetCursor(position=self.first_position, reverse=True))
+
+    def decode_cursor(self, request) -> Optional[KeysetCursor]:
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            tokens = json.loads(urlsafe_b64decode(encoded.encode("ascii")).decode("utf-8"))
+            position = tuple(tokens["p"])
+            reverse = bool(tokens.get("r", 0))
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return KeysetCursor(position=position, reverse=reverse)
+
+    def encode_cursor(self, cursor: KeysetCursor) -> str:
+        tokens = {"p": list(cursor.position)}
+        if cursor.reverse:
+            tokens["r"] = 1
+        encoded = urlsafe_b64encode(json.dumps(tokens, separators=(",", ":")).encode("utf-8")).decode("ascii")
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def _get_position(self, instance) -> Tuple:
+        """
+        Возвращает значения полей сортировки записи в виде, пригодном для JSON
+        """
+        values = []
+        for field in self.ordering:
+            value = instance[field] if isinstance(instance, dict) else getattr(instance, field)
+            values.append(value.isoformat() if hasattr(value, "isoformat") else value)
+        return tuple(values)
+
+    def _parse_position(self, model, position: Tuple) -> Tuple:
+        """
+        Приводит значения из курсора к типам полей модели
+        """
+        try:
+            return tuple(
+                model._meta.get_field(field).to_python(value)
+                for field, value in zip(self.ordering, position)
+            )
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def _keyset_filter(self, position: Tuple, reverse: bool) -> Q:
+        """
+        Условие лексикографического сравнения (поле1, поле2, ...) > position (или < для обратного направления)
+        """
+        lookup = "lt" if reverse else "gt"
+        condition = Q()
+        for idx, field in enumerate(self.ordering):
+            equal = {prev_field: position[prev_idx] for prev_idx, prev_field in enumerate(self.ordering[:idx])}
+            condition |= Q(**equal, **{"{}__{}".format(field, lookup): position[idx]})
+        return condition
+
+
+class ClientsPagination(KeysetPagination):
+    ordering = ("id",)
+
+
+class BillsPagination(KeysetPagination):
+    ordering = ("date", "id")
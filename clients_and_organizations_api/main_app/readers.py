@@ -0,0 +1,182 @@
+import datetime
+import os
+from typing import IO, Iterator, List, Optional, Sequence
+
+import pandas as pd
+
+from main_app.exceptions import UnsupportedFileFormatError
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+# Форматы загружаемых файлов
+FORMAT_XLSX = "xlsx"
+FORMAT_CSV = "csv"
+FORMAT_PARQUET = "parquet"
+# Расширения файлов каждого формата
+FORMAT_EXTENSIONS = {
+    ".xlsx": FORMAT_XLSX,
+    ".csv": FORMAT_CSV,
+    ".parquet": FORMAT_PARQUET,
+}
+# Первые байты файлов (xlsx - zip-архив), по ним определяется формат файла без известного расширения
+FORMAT_MAGIC = (
+    (b"PK\x03\x04", FORMAT_XLSX),
+    (b"PAR1", FORMAT_PARQUET),
+)
+# Дата (или дата со временем) в формате ISO 8601 - так даты записываются в CSV файлах
+ISO_DATE_PATTERN = r"^\s*\d{4}-\d{2}-\d{2}(?:[ T]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?)?\s*$"
+# Кодировка CSV файлов (utf-8-sig читает и файлы с BOM, которые сохраняет Excel)
+CSV_ENCODING = "utf-8-sig"
+
+
+def parquet_supported() -> bool:
+    """
+    Возвращает True, если установлен pyarrow и можно читать Parquet файлы
+    """
+    return pq is not None
+
+
+def supported_extensions() -> List[str]:
+    """
+    Возвращает расширения файлов, которые можно загрузить (.parquet - только если установлен pyarrow)
+    """
+    return [
+        extension for extension, file_format in FORMAT_EXTENSIONS.items()
+        if file_format != FORMAT_PARQUET or parquet_supported()
+    ]
+
+
+def detect_file_format(file_obj: IO) -> str:
+    """
+    Функция для определения формата файла по расширению имени файла, а если расширение неизвестно -
+    по первым байтам файла. Файл без имени и известной сигнатуры считается CSV.
+
+    Параметры
+    ---------
+    file_obj: IO
+        объект файла (загруженный файл, файл задачи импорта или открытый файл на диске)
+
+    Возвращаемое значение
+    ---------------------
+    str
+        формат файла (FORMAT_XLSX, FORMAT_CSV или FORMAT_PARQUET)
+    """
+    extension = os.path.splitext(getattr(file_obj, "name", None) or "")[1].lower()
+    if extension in FORMAT_EXTENSIONS:
+        return FORMAT_EXTENSIONS[extension]
+    file_obj.seek(0)
+    head = file_obj.read(4)
+    file_obj.seek(0)
+    for magic, file_format in FORMAT_MAGIC:
+        if head == magic:
+            return file_format
+    return FORMAT_CSV
+
+
+def _parquet_file(file_obj: IO):
+    if pq is None:
+        raise UnsupportedFileFormatError("Reading .parquet files requires pyarrow")
+    file_obj.seek(0)
+    return pq.ParquetFile(file_obj)
+
+
+def read_columnar_header(file_obj: IO, file_format: str) -> List[str]:
+    """
+    Функция для чтения заголовка (имен колонок) CSV или Parquet файла без чтения данных
+
+    Параметры
+    ---------
+    file_obj: IO
+        объект файла
+    file_format: str
+        формат файла (FORMAT_CSV или FORMAT_PARQUET)
+
+    Возвращаемое значение
+    ---------------------
+    List[str]
+        имена колонок файла
+    """
+    if file_format == FORMAT_PARQUET:
+        return list(_parquet_file(file_obj).schema_arrow.names)
+    file_obj.seek(0)
+    return list(pd.read_csv(file_obj, nrows=0, encoding=CSV_ENCODING).columns)
+
+
+def _to_python_values(chunk: pd.DataFrame) -> pd.DataFrame:
+    """
+    Приводит часть файла к тому же виду, что и части xlsx файла (utils.make_frame):
+    пустые значения - None, типы колонок выводятся только для однородных значений
+    """
+    return chunk.astype(object).where(chunk.notna(), None).infer_objects()
+
+
+def iter_columnar_chunks(
+        file_obj: IO,
+        file_format: str,
+        chunk_size: int,
+        columns: Optional[Sequence[str]] = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    Генератор для потокового чтения CSV или Parquet файла частями фиксированного размера.
+    Читаются только колонки columns (у Parquet остальные колонки не распаковываются),
+    поэтому потребление памяти ограничено размером одной части выбранных колонок.
+    Значения CSV файла читаются как строки (без преобразования типов pandas), как их записал автор файла.
+
+    Параметры
+    ---------
+    file_obj: IO
+        объект файла
+    file_format: str
+        формат файла (FORMAT_CSV или FORMAT_PARQUET)
+    chunk_size: int
+        количество строк в одной части
+    columns: Sequence[str], None
+        читаемые колонки, по умолчанию - все
+
+    Возвращаемое значение
+    ---------------------
+    Iterator[pd.DataFrame]
+        части файла в виде DataFrame
+    """
+    columns = list(columns) if columns is not None else None
+    if file_format == FORMAT_PARQUET:
+        for batch in _parquet_file(file_obj).iter_batches(batch_size=chunk_size, columns=columns):
+            yield _to_python_values(batch.to_pandas())
+        return
+    file_obj.seek(0)
+    with pd.read_csv(
+            file_obj, chunksize=chunk_size, usecols=columns, dtype=str, encoding=CSV_ENCODING,
+    ) as reader:
+        for chunk in reader:
+            chunk = chunk.dropna(how="all")
+            if len(chunk):
+                yield _to_python_values(chunk[columns] if columns is not None else chunk)
+
+
+def parse_dates(column: pd.Series) -> pd.Series:
+    """
+    Функция для приведения колонки дат CSV или Parquet файла к значениям, которые принимает валидация счетов
+    (validation.validate_bills_frame): строки в формате ISO 8601 и даты превращаются в pd.Timestamp,
+    остальные значения (числа, строки в другом формате, несуществующие даты) - в None и не проходят валидацию.
+
+    Параметры
+    ---------
+    column: pd.Series
+        колонка дат части файла
+
+    Возвращаемое значение
+    ---------------------
+    pd.Series
+        колонка с pd.Timestamp и None с тем же индексом
+    """
+    if pd.api.types.is_datetime64_any_dtype(column):
+        return column.astype(object).where(column.notna(), None)
+    values = column.astype(object)
+    is_string = values.map(lambda value: isinstance(value, str)).astype(bool)
+    is_date = values.map(lambda value: isinstance(value, datetime.date)).astype(bool)
+    candidates = values.where(is_date | (is_string & values.where(is_string, "").str.match(ISO_DATE_PATTERN)))
+    parsed = pd.to_datetime(candidates, errors="coerce")
+    return parsed.astype(object).where(parsed.notna(), None)
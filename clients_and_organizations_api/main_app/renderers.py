@@ -0,0 +1,131 @@
+import csv
+import io
+import itertools
+import re
+from typing import Iterable, Iterator, Sequence
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Числа, которые orjson записывает иначе, чем json.dumps: экспоненциальная запись (1e16 вместо 1e+16)
+# и малые дроби без экспоненты (0.00001 вместо 1e-05). Совпадения внутри строк дают лишь лишний откат.
+FLOAT_MISMATCH_PATTERN = re.compile(rb"0\.0000\d|\d[eE]")
+
+if orjson is not None:
+    ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSON-рендерер на orjson (если он установлен).
+    Результат побайтно совпадает с JSONRenderer: даты, Decimal и прочие типы кодируются
+    кодировщиком DRF, а если в ответе есть число, которое orjson записал бы иначе,
+    либо запрошен отступ или не-компактный/ASCII режим, ответ рендерится стандартным JSONRenderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if (
+                orjson is None
+                or self.ensure_ascii
+                or not self.compact
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        if FLOAT_MISMATCH_PATTERN.search(ret):
+            return super().render(data, accepted_media_type, renderer_context)
+        # JSONRenderer экранирует разделители строк U+2028 и U+2029 (они недопустимы в строках JavaScript)
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class StreamingRenderer(BaseRenderer):
+    """
+    Базовый класс рендереров выгрузки, которые отдают строки таблицы частями (для StreamingHttpResponse).
+    Метод render используется только для ответов с ошибками.
+
+    Атрибуты
+    ---------
+    batch_size: int
+        количество строк в одной отдаваемой части
+    """
+    charset = "utf-8"
+    batch_size = 1000
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if not isinstance(data, dict):
+            data = {"detail": data}
+        return b"".join(self.stream(list(data), [tuple(data.values())]))
+
+    def stream(self, header: Sequence[str], rows: Iterable[Sequence]) -> Iterator[bytes]:
+        """
+        Генератор частей выгрузки: первая часть (заголовок) отдается до чтения первой строки
+
+        Параметры
+        ---------
+        header: Sequence[str]
+            имена колонок
+        rows: Iterable[Sequence]
+            строки таблицы (например, queryset.values_list().iterator())
+        """
+        yield self.render_header(header)
+        rows = iter(rows)
+        while True:
+            batch = list(itertools.islice(rows, self.batch_size))
+            if not batch:
+                return
+            yield self.render_rows(header, batch)
+
+    def render_header(self, header: Sequence[str]) -> bytes:
+        return b""
+
+    def render_rows(self, header: Sequence[str], rows: Sequence[Sequence]) -> bytes:
+        raise NotImplementedError
+
+
+class CSVStreamingRenderer(StreamingRenderer):
+    """
+    Рендерер выгрузки в CSV: строка заголовка с именами колонок, затем по строке на запись
+    """
+    media_type = "text/csv"
+    format = "csv"
+
+    def _write(self, rows) -> bytes:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode(self.charset)
+
+    def render_header(self, header: Sequence[str]) -> bytes:
+        return self._write([header])
+
+    def render_rows(self, header: Sequence[str], rows: Sequence[Sequence]) -> bytes:
+        return self._write(rows)
+
+
+class NDJSONStreamingRenderer(StreamingRenderer):
+    """
+    Рендерер выгрузки в NDJSON: по JSON-объекту с именами колонок в качестве ключей на строку
+    """
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+
+    def render_rows(self, header: Sequence[str], rows: Sequence[Sequence]) -> bytes:
+        if orjson is not None:
+            ret = b"".join(orjson.dumps(dict(zip(header, row)), option=orjson.OPT_APPEND_NEWLINE) for row in rows)
+        else:
+            encoder = JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+            ret = "".join(encoder.encode(dict(zip(header, row))) + "\n" for row in rows).encode(self.charset)
+        # U+2028 и U+2029 экранируются, иначе многие читатели (например, str.splitlines) считают их концом строки
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
@@ -0,0 +1,155 @@
+import hashlib
+import logging
+import uuid
+from typing import Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError, transaction
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from main_app.models import DataVersion
+
+my_logger = logging.getLogger("my_logger")
+
+# id записи DataVersion с текущей версией данных
+DATA_VERSION_ID = 1
+
+
+def get_cache():
+    """
+    Возвращает кеш ответов списков (настройка RESPONSE_CACHE_ALIAS)
+    """
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def get_data_version() -> str:
+    """
+    Функция для получения текущей версии данных (DataVersion) одним запросом по первичному ключу.
+    Версия хранится в базе, а не в кеше ответов: кеш может быть локальным для процесса,
+    а версию должны менять импорты в любом процессе.
+    Версия - случайный токен, а не счетчик: после пересоздания записи (например, очистки базы)
+    ранее закешированные ответы не используются.
+
+    Возвращаемое значение
+    ---------------------
+    str
+        токен версии данных
+    """
+    token = DataVersion.objects.filter(id=DATA_VERSION_ID).values_list("token", flat=True).first()
+    if token is None:
+        token = DataVersion.objects.get_or_create(id=DATA_VERSION_ID, defaults=dict(token=uuid.uuid4().hex))[0].token
+    return token
+
+
+def bump_data_version() -> None:
+    """
+    Функция для смены версии данных (после записи в базу клиентов, организаций или счетов).
+    Версия меняется одним запросом UPDATE без предварительного чтения: в SQLite транзакция, которая
+    сначала читает, а затем пишет, при параллельной записи сразу завершается ошибкой "database is locked",
+    а одиночный UPDATE ждет освобождения блокировки. Запись создается, только если ее еще нет.
+    """
+    token = uuid.uuid4().hex
+    if not DataVersion.objects.filter(id=DATA_VERSION_ID).update(token=token):
+        DataVersion.objects.get_or_create(id=DATA_VERSION_ID, defaults=dict(token=token))
+
+
+def _bump_data_version_after_commit() -> None:
+    # данные уже зафиксированы, поэтому ошибка смены версии не должна завершать ошибкой импорт:
+    # закешированные ответы устареют не позже чем через RESPONSE_CACHE_TIMEOUT секунд
+    try:
+        bump_data_version()
+    except DatabaseError:
+        my_logger.exception("Не удалось сменить версию данных после записи")
+
+
+def bump_data_version_on_commit() -> None:
+    """
+    Функция для смены версии данных после фиксации текущей транзакции.
+    Если сменить версию до фиксации, параллельный запрос может закешировать
+    под новой версией еще не измененные данные.
+    Ошибка смены версии пишется в лог и не прерывает выполнение.
+    """
+    transaction.on_commit(_bump_data_version_after_commit)
+
+
+def make_response_key(request, query_params: Tuple[str, ...]) -> str:
+    """
+    Функция для построения ключа ответа по адресу запроса, формату ответа,
+    значениям заданных query-параметров (в фиксированном порядке) и текущей версии данных.
+    Остальные query-параметры на ответ не влияют и в ключ не входят.
+
+    Параметры
+    ---------
+    request: Request
+        объект запроса (после выбора рендерера)
+    query_params: Tuple[str, ...]
+        имена query-параметров, влияющих на ответ
+
+    Возвращаемое значение
+    ---------------------
+    str
+        sha256 от составляющих ключа
+    """
+    parts = [get_data_version(), request.get_host(), request.path, request.accepted_renderer.format]
+    for param in query_params:
+        parts.append("{}={}".format(param, request.query_params.get(param, "")))
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+def etag_matches(request, etag: str) -> bool:
+    """
+    Проверяет, совпадает ли ETag с одним из значений заголовка If-None-Match (слабое сравнение по RFC 7232)
+    """
+    header = request.META.get("HTTP_IF_NONE_MATCH")
+    if not header:
+        return False
+    etags = parse_etags(header)
+    return "*" in etags or etag in (value[2:] if value.startswith("W/") else value for value in etags)
+
+
+class CachedListMixin:
+    """
+    Миксин для list-метода вьюсета: кеширует данные ответа по ключу make_response_key
+    и отдает строгий ETag. На запрос с совпадающим If-None-Match отвечает 304, читая из базы только версию данных.
+    Данные в кеше устаревают при смене версии данных (bump_data_version_on_commit при импорте).
+
+    Атрибуты
+    ---------
+    cache_query_params: Tuple[str, ...]
+        query-параметры фильтрации, влияющие на ответ (параметры пагинации добавляются автоматически)
+    """
+    cache_query_params: Tuple[str, ...] = ()
+
+    def get_cache_query_params(self) -> Tuple[str, ...]:
+        params = tuple(self.cache_query_params)
+        paginator = self.paginator
+        if paginator is not None:
+            params += tuple(
+                param for param in (
+                    getattr(paginator, "cursor_query_param", None),
+                    getattr(paginator, "page_size_query_param", None),
+                )
+                if param
+            )
+        return params
+
+    def list(self, request, *args, **kwargs):
+        key = make_response_key(request, self.get_cache_query_params())
+        etag = '"{}"'.format(key)
+        if etag_matches(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+        cache = get_cache()
+        data = cache.get(key)
+        if data is None:
+            response = super().list(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            cache.set(key, response.data)
+        else:
+            response = Response(data)
+        response["ETag"] = etag
+        return response
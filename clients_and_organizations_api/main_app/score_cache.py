@@ -0,0 +1,178 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from main_app import metrics, utils
+from main_app.models import ServiceScore
+from main_app.scoring import BillScorer, BillScores, get_scorer
+
+my_logger = logging.getLogger("my_logger")
+
+# Результат оценки одной услуги: (fraud_score, service_class, service_name)
+Score = Tuple[float, int, str]
+
+# Уровни кеша оценок для метрик
+TIER_MEMORY = "memory"
+TIER_DATABASE = "database"
+TIER_MISS = "miss"
+
+
+def normalize_service(text) -> str:
+    """
+    Нормализует описание услуги для ключа кеша: пробелы схлопываются, регистр не учитывается
+    """
+    return " ".join(str(text).split()).casefold()
+
+
+def service_hash(text) -> str:
+    """
+    Возвращает sha256 нормализованного описания услуги
+    """
+    return hashlib.sha256(normalize_service(text).encode("utf-8")).hexdigest()
+
+
+class CachedBillScorer(BillScorer):
+    """
+    Двухуровневый кеш результатов оценщика счетов.
+    Первый уровень - ограниченный LRU-словарь в памяти процесса (lru_size записей),
+    второй - таблица ServiceScore, которая читается одним набором запросов на часть файла.
+    Ключ - sha256 нормализованного описания услуги и версия оценщика.
+    Оценщик вызывается один раз на часть файла только для описаний, которых нет ни на одном уровне,
+    каждое уникальное описание оценивается один раз.
+    """
+
+    def __init__(self, scorer: BillScorer, lru_size: int):
+        self.scorer = scorer
+        self.version = scorer.version
+        self.lru_size = lru_size
+        self._lru: "OrderedDict[str, Score]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.lookups = {TIER_MEMORY: 0, TIER_DATABASE: 0, TIER_MISS: 0}
+
+    @property
+    def hit_ratio(self) -> float:
+        """
+        Доля уникальных описаний услуг, найденных в кеше (в памяти или в базе)
+        """
+        total = sum(self.lookups.values())
+        return (total - self.lookups[TIER_MISS]) / total if total else 0.0
+
+    def _count(self, tier: str, amount: int) -> None:
+        if amount:
+            with self._lock:
+                self.lookups[tier] += amount
+            metrics.SCORE_CACHE_LOOKUPS.inc(amount, tier=tier)
+
+    def _lru_get(self, keys: Sequence[str]) -> Dict[str, Score]:
+        found = {}
+        with self._lock:
+            for key in keys:
+                score = self._lru.get(key)
+                if score is not None:
+                    self._lru.move_to_end(key)
+                    found[key] = score
+        return found
+
+    def _lru_put(self, scores: Dict[str, Score]) -> None:
+        with self._lock:
+            for key, score in scores.items():
+                self._lru[key] = score
+                self._lru.move_to_end(key)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    def _db_get(self, keys: Sequence[str]) -> Dict[str, Score]:
+        found = {}
+        for keys_batch in utils.chunked(keys, utils.IN_QUERY_BATCH_SIZE):
+            rows = ServiceScore.objects.filter(scorer_version=self.version, text_hash__in=keys_batch).values_list(
+                "text_hash", "fraud_score", "service_class", "service_name"
+            )
+            for text_hash, fraud_score, service_class, service_name in rows:
+                found[text_hash] = (fraud_score, service_class, service_name)
+        return found
+
+    def _db_put(self, scores: Dict[str, Score]) -> None:
+        ServiceScore.objects.bulk_create(
+            [
+                ServiceScore(
+                    text_hash=key,
+                    scorer_version=self.version,
+                    fraud_score=fraud_score,
+                    service_class=service_class,
+                    service_name=service_name,
+                )
+                for key, (fraud_score, service_class, service_name) in scores.items()
+            ],
+            batch_size=utils.IN_QUERY_BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+
+    def score(self, services: Sequence[str]) -> BillScores:
+        keys = [service_hash(text) for text in services]
+        texts = {}
+        for key, text in zip(keys, services):
+            texts.setdefault(key, text)
+
+        scores = self._lru_get(list(texts))
+        self._count(TIER_MEMORY, len(scores))
+
+        missing = [key for key in texts if key not in scores]
+        if missing:
+            found = self._db_get(missing)
+            self._count(TIER_DATABASE, len(found))
+            self._lru_put(found)
+            scores.update(found)
+            missing = [key for key in missing if key not in found]
+        if missing:
+            self._count(TIER_MISS, len(missing))
+            fresh = self.scorer.score([texts[key] for key in missing])
+            computed = dict(zip(missing, zip(
+                fresh.fraud_score.tolist(), fresh.service_class.tolist(), fresh.service_name.tolist()
+            )))
+            self._db_put(computed)
+            self._lru_put(computed)
+            scores.update(computed)
+
+        fraud_score, service_class, service_name = zip(*(scores[key] for key in keys)) if keys else ((), (), ())
+        return BillScores(
+            fraud_score=np.array(fraud_score, dtype=np.float64),
+            service_class=np.array(service_class, dtype=np.int64),
+            service_name=np.array(service_name, dtype=object),
+        )
+
+    def clear(self) -> None:
+        """
+        Очищает кеш в памяти и счетчики обращений
+        """
+        with self._lock:
+            self._lru.clear()
+            self.lookups = dict.fromkeys(self.lookups, 0)
+
+
+def invalidate_service_scores(keep_version: Optional[str] = None) -> int:
+    """
+    Функция для удаления сохраненных оценок услуг.
+
+    Параметры
+    ---------
+    keep_version: str, None
+        версия оценщика, оценки которой сохраняются (None - удалить все оценки)
+
+    Возвращаемое значение
+    ---------------------
+    int
+        количество удаленных записей
+    """
+    queryset = ServiceScore.objects.all()
+    if keep_version is not None:
+        queryset = queryset.exclude(scorer_version=keep_version)
+    deleted, _ = queryset.delete()
+    scorer = get_scorer()
+    if isinstance(scorer, CachedBillScorer):
+        scorer.clear()
+    my_logger.info(f"Удалено {deleted} сохраненных оценок услуг")
+    return deleted
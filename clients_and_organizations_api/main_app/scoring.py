@@ -0,0 +1,219 @@
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import NamedTuple, Sequence, List, Optional
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+# Классы услуг: {service_class: service_name}
+SERVICE_TYPES = {
+    1: "консультация",
+    2: "лечение",
+    3: "стационар",
+    4: "диагностика",
+    5: "лаборатория",
+}
+
+
+class BillScores(NamedTuple):
+    """
+    Класс, представляющий результат оценки колонки услуг
+
+    Атрибуты
+    ---------
+    fraud_score: np.ndarray
+        оценки мошенничества в диапазоне от 0 до 1 (float64)
+    service_class: np.ndarray
+        классы услуг (int64)
+    service_name: np.ndarray
+        названия классов услуг (object)
+    """
+    fraud_score: np.ndarray
+    service_class: np.ndarray
+    service_name: np.ndarray
+
+    @classmethod
+    def concatenate(cls, parts: Sequence["BillScores"]) -> "BillScores":
+        return cls(*(np.concatenate(columns) for columns in zip(*parts)))
+
+
+class BillScorer:
+    """
+    Интерфейс оценки счетов: по колонке описаний услуг возвращает оценку мошенничества и класс услуги
+    для каждого счета. Оценка выполняется сразу для всей части файла.
+
+    Атрибуты
+    ---------
+    version: str
+        версия модели (меняется при изменении результатов оценки); обязательна: по ней кешируются оценки,
+        поэтому get_scorer не создает оценщик с пустой версией
+    cacheable: bool
+        результат зависит только от текста услуги, поэтому его можно кешировать (score_cache)
+    """
+    version = ""
+    cacheable = True
+
+    def score(self, services: Sequence[str]) -> BillScores:
+        """
+        Метод для оценки колонки описаний услуг
+
+        Параметры
+        ---------
+        services: Sequence[str]
+            описания услуг
+
+        Возвращаемое значение
+        ---------------------
+        BillScores
+            массивы длины len(services)
+        """
+        raise NotImplementedError
+
+    def split(self, parts: int) -> List["BillScorer"]:
+        """
+        Возвращает оценщики для параллельной обработки parts частей колонки.
+        Оценщики со случайным состоянием должны возвращать независимые копии.
+        """
+        return [self] * parts
+
+
+class RandomBillScorer(BillScorer):
+    """
+    Оценщик-заглушка (как fraud_detector и service_classificator): случайная оценка мошенничества
+    и случайный класс услуги, сгенерированные NumPy сразу для всей колонки.
+    При заданном seed результаты воспроизводимы.
+    Оценка не зависит от текста услуги, поэтому не кешируется: каждый счет получает независимую оценку.
+    """
+    version = "random-1"
+    cacheable = False
+
+    def __init__(self, seed: Optional[int] = None):
+        self._seed_sequence = np.random.SeedSequence(seed)
+        self._rng = np.random.default_rng(self._seed_sequence)
+        self._lock = threading.Lock()
+        self._classes = np.array(list(SERVICE_TYPES), dtype=np.int64)
+        self._names = np.array(list(SERVICE_TYPES.values()), dtype=object)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def score(self, services: Sequence[str]) -> BillScores:
+        size = len(services)
+        with self._lock:
+            fraud_score = self._rng.random(size)
+            idx = self._rng.integers(len(self._classes), size=size)
+        return BillScores(fraud_score=fraud_score, service_class=self._classes[idx], service_name=self._names[idx])
+
+    def split(self, parts: int) -> List["RandomBillScorer"]:
+        with self._lock:
+            children = self._seed_sequence.spawn(parts)
+        scorers = []
+        for child in children:
+            scorer = RandomBillScorer()
+            scorer._seed_sequence = child
+            scorer._rng = np.random.default_rng(child)
+            scorers.append(scorer)
+        return scorers
+
+
+def _score_part(scorer: BillScorer, services: Sequence[str]) -> BillScores:
+    return scorer.score(services)
+
+
+class ProcessPoolBillScorer(BillScorer):
+    """
+    Обертка для тяжелых по CPU моделей: делит колонку на части по chunk_size строк
+    и оценивает их в пуле из workers процессов. Колонки короче chunk_size оцениваются в текущем процессе.
+    Оцениваемая модель должна сериализоваться pickle.
+    """
+
+    def __init__(self, scorer: BillScorer, workers: int, chunk_size: int = 1000):
+        self.scorer = scorer
+        self.version = scorer.version
+        self.cacheable = scorer.cacheable
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn: fork процесса с потоками воркеров импорта небезопасен
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=get_context("spawn"))
+        return self._executor
+
+    def score(self, services: Sequence[str]) -> BillScores:
+        if len(services) <= self.chunk_size:
+            return self.scorer.score(services)
+        services = list(services)
+        parts = [services[start:start + self.chunk_size] for start in range(0, len(services), self.chunk_size)]
+        scorers = self.scorer.split(len(parts))
+        return BillScores.concatenate(list(self._get_executor().map(_score_part, scorers, parts)))
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+_scorer: Optional[BillScorer] = None
+_scorer_lock = threading.Lock()
+
+
+def get_scorer() -> BillScorer:
+    """
+    Возвращает общий для процесса оценщик счетов, создавая его при первом обращении
+    по настройкам BILL_SCORER (путь к классу), BILL_SCORER_OPTIONS (аргументы конструктора),
+    BILL_SCORER_WORKERS (если больше 0 - оценка в пуле процессов)
+    и BILL_SCORE_CACHE_SIZE (если больше 0 - результаты кешируются, см. score_cache).
+
+    Исключения
+    ----------
+    ImproperlyConfigured
+        если у класса оценщика не задана версия (BillScorer.version)
+    """
+    global _scorer
+    with _scorer_lock:
+        if _scorer is None:
+            scorer = import_string(settings.BILL_SCORER)(**settings.BILL_SCORER_OPTIONS)
+            if not scorer.version:
+                raise ImproperlyConfigured("{} must define a non-empty version".format(settings.BILL_SCORER))
+            if settings.BILL_SCORER_WORKERS > 0:
+                scorer = ProcessPoolBillScorer(scorer, workers=settings.BILL_SCORER_WORKERS)
+            if settings.BILL_SCORE_CACHE_SIZE > 0 and scorer.cacheable:
+                # score_cache использует модели, поэтому импортируется только в процессе приложения
+                from main_app.score_cache import CachedBillScorer
+                scorer = CachedBillScorer(scorer, lru_size=settings.BILL_SCORE_CACHE_SIZE)
+            _scorer = scorer
+    return _scorer
+
+
+def reset_scorer() -> None:
+    """
+    Функция для сброса общего оценщика (например, после изменения настроек)
+    """
+    global _scorer
+    with _scorer_lock:
+        scorer = getattr(_scorer, "scorer", _scorer)
+        if isinstance(scorer, ProcessPoolBillScorer):
+            scorer.shutdown()
+        _scorer = None
+
+
+@receiver(setting_changed)
+def reset_scorer_on_setting_changed(sender, setting, **kwargs):
+    if setting.startswith(("BILL_SCORER", "BILL_SCORE_CACHE")):
+        reset_scorer()
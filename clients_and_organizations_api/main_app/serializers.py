@@ -1,6 +1,10 @@
+from datetime import date
+from typing import Tuple
+
+from django.db import models
 from rest_framework import serializers
 
-from main_app.models import Client, Organization, Bill
+from main_app.models import Client, Organization, Bill, ImportJob
 
 
 class ClientSerializer(serializers.ModelSerializer):
@@ -15,7 +19,55 @@ class ClientSerializer(serializers.ModelSerializer):
 class OrganizationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Organization
-        fields = "__all__"
+        exclude = ("row_hash",)
+
+
+class BillListSerializer(serializers.ListSerializer):
+    """
+    Сериализатор списка счетов с быстрым путем для строк Bill.objects.values(*BillListSerializer.values_fields()).
+    Строки уже содержат имена клиента и организации (соединение выполняется в запросе),
+    поэтому объекты моделей не создаются, а поля копируются по заранее составленному списку колонок.
+    Результат совпадает с BillSerializer(many=True) для объектов Bill.
+    Объекты моделей сериализуются обычным путем.
+    """
+    # Поля ответа в порядке BillSerializer (объявленные поля идут сразу после id) и соответствующие им ключи строк values()
+    columns = (
+        ("id", "id"),
+        ("client", "client__name"),
+        ("organization", "organization__name"),
+        ("number", "number"),
+        ("summ", "summ"),
+        ("date", "date"),
+        ("service", "service"),
+        ("fraud_score", "fraud_score"),
+        ("service_class", "service_class"),
+        ("service_name", "service_name"),
+    )
+    # Преобразования значений, повторяющие to_representation полей BillSerializer
+    converters = (
+        ("date", date.isoformat),
+        ("fraud_score", float),
+    )
+
+    @classmethod
+    def values_fields(cls) -> Tuple[str, ...]:
+        return tuple(source for _, source in cls.columns)
+
+    def to_representation(self, data):
+        rows = data.all() if isinstance(data, models.Manager) else data
+        if not isinstance(rows, (list, tuple)):
+            rows = list(rows)
+        if not rows or not isinstance(rows[0], dict):
+            return super().to_representation(rows)
+
+        columns, converters = self.columns, self.converters
+        result = []
+        for row in rows:
+            item = {key: row[source] for key, source in columns}
+            for key, convert in converters:
+                item[key] = convert(item[key])
+            result.append(item)
+        return result
 
 
 class BillSerializer(serializers.ModelSerializer):
@@ -24,4 +76,17 @@ class BillSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Bill
-        fields = "__all__"
+        exclude = ("row_hash",)
+        list_serializer_class = BillListSerializer
+
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    throughput = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = ImportJob
+        fields = (
+            "id", "kind", "state", "file_name", "on_conflict", "rows_processed", "rows_accepted", "rows_rejected",
+            "rows_inserted", "rows_updated", "rows_skipped", "rows_unchanged", "throughput", "error", "duplicate_of",
+            "created_at", "started_at", "finished_at",
+        )
@@ -0,0 +1,282 @@
+import logging
+from contextlib import contextmanager, ExitStack
+from typing import Dict, Iterator, List, Mapping, Sequence, Type
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.backends.signals import connection_created
+from django.db.models import Model
+from django.dispatch import receiver
+
+my_logger = logging.getLogger("my_logger")
+
+
+def is_supported(using: str = DEFAULT_DB_ALIAS) -> bool:
+    """
+    Возвращает True, если база using - SQLite и быстрая загрузка возможна
+    """
+    return connections[using].vendor == "sqlite"
+
+
+@receiver(connection_created)
+def configure_connection(sender, connection, **kwargs):
+    """
+    Переводит базу SQLite в режим журнала SQLITE_JOURNAL_MODE (по умолчанию WAL).
+    В режиме WAL запросы на чтение (списки /api/clients/ и /api/bills/) не блокируются
+    транзакцией импорта и видят данные на момент своего начала.
+    Режим WAL сохраняется в файле базы, для базы в памяти команда ничего не меняет.
+    """
+    if connection.vendor != "sqlite" or not settings.SQLITE_JOURNAL_MODE:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA journal_mode = {}".format(settings.SQLITE_JOURNAL_MODE))
+
+
+class WriteAtomic(transaction.Atomic):
+    """
+    transaction.atomic для транзакций, которые читают, а затем пишут: в SQLite внешняя транзакция
+    начинается командой BEGIN IMMEDIATE, то есть сразу берет блокировку на запись (ожидая ее до timeout базы).
+    Транзакция, начатая обычным BEGIN, берет блокировку только при первой записи, и если параллельная
+    транзакция уже пишет или успела записать после чтения, SQLite сразу завершает ее ошибкой "database is locked".
+    Вложенный блок и другие базы данных работают как обычный transaction.atomic.
+    """
+
+    def __enter__(self):
+        connection = transaction.get_connection(self.using)
+        if connection.vendor != "sqlite" or connection.in_atomic_block:
+            return super().__enter__()
+        # Django 3.2 начинает транзакцию SQLite методом соединения _start_transaction_under_autocommit,
+        # который выполняет BEGIN (DEFERRED): на время входа в блок он заменяется на BEGIN IMMEDIATE
+        connection._start_transaction_under_autocommit = lambda: connection.cursor().execute("BEGIN IMMEDIATE")
+        try:
+            return super().__enter__()
+        finally:
+            del connection._start_transaction_under_autocommit
+
+
+def write_transaction(using: str = DEFAULT_DB_ALIAS) -> WriteAtomic:
+    """
+    Возвращает блок транзакции записи (WriteAtomic) для базы using
+    """
+    return WriteAtomic(using, savepoint=True, durable=False)
+
+
+def _pragma(cursor, name: str):
+    cursor.execute("PRAGMA {}".format(name))
+    return cursor.fetchone()[0]
+
+
+@contextmanager
+def write_optimized(using: str = DEFAULT_DB_ALIAS) -> Iterator[None]:
+    """
+    Контекстный менеджер, настраивающий соединение SQLite на массовую запись:
+    synchronous = NORMAL (в режиме WAL база не повреждается, при сбое питания может потеряться
+    последняя транзакция), кеш страниц IMPORT_SQLITE_CACHE_KB килобайт и временные данные
+    (сортировка при построении индексов) в памяти. После выхода прежние значения восстанавливаются.
+    Внутри уже открытой транзакции SQLite не позволяет менять synchronous, поэтому настройки не меняются.
+    """
+    if connections[using].in_atomic_block:
+        yield
+        return
+    previous: Dict[str, object] = {}
+    with connections[using].cursor() as cursor:
+        for name, value in (
+                ("synchronous", "NORMAL"),
+                ("cache_size", -settings.IMPORT_SQLITE_CACHE_KB),
+                ("temp_store", "MEMORY"),
+        ):
+            previous[name] = _pragma(cursor, name)
+            cursor.execute("PRAGMA {} = {}".format(name, value))
+    try:
+        yield
+    finally:
+        with connections[using].cursor() as cursor:
+            for name, value in previous.items():
+                cursor.execute("PRAGMA {} = {}".format(name, value))
+
+
+def secondary_indexes(model: Type[Model], using: str = DEFAULT_DB_ALIAS) -> Dict[str, str]:
+    """
+    Возвращает неуникальные индексы таблицы модели, созданные через CREATE INDEX: {имя: SQL создания}.
+    Уникальные индексы (unique_together) не возвращаются - они нужны для проверки конфликтов при записи.
+    """
+    table = model._meta.db_table
+    with connections[using].cursor() as cursor:
+        cursor.execute("PRAGMA index_list({})".format(connections[using].ops.quote_name(table)))
+        names = [row[1] for row in cursor.fetchall() if not row[2] and row[3] == "c"]
+        if not names:
+            return {}
+        cursor.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND name IN ({})".format(
+                ", ".join(["%s"] * len(names))
+            ),
+            [table, *names],
+        )
+        return dict(cursor.fetchall())
+
+
+@contextmanager
+def deferred_indexes(model: Type[Model], using: str = DEFAULT_DB_ALIAS) -> Iterator[None]:
+    """
+    Контекстный менеджер, откладывающий обновление неуникальных индексов таблицы модели:
+    индексы удаляются перед загрузкой и создаются заново после нее одной сортировкой.
+    Индексы откладываются, только если в таблице не больше IMPORT_DEFER_INDEXES_MAX_ROWS записей,
+    иначе пересоздание индексов по всей таблице дольше их обновления.
+    Менеджер нужно использовать внутри транзакции: при ошибке удаление индексов откатывается,
+    а запросы на чтение (в режиме WAL) до фиксации транзакции используют прежние индексы.
+    """
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM {}".format(connection.ops.quote_name(model._meta.db_table)))
+        rows = cursor.fetchone()[0]
+    indexes = secondary_indexes(model, using) if rows <= settings.IMPORT_DEFER_INDEXES_MAX_ROWS else {}
+    with connection.cursor() as cursor:
+        for name in indexes:
+            cursor.execute("DROP INDEX {}".format(connection.ops.quote_name(name)))
+    yield
+    with connection.cursor() as cursor:
+        for sql in indexes.values():
+            cursor.execute(sql)
+    if indexes:
+        my_logger.info(f"Пересозданы индексы таблицы {model._meta.db_table}: {', '.join(indexes)}")
+
+
+@contextmanager
+def bulk_load(models: Sequence[Type[Model]], using: str = DEFAULT_DB_ALIAS) -> Iterator[None]:
+    """
+    Контекстный менеджер быстрой загрузки в SQLite: соединение настраивается на массовую запись
+    (write_optimized), вся загрузка выполняется в одной транзакции, а неуникальные индексы
+    таблиц models обновляются один раз в конце (deferred_indexes).
+    Транзакция держит блокировку базы на запись до конца загрузки: читающие запросы (в режиме WAL)
+    не ждут, а другие импорты ждут ее освобождения. Промежуточный прогресс импорта,
+    записанный в этой транзакции, виден остальным соединениям только после ее фиксации.
+
+    Параметры
+    ---------
+    models: Sequence[Type[Model]]
+        модели, в таблицы которых выполняется загрузка
+    using: str
+        алиас базы данных
+    """
+    with write_optimized(using), write_transaction(using), ExitStack() as stack:
+        for model in models:
+            stack.enter_context(deferred_indexes(model, using))
+        yield
+
+
+def _insert_fields(model: Type[Model]) -> List:
+    return [field for field in model._meta.concrete_fields if not field.primary_key]
+
+
+def insert_objects(
+        model: Type[Model],
+        objects: List[Model],
+        ignore_conflicts: bool = False,
+        using: str = DEFAULT_DB_ALIAS,
+) -> None:
+    """
+    Функция для записи новых объектов одним вызовом executemany без построения запросов ORM.
+    Значения полей приводятся к формату базы так же, как в bulk_create (get_db_prep_save).
+    id созданных записей объектам не присваиваются.
+
+    Параметры
+    ---------
+    model: Type[Model]
+        модель
+    objects: List[Model]
+        объекты для записи
+    ignore_conflicts: bool
+        пропускать объекты, нарушающие уникальность (INSERT OR IGNORE), иначе - ошибка IntegrityError
+    using: str
+        алиас базы данных
+    """
+    if not objects:
+        return
+    connection = connections[using]
+    fields = _insert_fields(model)
+    sql = "INSERT {}INTO {} ({}) VALUES ({})".format(
+        "OR IGNORE " if ignore_conflicts else "",
+        connection.ops.quote_name(model._meta.db_table),
+        ", ".join(connection.ops.quote_name(field.column) for field in fields),
+        ", ".join(["%s"] * len(fields)),
+    )
+    rows = [
+        [field.get_db_prep_save(getattr(obj, field.attname), connection) for field in fields]
+        for obj in objects
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def increment_objects(
+        model: Type[Model],
+        increments: Mapping[int, Mapping[str, int]],
+        using: str = DEFAULT_DB_ALIAS,
+) -> None:
+    """
+    Функция для увеличения числовых полей многих записей одним вызовом executemany
+    (аналог utils.increment_fields без построения CASE/WHEN выражений)
+
+    Параметры
+    ---------
+    model: Type[Model]
+        модель
+    increments: Mapping[int, Mapping[str, int]]
+        словарь вида {pk: {поле: на сколько увеличить}}
+    using: str
+        алиас базы данных
+    """
+    connection = connections[using]
+    quote_name = connection.ops.quote_name
+    fields = sorted({field for deltas in increments.values() for field in deltas})
+    rows = [
+        [deltas.get(field, 0) for field in fields] + [pk]
+        for pk, deltas in increments.items() if any(deltas.values())
+    ]
+    if not rows:
+        return
+    sql = "UPDATE {} SET {} WHERE {} = %s".format(
+        quote_name(model._meta.db_table),
+        ", ".join("{0} = {0} + %s".format(quote_name(model._meta.get_field(field).column)) for field in fields),
+        quote_name(model._meta.pk.column),
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def update_objects(
+        model: Type[Model],
+        objects: List[Model],
+        fields: Sequence[str],
+        using: str = DEFAULT_DB_ALIAS,
+) -> None:
+    """
+    Функция для обновления полей fields существующих объектов (по id) одним вызовом executemany
+
+    Параметры
+    ---------
+    model: Type[Model]
+        модель
+    objects: List[Model]
+        объекты с заполненным id
+    fields: Sequence[str]
+        обновляемые поля
+    using: str
+        алиас базы данных
+    """
+    if not objects:
+        return
+    connection = connections[using]
+    fields = [model._meta.get_field(name) for name in fields]
+    pk = model._meta.pk
+    sql = "UPDATE {} SET {} WHERE {} = %s".format(
+        connection.ops.quote_name(model._meta.db_table),
+        ", ".join("{} = %s".format(connection.ops.quote_name(field.column)) for field in fields),
+        connection.ops.quote_name(pk.column),
+    )
+    rows = [
+        [field.get_db_prep_save(getattr(obj, field.attname), connection) for field in fields] + [obj.pk]
+        for obj in objects
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
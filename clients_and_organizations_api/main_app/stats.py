@@ -0,0 +1,111 @@
+from collections import Counter, defaultdict
+from typing import Iterable, DefaultDict
+
+from django.db import transaction
+from django.db.models import Count, Sum, Q, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from main_app import utils
+from main_app.models import Client, Organization, Bill, ClientStats
+from main_app.response_cache import bump_data_version_on_commit
+
+# Количество записей ClientStats в одном INSERT при полном пересчете
+REBUILD_BATCH_SIZE = 1000
+
+
+class ClientStatsDelta:
+    """
+    Накопитель изменений агрегированных данных клиентов за одну часть импорта.
+    Изменения применяются одним пакетным UPDATE через apply().
+    """
+
+    def __init__(self):
+        self.increments: DefaultDict[int, Counter] = defaultdict(Counter)
+
+    def add_organizations(self, organizations: Iterable[Organization]) -> None:
+        for organization in organizations:
+            self.increments[organization.client_id]["organizations_count"] += 1
+
+    def add_bill(self, bill: Bill, sign: int = 1) -> None:
+        """
+        Учитывает добавленный счет (sign=1) или удаляет вклад прежней версии счета (sign=-1)
+        """
+        counters = self.increments[bill.client_id]
+        counters["bills_count"] += sign
+        counters["total_summ"] += sign * bill.summ
+        counters["high_fraud_bills_count"] += sign * (bill.fraud_score >= utils.FRAUD_SCORE_THRESHOLD)
+
+    def apply(self, fast: bool = False) -> None:
+        """
+        Применяет накопленные изменения. Отсутствующие записи ClientStats создаются с нулевыми значениями.
+        Если fast=True, записи обновляются через executemany (sqlite_loader).
+        """
+        if not self.increments:
+            return
+        ensure_client_stats(self.increments)
+        utils.increment_fields(ClientStats, self.increments, fast=fast)
+
+
+def ensure_client_stats(client_ids: Iterable[int]) -> None:
+    """
+    Функция для создания пустых записей ClientStats для клиентов, у которых их еще нет
+    """
+    ClientStats.objects.bulk_create(
+        [ClientStats(client_id=client_id) for client_id in client_ids],
+        batch_size=REBUILD_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def rebuild_client_stats() -> int:
+    """
+    Функция для полного пересчета ClientStats по таблицам организаций и счетов.
+    Агрегаты всех клиентов считаются одним запросом с подзапросами по организациям и счетам.
+
+    Возвращаемое значение
+    ---------------------
+    int
+        количество пересчитанных клиентов
+    """
+    organizations = (
+        Organization.objects.filter(client=OuterRef("pk"))
+        .order_by()
+        .values("client")
+        .annotate(total=Count("id"))
+        .values("total")
+    )
+    bills = Bill.objects.filter(client=OuterRef("pk")).order_by().values("client")
+    rows = Client.objects.annotate(
+        organizations_count=Coalesce(Subquery(organizations), Value(0)),
+        bills_count=Coalesce(Subquery(bills.annotate(total=Count("id")).values("total")), Value(0)),
+        total_summ=Coalesce(Subquery(bills.annotate(total=Sum("summ")).values("total")), Value(0)),
+        high_fraud_bills_count=Coalesce(
+            Subquery(
+                bills.annotate(
+                    total=Count("id", filter=Q(fraud_score__gte=utils.FRAUD_SCORE_THRESHOLD))
+                ).values("total")
+            ),
+            Value(0),
+        ),
+    ).values_list("id", "organizations_count", "bills_count", "total_summ", "high_fraud_bills_count")
+
+    rebuilt = 0
+    with transaction.atomic():
+        ClientStats.objects.all().delete()
+        stats = []
+        for client_id, organizations_count, bills_count, total_summ, high_fraud_bills_count in rows.iterator():
+            stats.append(ClientStats(
+                client_id=client_id,
+                organizations_count=organizations_count,
+                bills_count=bills_count,
+                total_summ=total_summ,
+                high_fraud_bills_count=high_fraud_bills_count,
+            ))
+            if len(stats) == REBUILD_BATCH_SIZE:
+                ClientStats.objects.bulk_create(stats)
+                rebuilt += len(stats)
+                stats = []
+        ClientStats.objects.bulk_create(stats)
+        rebuilt += len(stats)
+        bump_data_version_on_commit()
+    return rebuilt
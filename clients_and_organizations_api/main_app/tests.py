@@ -1,3 +1,1606 @@
-from django.test import TestCase
+import asyncio
+import csv
+import datetime
+import decimal
+import io
+import itertools
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+import zipfile
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+import pydantic
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DEFAULT_DB_ALIAS, connection, connections, IntegrityError, OperationalError
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from rest_framework.exceptions import NotFound
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework.throttling import BaseThrottle
+
+from benchmarks import generate, serving
+from main_app import utils, response_cache, importers, metrics, sqlite_loader, jobs, readers
+from main_app.exceptions import UnknownBillFormatError
+from main_app.formats import BILL_FIELDS, BUILTIN_BILL_FORMATS, bill_formats
+from main_app.renderers import FastJSONRenderer
+from main_app.score_cache import CachedBillScorer, invalidate_service_scores
+from main_app.scoring import (
+    BillScorer, BillScores, RandomBillScorer, ProcessPoolBillScorer, SERVICE_TYPES, get_scorer,
+)
+from main_app.models import (
+    Client, Organization, Bill, ImportJob, ImportBatch, BillColumnMapping, ClientStats, DataVersion, ServiceScore,
+)
+from main_app.serializers import BillSerializer, BillListSerializer
+from main_app.views import BillsViewSet, ClientsViewSet
+from main_app.validation import validate_bills_frame, normalize_bills_frame, format_reasons
+
+
+def make_xlsx(sheets: dict, name: str) -> SimpleUploadedFile:
+    """
+    Собирает xlsx файл в памяти из словаря {имя листа: список строк}
+    """
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
+        for sheet_name, rows in sheets.items():
+            pd.DataFrame(rows).to_excel(writer, sheet_name=sheet_name, index=False)
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+def make_csv(rows: list, name: str) -> SimpleUploadedFile:
+    """
+    Собирает CSV файл в памяти из списка строк
+    """
+    return SimpleUploadedFile(name, pd.DataFrame(rows).to_csv(index=False).encode("utf-8"))
+
+
+def make_parquet(rows: list, name: str) -> SimpleUploadedFile:
+    """
+    Собирает Parquet файл в памяти из списка строк
+    """
+    buffer = io.BytesIO()
+    pd.DataFrame(rows).to_parquet(buffer, index=False)
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+class ResolveClientsAndOrganizationsTestCase(TestCase):
+    def setUp(self):
+        self.client1 = Client.objects.create(name="client1")
+        self.client2 = Client.objects.create(name="client2")
+        self.org1 = Organization.objects.create(name="OOO Org", address="", client=self.client1)
+        self.org2 = Organization.objects.create(name="OOO Org", address="", client=self.client2)
+
+    def test_organization_is_matched_by_client_and_name(self):
+        resolved = utils.resolve_clients_and_organizations(
+            [("client1", "OOO Org"), ("client2", "OOO Org"), ("client1", "OOO Org")]
+        )
+        self.assertEqual(resolved, {
+            ("client1", "OOO Org"): (self.client1.id, self.org1.id),
+            ("client2", "OOO Org"): (self.client2.id, self.org2.id),
+        })
+
+    def test_unknown_pairs_are_skipped(self):
+        resolved = utils.resolve_clients_and_organizations([("client3", "OOO Org"), ("client1", "Unknown")])
+        self.assertEqual(resolved, {})
+
+
+class UploadTestCase(TestCase):
+    """
+    Базовый класс тестов загрузки файлов: импорт выполняется сразу, файлы сохраняются во временную папку
+    """
+
+    def setUp(self):
+        self.api_client = APIClient()
+        response_cache.get_cache().clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root, IMPORT_JOBS_EAGER=True)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+class BillsUploadTestCase(UploadTestCase):
+    def setUp(self):
+        super().setUp()
+        client1 = Client.objects.create(name="client1")
+        client2 = Client.objects.create(name="client2")
+        Organization.objects.create(name="OOO Org", address="", client=client1)
+        Organization.objects.create(name="OOO Org", address="", client=client2)
+
+    def test_upload_bills(self):
+        rows = [
+            {"client_name": "client1", "client_org": "OOO Org", "№": 1, "sum": 100,
+             "date": pd.Timestamp("2022-01-01"), "service": "консультация"},
+            {"client_name": "client2", "client_org": "OOO Org", "№": 1, "sum": 200,
+             "date": pd.Timestamp("2022-01-02"), "service": "лечение"},
+            {"client_name": "client3", "client_org": "OOO Org", "№": 2, "sum": 300,
+             "date": pd.Timestamp("2022-01-03"), "service": "лечение"},
+            {"client_name": "client1", "client_org": "OOO Org", "№": 3, "sum": 400,
+             "date": pd.Timestamp("2022-01-04"), "service": "-"},
+        ]
+        response = self.api_client.post(
+            "/api/bills/upload/", {"file": make_xlsx({"Sheet1": rows}, "bills.xlsx")}, format="multipart"
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(
+            sorted(Bill.objects.values_list("client__name", "organization__client__name", "summ")),
+            [("client1", "client1", 100), ("client2", "client2", 200)],
+        )
+
+        response = self.api_client.get(f"/api/imports/{response.data['id']}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["kind"], ImportJob.KIND_BILLS)
+        self.assertEqual(response.data["state"], ImportJob.STATE_DONE)
+        self.assertEqual(
+            (response.data["rows_processed"], response.data["rows_accepted"], response.data["rows_rejected"]),
+            (4, 2, 2),
+        )
+
+    def test_upload_bills_on_conflict(self):
+        rows = [
+            {"client_name": "client1", "client_org": "OOO Org", "№": number, "sum": 100 * number,
+             "date": pd.Timestamp("2022-01-01"), "service": "консультация"}
+            for number in (1, 2, 2, 3)
+        ]
+
+        def upload(on_conflict):
+            response = self.api_client.post(
+                "/api/bills/upload/",
+                {"file": make_xlsx({"Sheet1": rows}, "bills.xlsx"), "on_conflict": on_conflict},
+                format="multipart",
+            )
+            self.assertEqual(response.status_code, 202)
+            return ImportJob.objects.get(id=response.data["id"])
+
+        job = upload("skip")
+        self.assertEqual((job.rows_inserted, job.rows_updated, job.rows_skipped), (3, 0, 1))
+        # строки, уже записанные с теми же значениями, не конфликтуют с существующими счетами
+        job = upload("error")
+        self.assertEqual(
+            (job.state, job.rows_inserted, job.rows_updated, job.rows_skipped, job.rows_unchanged, job.rows_rejected),
+            ("done", 0, 0, 0, 4, 0),
+        )
+
+        rows[0]["sum"] = 150
+        job = upload("update")
+        self.assertEqual((job.rows_inserted, job.rows_updated, job.rows_skipped, job.rows_unchanged), (0, 1, 0, 3))
+        self.assertEqual(Bill.objects.get(number=1).summ, 150)
+        self.assertEqual(Bill.objects.count(), 3)
+
+        fraud_weight = Organization.objects.get(client__name="client1").fraud_weight
+        call_command("recompute_fraud_weight", stdout=io.StringIO())
+        self.assertEqual(Organization.objects.get(client__name="client1").fraud_weight, fraud_weight)
+
+        stats = ClientStats.objects.filter(client__name="client1").values_list(
+            "bills_count", "total_summ", "high_fraud_bills_count"
+        )
+        expected = stats.get()
+        self.assertEqual(expected[:2], (3, 650))
+        call_command("rebuild_client_stats", stdout=io.StringIO())
+        self.assertEqual(stats.get(), expected)
+
+        rows[0]["sum"] = 175
+        job = upload("error")
+        self.assertEqual(job.state, ImportJob.STATE_FAILED)
+
+        response = self.api_client.post(
+            "/api/bills/upload/",
+            {"file": make_xlsx({"Sheet1": rows}, "bills.xlsx"), "on_conflict": "replace"},
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_upload_same_file_twice(self):
+        rows = [
+            {"client_name": "client1", "client_org": "OOO Org", "№": 1, "sum": 100,
+             "date": pd.Timestamp("2022-01-01"), "service": "консультация"},
+        ]
+        content = make_xlsx({"Sheet1": rows}, "bills.xlsx").read()
+
+        def upload(on_conflict="error"):
+            return self.api_client.post(
+                "/api/bills/upload/",
+                {"file": SimpleUploadedFile("bills.xlsx", content), "on_conflict": on_conflict},
+                format="multipart",
+            )
+
+        first = upload()
+        self.assertEqual(first.status_code, 202)
+        with mock.patch("main_app.jobs.enqueue") as enqueue:
+            response = upload()
+        enqueue.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            (response.data["state"], response.data["duplicate_of"], response.data["rows_processed"]),
+            (ImportJob.STATE_DONE, first.data["id"], 0),
+        )
+        self.assertEqual(Bill.objects.count(), 1)
+
+        # в другом режиме on_conflict файл импортируется, но неизмененная строка не записывается
+        response = upload("update")
+        self.assertEqual(response.status_code, 202)
+        job = ImportJob.objects.get(id=response.data["id"])
+        self.assertEqual((job.rows_processed, job.rows_updated, job.rows_unchanged), (1, 0, 1))
+
+        # файл задачи, завершившейся ошибкой, импортируется повторно
+        ImportJob.objects.filter(id=first.data["id"]).update(state=ImportJob.STATE_FAILED)
+        self.assertEqual(upload().status_code, 202)
+        self.assertEqual(ImportBatch.objects.get(on_conflict="error").job_id, ImportJob.objects.latest("id").id)
+
+    def test_upload_requires_supported_format(self):
+        response = self.api_client.post(
+            "/api/bills/upload/", {"file": SimpleUploadedFile("bills.txt", b"")}, format="multipart"
+        )
+        self.assertEqual(response.status_code, 415)
+        self.assertFalse(ImportJob.objects.exists())
+
+    def test_failed_import_keeps_committed_chunks(self):
+        client1 = Client.objects.get(name="client1")
+        organization = Organization.objects.get(client=client1)
+        Bill.objects.create(
+            number=3, summ=1, date=datetime.date(2022, 1, 1), service="лечение",
+            fraud_score=0.1, service_class=1, service_name="лечение", client=client1, organization=organization,
+        )
+        call_command("rebuild_client_stats", stdout=io.StringIO())
+        rows = [
+            {"client_name": "client1", "client_org": "OOO Org", "№": number, "sum": "100", "date": "2022-01-01",
+             "service": "лечение"}
+            for number in (1, 2, 3, 4)
+        ]
+        # счет 3 конфликтует с существующим: вторая часть файла не записывается
+        with self.assertRaises(IntegrityError):
+            importers.import_bills(make_csv(rows, "bills.csv"), chunk_size=2)
+        committed = [] if importers.fast_loader_enabled() else [1, 2]
+        self.assertEqual(sorted(Bill.objects.values_list("number", flat=True)), sorted(committed + [3]))
+
+        # счетчики записанной части согласованы с записанными счетами
+        stats = ClientStats.objects.filter(client=client1).values_list("bills_count", "total_summ")
+        self.assertEqual(stats.get(), (1 + len(committed), 1 + 100 * len(committed)))
+        call_command("rebuild_client_stats", stdout=io.StringIO())
+        self.assertEqual(stats.get(), (1 + len(committed), 1 + 100 * len(committed)))
+
+        # повторный импорт после устранения конфликта записывает только оставшиеся строки
+        Bill.objects.filter(number=3).delete()
+        result = importers.import_bills(make_csv(rows, "bills.csv"), chunk_size=2)
+        self.assertEqual((result.rows_inserted, result.rows_unchanged), (4 - len(committed), len(committed)))
+        self.assertEqual(sorted(Bill.objects.values_list("number", flat=True)), [1, 2, 3, 4])
+
+
+class ClientsUploadTestCase(UploadTestCase):
+    def test_upload_clients(self):
+        xlsx_obj = make_xlsx({
+            "client": [{"name": "client1"}, {"name": "client2"}],
+            "organization": [
+                {"client_name": "client1", "name": "org1", "address": "г Москва"},
+                {"client_name": "client2", "name": "org1", "address": "-"},
+                {"client_name": "client3", "name": "org1", "address": None},
+            ],
+        }, "client_org.xlsx")
+        response = self.api_client.post("/api/clients/upload/", {"file": xlsx_obj}, format="multipart")
+        self.assertEqual(response.status_code, 202)
+        job = ImportJob.objects.get()
+        self.assertEqual(job.state, ImportJob.STATE_DONE)
+        self.assertEqual((job.rows_processed, job.rows_accepted, job.rows_rejected), (5, 4, 1))
+        self.assertEqual(
+            sorted(Organization.objects.values_list("client__name", "name", "address")),
+            [("client1", "org1", "Адрес: г Москва"), ("client2", "org1", "")],
+        )
+        response = self.api_client.get("/api/clients/")
+        self.assertEqual(
+            [(client["name"], client["organizations_count"], client["all_sums"]) for client in response.data["results"]],
+            [("client1", 1, None), ("client2", 1, None)],
+        )
+
+    def test_upload_changed_clients(self):
+        def upload(organizations):
+            xlsx_obj = make_xlsx({
+                "client": [{"name": "client1"}, {"name": "client2"}],
+                "organization": organizations,
+            }, "client_org.xlsx")
+            response = self.api_client.post(
+                "/api/clients/upload/", {"file": xlsx_obj, "on_conflict": "update"}, format="multipart"
+            )
+            self.assertEqual(response.status_code, 202)
+            return ImportJob.objects.get(id=response.data["id"])
+
+        organizations = [
+            {"client_name": "client1", "name": "org1", "address": "г Москва"},
+            {"client_name": "client2", "name": "org2", "address": "г Казань"},
+        ]
+        upload(organizations)
+        organizations[1]["address"] = "г Самара"
+        job = upload(organizations + [{"client_name": "client1", "name": "org3", "address": None}])
+        self.assertEqual(
+            (job.rows_processed, job.rows_inserted, job.rows_updated, job.rows_unchanged, job.rows_rejected),
+            (5, 1, 1, 3, 0),
+        )
+        self.assertEqual(Organization.objects.get(name="org2").address, "Адрес: г Самара")
+        self.assertEqual(ClientStats.objects.get(client__name="client1").organizations_count, 2)
+
+
+class UpsertObjectsTestCase(TestCase):
+    def setUp(self):
+        self.client1 = Client.objects.create(name="client1")
+
+    def test_rows_inserted_concurrently_are_not_counted(self):
+        fetch_existing = utils.fetch_existing
+        calls = []
+
+        def concurrent_insert(*args):
+            # между поиском существующих записей и INSERT параллельный импорт добавил организацию org1
+            calls.append(args)
+            if len(calls) == 1:
+                Organization.objects.create(name="org1", address="old", client=self.client1)
+                return {}
+            return fetch_existing(*args)
+
+        for on_conflict, expected in ((ImportJob.ON_CONFLICT_SKIP, "old"), (ImportJob.ON_CONFLICT_UPDATE, "new")):
+            Organization.objects.all().delete()
+            calls.clear()
+            organizations = [
+                Organization(name=name, address="new", client=self.client1) for name in ("org1", "org2")
+            ]
+            with mock.patch("main_app.utils.fetch_existing", side_effect=concurrent_insert):
+                result = utils.upsert_objects(
+                    Organization, organizations, key_fields=("name", "client_id"), update_fields=("address",),
+                    on_conflict=on_conflict, fetch_fields=("address",),
+                )
+            self.assertEqual(len(calls), 2)
+            self.assertEqual([organization.name for organization in result.inserted], ["org2"])
+            self.assertEqual(
+                (len(result.updated), result.skipped), (1, 0) if on_conflict == ImportJob.ON_CONFLICT_UPDATE else (0, 1)
+            )
+            self.assertEqual(result.previous[("org1", self.client1.id)], ("old",))
+            self.assertEqual(
+                sorted(Organization.objects.values_list("name", "address")), [("org1", expected), ("org2", "new")]
+            )
+
+
+class FraudWeightTestCase(TestCase):
+    def setUp(self):
+        client = Client.objects.create(name="client1")
+        self.org1 = Organization.objects.create(name="org1", address="", client=client)
+        self.org2 = Organization.objects.create(name="org2", address="", client=client)
+        for number, (organization, fraud_score) in enumerate(
+                [(self.org1, 0.95), (self.org1, 0.9), (self.org1, 0.1), (self.org2, 0.5)], start=1
+        ):
+            Bill.objects.create(
+                number=number, summ=100, date="2022-01-01", service="консультация", fraud_score=fraud_score,
+                service_class=1, service_name="консультация", client=client, organization=organization,
+            )
+
+    def test_increment_fraud_weights(self):
+        utils.increment_fraud_weights({self.org1.id: 2, self.org2.id: 1})
+        utils.increment_fraud_weights({self.org1.id: 1})
+        self.assertEqual(
+            dict(Organization.objects.values_list("name", "fraud_weight")), {"org1": 3, "org2": 1}
+        )
+
+    def test_recompute_fraud_weight_command(self):
+        Organization.objects.update(fraud_weight=10)
+        call_command("recompute_fraud_weight", stdout=io.StringIO())
+        self.assertEqual(
+            dict(Organization.objects.values_list("name", "fraud_weight")), {"org1": 2, "org2": 0}
+        )
+
+
+class XlsxStreamingTestCase(TestCase):
+    def test_iter_bills_frames(self):
+        rows = [
+            {"client": "client2", "organization": f"org{idx}", "bill_number": idx, "created_date": None,
+             "total_sum": idx * 10, "service_name": "лечение"}
+            for idx in range(1, 8)
+        ]
+        xlsx_obj = make_xlsx({"Sheet1": rows}, "bills.xlsx")
+        frames = list(utils.iter_bills_frames(xlsx_obj, chunk_size=3))
+        self.assertEqual([frame.index.to_list() for frame in frames], [[1, 2, 3], [4, 5, 6], [7]])
+        self.assertEqual(utils.chunk_to_records(frames[2]), [{
+            "client_name": "client2", "client_org": "org7", "number": 7,
+            "summ": 70, "date": None, "service": "лечение",
+        }])
+        self.assertEqual(
+            utils.get_bills_data(xlsx_obj),
+            list(itertools.chain.from_iterable(utils.chunk_to_records(frame) for frame in frames)),
+        )
+
+    def test_get_clients_and_organizations_data(self):
+        xlsx_obj = make_xlsx({
+            "client": [{"name": "client1"}, {"name": "client2"}],
+            "organization": [{"client_name": "client1", "name": "org1", "address": "-"}],
+        }, "client_org.xlsx")
+        self.assertEqual(utils.get_clients_and_organizations_data(xlsx_obj), {
+            "clients_data": ["client1", "client2"],
+            "organizations_data": [{"client_name": "client1", "name": "org1", "address": "-"}],
+        })
+
+
+@unittest.skipUnless(readers.parquet_supported(), "для чтения Parquet нужен pyarrow")
+class ColumnarFormatsTestCase(UploadTestCase):
+    # строки в формате client1: последние две невалидны (дата не в формате ISO и нечисловой номер)
+    rows = [
+        {"client_name": "client1", "client_org": "OOO Org", "№": "1", "sum": "100", "date": "2022-01-01",
+         "service": "консультация", "comment": "не читается"},
+        {"client_name": "client1", "client_org": "OOO Org", "№": "2", "sum": "200.5", "date": "2022-01-02 10:30",
+         "service": "лечение", "comment": ""},
+        {"client_name": "client1", "client_org": "OOO Org", "№": "3", "sum": "300", "date": "02.01.2022",
+         "service": "лечение", "comment": ""},
+        {"client_name": "client1", "client_org": "OOO Org", "№": "x", "sum": "400", "date": "2022-01-04",
+         "service": "лечение", "comment": ""},
+    ]
+
+    def setUp(self):
+        super().setUp()
+        Organization.objects.create(name="OOO Org", address="", client=Client.objects.create(name="client1"))
+
+    def parse(self, file_obj):
+        chunks = list(importers.iter_parsed_bills(file_obj))
+        return pd.concat([chunk.frame for chunk in chunks]), sorted(itertools.chain(*(chunk.rejected for chunk in chunks)))
+
+    def test_formats_parse_alike(self):
+        xlsx_rows = [
+            dict(row, date=pd.Timestamp(row["date"]) if row["date"][4] == "-" else row["date"]) for row in self.rows
+        ]
+        expected_frame, expected_rejected = self.parse(make_xlsx({"Sheet1": xlsx_rows}, "bills.xlsx"))
+        self.assertEqual(expected_rejected, [3, 4])
+        for file_obj in (make_csv(self.rows, "bills.csv"), make_parquet(self.rows, "bills.parquet")):
+            frame, rejected = self.parse(file_obj)
+            pd.testing.assert_frame_equal(frame, expected_frame)
+            self.assertEqual(rejected, expected_rejected)
+
+        typed = make_parquet([
+            {"client_name": "client1", "client_org": "OOO Org", "№": 1, "sum": 100.0,
+             "date": pd.Timestamp("2022-01-01"), "service": "консультация"},
+        ], "bills.parquet")
+        frame, rejected = self.parse(typed)
+        pd.testing.assert_frame_equal(frame, expected_frame.iloc[:1])
+
+    def test_parquet_reads_only_format_columns(self):
+        file_obj = make_parquet(self.rows, "bills.parquet")
+        with mock.patch("pyarrow.parquet.ParquetFile.iter_batches", autospec=True,
+                        side_effect=lambda self, **kwargs: iter(())) as iter_batches:
+            list(utils.iter_bills_frames(file_obj))
+        self.assertEqual(
+            sorted(iter_batches.call_args.kwargs["columns"]), sorted(BUILTIN_BILL_FORMATS["client1"])
+        )
+
+    def test_detect_file_format(self):
+        self.assertEqual(readers.detect_file_format(make_csv(self.rows, "bills.CSV")), readers.FORMAT_CSV)
+        self.assertEqual(readers.detect_file_format(io.BytesIO(make_parquet(self.rows, "x").read())),
+                         readers.FORMAT_PARQUET)
+        self.assertEqual(readers.detect_file_format(io.BytesIO(make_xlsx({"a": []}, "x").read())),
+                         readers.FORMAT_XLSX)
+
+    def test_upload_csv_and_parquet(self):
+        response = self.api_client.post(
+            "/api/bills/upload/", {"file": make_csv(self.rows, "bills.csv")}, format="multipart"
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual((response.data["state"], response.data["rows_accepted"]), (ImportJob.STATE_DONE, 2))
+        self.assertEqual(sorted(Bill.objects.values_list("number", "summ")), [(1, 100), (2, 200)])
+
+        organizations = [
+            {"client_name": "client2", "name": None, "address": None},
+            {"client_name": "client3", "name": "org3", "address": "г Москва"},
+            {"client_name": "client3", "name": "org4", "address": None},
+        ]
+        self.assertEqual(utils.get_clients_and_organizations_data(make_parquet(organizations, "c.parquet")), {
+            "clients_data": ["client2", "client3"],
+            "organizations_data": [
+                {"client_name": "client3", "name": "org3", "address": "г Москва"},
+                {"client_name": "client3", "name": "org4", "address": None},
+            ],
+        })
+        response = self.api_client.post(
+            "/api/clients/upload/", {"file": make_parquet(organizations, "client_org.parquet")}, format="multipart"
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual((response.data["rows_processed"], response.data["rows_accepted"]), (4, 4))
+        self.assertEqual(
+            sorted(Organization.objects.filter(client__name="client3").values_list("name", "address")),
+            [("org3", "Адрес: г Москва"), ("org4", "")],
+        )
+
+
+class BillsValidationTestCase(TestCase):
+    rows = [
+        ("client1", "org1", 1, 100, pd.Timestamp("2022-01-01"), "консультация"),
+        ("client1", "org1", "12", "100.5", datetime.datetime(2022, 1, 2), "лечение"),
+        ("client1", "org1", 1.5, 10.5, pd.Timestamp("2022-01-03"), 123),
+        (" ", "org1", 2, 100, pd.Timestamp("2022-01-04"), "лечение"),
+        ("client1", None, 3, 100, pd.Timestamp("2022-01-05"), "лечение"),
+        ("client1", "org1", "1.5", 100, pd.Timestamp("2022-01-06"), "лечение"),
+        ("client1", "org1", None, 100, pd.Timestamp("2022-01-07"), "лечение"),
+        ("client1", "org1", 4, "сто", pd.Timestamp("2022-01-08"), "лечение"),
+        ("client1", "org1", 5, None, pd.Timestamp("2022-01-09"), "лечение"),
+        ("client1", "org1", 6, 100, "2022-01", "лечение"),
+        ("client1", "org1", 7, 100, None, "лечение"),
+        ("client1", "org1", 8, 100, pd.Timestamp("2022-01-10"), " - "),
+        ("client1", "org1", 9, 100, pd.Timestamp("2022-01-11"), None),
+        ("client1", "org1", 10, 100, pd.Timestamp("2022-01-12"), datetime.datetime(2022, 1, 1)),
+        (123, "org1", " 11 ", "1e3", pd.Timestamp("2022-01-13"), "лечение"),
+    ]
+
+    def test_columnar_validation_agrees_with_bill_obj_model(self):
+        frame = utils.make_frame(self.rows, columns=BILL_FIELDS)
+        expected = []
+        for row in self.rows:
+            try:
+                utils.BillObjModel(**dict(zip(BILL_FIELDS, row)))
+            except pydantic.ValidationError:
+                expected.append(False)
+            else:
+                expected.append(True)
+
+        accepted, reasons = validate_bills_frame(frame)
+        self.assertEqual(accepted.to_list(), expected)
+        self.assertEqual(reasons.index.to_list(), [idx for idx, ok in enumerate(expected) if not ok])
+        self.assertEqual(format_reasons(reasons)[3], "client_name")
+        self.assertEqual(format_reasons(reasons)[9], "date")
+
+    def test_normalize_bills_frame(self):
+        frame = utils.make_frame(self.rows, columns=BILL_FIELDS)
+        accepted, _ = validate_bills_frame(frame)
+        normalized = normalize_bills_frame(frame[accepted])
+        self.assertEqual(normalized["number"].to_list(), [1, 12, 1, 11])
+        self.assertEqual(normalized["summ"].to_list(), [100, 100, 10, 1000])
+        self.assertEqual(normalized["service"].to_list(), ["консультация", "лечение", "123", "лечение"])
+        self.assertEqual(normalized["date"].to_list()[0], datetime.date(2022, 1, 1))
+
+
+class BillFormatsTestCase(TestCase):
+    def test_detect_builtin_formats(self):
+        self.assertEqual(
+            bill_formats.detect(["client_org", "client_name", "№", "sum", "date", "service"]).name, "client1"
+        )
+        self.assertEqual(
+            bill_formats.detect(["client", "organization", "bill_number", "created_date", "total_sum",
+                                 "service_name", "comment"]).name,
+            "client2",
+        )
+        with self.assertRaises(UnknownBillFormatError):
+            bill_formats.detect(["client", "organization"])
+
+    def test_format_from_db(self):
+        header = ["Клиент", "Организация", "Номер", "Сумма", "Дата", "Услуга"]
+        with self.assertRaises(UnknownBillFormatError):
+            bill_formats.detect(header)
+        BillColumnMapping.objects.create(name="client4", columns=dict(zip(header, BILL_FIELDS)))
+        bill_format = bill_formats.detect(header)
+        self.assertEqual(bill_format.name, "client4")
+
+        frame = utils.make_frame([("client4", "org", 1, 10, None, "лечение")], columns=header)
+        self.assertEqual(bill_format.normalize(frame).columns.to_list(), list(BILL_FIELDS))
+
+        BillColumnMapping.objects.all().delete()
+        with self.assertRaises(UnknownBillFormatError):
+            bill_formats.detect(header)
+
+
+class KeysetPaginationTestCase(TestCase):
+    def setUp(self):
+        self.api_client = APIClient()
+        response_cache.get_cache().clear()
+        client1 = Client.objects.create(name="client1")
+        client2 = Client.objects.create(name="client2")
+        org1 = Organization.objects.create(name="org1", address="", client=client1)
+        org2 = Organization.objects.create(name="org2", address="", client=client2)
+        for number in range(1, 11):
+            for client, organization in ((client1, org1), (client2, org2)):
+                Bill.objects.create(
+                    number=number, summ=100, date=datetime.date(2022, 1, 11 - number % 3), service="лечение",
+                    fraud_score=0.1, service_class=1, service_name="лечение",
+                    client=client, organization=organization,
+                )
+
+    def collect(self, url):
+        pages = []
+        while url is not None:
+            response = self.api_client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.data)
+            url = response.data["next"]
+        return pages
+
+    def test_bills_pages_follow_date_and_id(self):
+        pages = self.collect("/api/bills/?client=client1&page_size=3")
+        self.assertEqual([len(page["results"]) for page in pages], [3, 3, 3, 1])
+        ids = [bill["id"] for page in pages for bill in page["results"]]
+        expected = list(
+            Bill.objects.filter(client__name="client1").order_by("date", "id").values_list("id", flat=True)
+        )
+        self.assertEqual(ids, expected)
+
+        response = self.api_client.get(pages[2]["previous"])
+        self.assertEqual(response.data["results"], pages[1]["results"])
+        self.assertIsNone(pages[0]["previous"])
+
+    def test_clients_pages(self):
+        pages = self.collect("/api/clients/?page_size=1")
+        self.assertEqual([client["name"] for page in pages for client in page["results"]], ["client1", "client2"])
+        self.assertEqual(pages[0]["results"][0]["organizations_count"], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("rebuild_client_stats", stdout=io.StringIO())
+        pages = self.collect("/api/clients/?page_size=1")
+        self.assertEqual(
+            [(client["name"], client["organizations_count"], client["all_sums"])
+             for page in pages for client in page["results"]],
+            [("client1", 1, 1000), ("client2", 1, 1000)],
+        )
+
+    def test_page_size_limit_and_invalid_cursor(self):
+        response = self.api_client.get("/api/bills/?page_size=100000")
+        self.assertEqual(len(response.data["results"]), 20)
+        self.assertEqual(self.api_client.get("/api/bills/?cursor=garbage").status_code, 404)
+
+
+class BillsQueryPlanTestCase(TestCase):
+    """
+    Регрессионный тест планов запросов списка счетов (SQLite EXPLAIN QUERY PLAN):
+    таблица счетов не должна читаться полным сканированием или сортироваться во временном B-дереве.
+    """
+    setUp = KeysetPaginationTestCase.setUp
+
+    def bill_query_plans(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.api_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        plans = []
+        with connection.cursor() as cursor:
+            for query in queries.captured_queries:
+                if 'FROM "main_app_bill"' not in query["sql"]:
+                    continue
+                cursor.execute("EXPLAIN QUERY PLAN " + query["sql"])
+                plans.append([row[-1] for row in cursor.fetchall()])
+        self.assertTrue(plans)
+        return response, plans
+
+    def assert_indexed(self, url):
+        response, plans = self.bill_query_plans(url)
+        for plan in plans:
+            for step in plan:
+                self.assertFalse(step == "SCAN main_app_bill", (url, plan))
+                self.assertNotIn("USE TEMP B-TREE FOR ORDER BY", step, (url, plan))
+        return response
+
+    @unittest.skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN есть только в SQLite")
+    def test_bills_list_uses_indexes(self):
+        for query in ("", "?client=client1", "?organization=org2", "?client=client1&organization=org1"):
+            response = self.assert_indexed("/api/bills/{}".format(query) + ("&" if query else "?") + "page_size=3")
+            self.assert_indexed(response.data["next"])
+
+    def test_unknown_filter_values(self):
+        for query in ("?client=nobody", "?organization=nothing", "?client=client1&organization=org2"):
+            response = self.api_client.get("/api/bills/{}".format(query))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data["results"], [])
+
+
+class ResponseCacheTestCase(UploadTestCase):
+    def setUp(self):
+        super().setUp()
+        client1 = Client.objects.create(name="client1")
+        organization = Organization.objects.create(name="org1", address="", client=client1)
+        Bill.objects.create(
+            number=1, summ=100, date=datetime.date(2022, 1, 1), service="лечение",
+            fraud_score=0.1, service_class=1, service_name="лечение", client=client1, organization=organization,
+        )
+
+    def test_cached_list_and_conditional_get(self):
+        for url in ("/api/clients/", "/api/bills/?client=client1"):
+            response = self.api_client.get(url)
+            self.assertEqual(response.status_code, 200)
+            etag = response["ETag"]
+            # закешированный ответ и 304 стоят одного запроса - чтения версии данных (DataVersion)
+            with self.assertNumQueries(2):
+                cached = self.api_client.get(url + ("&" if "?" in url else "?") + "utm=1")
+                not_modified = self.api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(cached.content, response.content)
+            self.assertEqual(cached["ETag"], etag)
+            self.assertEqual(not_modified.status_code, 304)
+            self.assertEqual(not_modified["ETag"], etag)
+
+        other = self.api_client.get("/api/bills/?client=client2")
+        self.assertNotEqual(other["ETag"], self.api_client.get("/api/bills/?client=client1")["ETag"])
+
+    def test_upload_bumps_data_version(self):
+        etag = self.api_client.get("/api/clients/")["ETag"]
+        xlsx_obj = make_xlsx({"client": [{"name": "client2"}], "organization": []}, "client_org.xlsx")
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.api_client.post("/api/clients/upload/", {"file": xlsx_obj}, format="multipart")
+        self.assertEqual(response.status_code, 202)
+
+        response = self.api_client.get("/api/clients/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual([client["name"] for client in response.data["results"]], ["client1", "client2"])
+
+    def test_data_version_is_shared_between_processes(self):
+        etag = self.api_client.get("/api/clients/")["ETag"]
+        # версию данных сменил другой процесс (например, process_import_jobs): кеш этого процесса не изменился
+        DataVersion.objects.update(token="changed-by-other-process")
+        response = self.api_client.get("/api/clients/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+        etag = response["ETag"]
+        call_command("recompute_fraud_weight", stdout=io.StringIO())
+        self.assertEqual(self.api_client.get("/api/clients/", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class FastBillsListTestCase(TestCase):
+    def setUp(self):
+        client = Client.objects.create(name="Клиент \u2028 \"1\"")
+        organization = Organization.objects.create(name="org\t1", address="", client=client)
+        for number, fraud_score in enumerate((0.1, 1.0, 0.0, 0.30000000000000004, 0.5), start=1):
+            Bill.objects.create(
+                number=number, summ=number * 100, date=datetime.date(2022, 1, number), service="лечение\n",
+                fraud_score=fraud_score, service_class=1, service_name="лечение", client=client,
+                organization=organization,
+            )
+
+    def assert_byte_compatible(self):
+        instances = Bill.objects.select_related("client", "organization").order_by("date", "id")
+        rows = Bill.objects.order_by("date", "id").values(*BillListSerializer.values_fields())
+        expected = JSONRenderer().render(BillSerializer(instances, many=True).data)
+        self.assertEqual(FastJSONRenderer().render(BillSerializer(list(rows), many=True).data), expected)
+
+    def test_values_rows_render_like_model_serializer(self):
+        self.assert_byte_compatible()
+        Bill.objects.filter(number=1).update(fraud_score=0.00001)
+        self.assert_byte_compatible()
+
+    def test_renderer_matches_json_renderer(self):
+        data = {
+            "date": datetime.date(2022, 1, 1),
+            "datetime": datetime.datetime(2022, 1, 1, 12, 30, 15, 123456),
+            "decimal": decimal.Decimal("1.10"),
+            "floats": [1e16, 1e-05, 0.1],
+            "text": "\u2029 é \x01",
+            1: None,
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(FastJSONRenderer().render(None), b"")
+
+
+class BillsExportTestCase(FastBillsListTestCase):
+    def setUp(self):
+        super().setUp()
+        self.api_client = APIClient()
+        other = Client.objects.create(name="client2")
+        Bill.objects.create(
+            number=1, summ=1, date=datetime.date(2022, 2, 1), service="", fraud_score=0.9, service_class=0,
+            service_name="", client=other, organization=Organization.objects.create(name="org2", client=other),
+        )
+
+    def export(self, url):
+        response = self.api_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content).decode("utf-8")
+
+    def test_export_csv(self):
+        lines = list(csv.reader(io.StringIO(self.export("/api/bills/export/?client=client2"))))
+        self.assertEqual(lines[0], [key for key, _ in BillListSerializer.columns])
+        self.assertEqual(lines[1][1:], ["client2", "org2", "1", "1", "2022-02-01", "", "0.9", "0", ""])
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(len(list(csv.reader(io.StringIO(self.export("/api/bills/export/"))))), 7)
+
+    def test_export_ndjson(self):
+        content = self.export("/api/bills/export/?format=ndjson&organization=org\t1")
+        rows = [json.loads(line) for line in content.splitlines()]
+        expected = json.loads(JSONRenderer().render(BillSerializer(
+            Bill.objects.filter(organization__name="org\t1").order_by("id"), many=True
+        ).data))
+        self.assertEqual(rows, expected)
+        self.assertEqual(self.export("/api/bills/export/?format=ndjson&client=nobody"), "")
+        self.assertEqual(self.api_client.get("/api/bills/export/?format=xml").status_code, 404)
+
+
+class BillStatsTestCase(TestCase):
+    def setUp(self):
+        self.api_client = APIClient()
+        response_cache.get_cache().clear()
+        client1 = Client.objects.create(name="client1")
+        client2 = Client.objects.create(name="client2")
+        org1 = Organization.objects.create(name="org", address="", client=client1)
+        org2 = Organization.objects.create(name="org", address="", client=client2)
+        for number, (organization, summ, day, fraud_score, service_class) in enumerate((
+                (org1, 100, datetime.date(2022, 1, 10), 0.1, 1),
+                (org1, 200, datetime.date(2022, 1, 20), 0.95, 2),
+                (org1, 300, datetime.date(2022, 2, 1), 0.5, 1),
+                (org2, 400, datetime.date(2022, 2, 15), 0.9, 1),
+        ), start=1):
+            Bill.objects.create(
+                number=number, summ=summ, date=day, service="", fraud_score=fraud_score,
+                service_class=service_class, service_name="", client=organization.client, organization=organization,
+            )
+        response_cache.get_data_version()
+
+    def stats(self, query, queries=1):
+        # плюс чтение версии данных (DataVersion) для ключа ответа
+        with self.assertNumQueries(queries + 1):
+            response = self.api_client.get("/api/bills/stats/?{}".format(query))
+        self.assertEqual(response.status_code, 200)
+        return response.data["columns"]
+
+    def test_group_by(self):
+        self.assertEqual(self.stats("group_by=client"), {
+            "client": ["client1", "client2"],
+            "bills_count": [3, 1],
+            "total_summ": [600, 400],
+            "avg_fraud_score": [0.5167, 0.9],
+            "high_fraud_bills_count": [1, 1],
+            "fraud_rate": [0.3333, 1.0],
+        })
+        organizations = self.stats("group_by=organization")
+        self.assertEqual(organizations["organization"], ["org", "org"])
+        self.assertEqual(len(set(organizations["organization_id"])), 2)
+        self.assertEqual(self.stats("group_by=service_class")["total_summ"], [800, 200])
+        columns = self.stats("group_by=month,service_class")
+        self.assertEqual(
+            list(zip(columns["month"], columns["service_class"], columns["bills_count"])),
+            [("2022-01", 1, 1), ("2022-01", 2, 1), ("2022-02", 1, 2)],
+        )
+
+    def test_filters(self):
+        columns = self.stats("group_by=client&date_from=2022-01-15&date_to=2022-02-01&min_fraud_score=0.5")
+        self.assertEqual(columns["client"], ["client1"])
+        self.assertEqual(columns["total_summ"], [500])
+        self.assertEqual(self.stats("group_by=client&max_fraud_score=0.2&client=client1", 2)["bills_count"], [1])
+        self.assertEqual(self.stats("group_by=month&client=nobody", 1)["month"], [])
+        with self.assertNumQueries(1):
+            self.api_client.get("/api/bills/stats/?group_by=client&max_fraud_score=0.2&client=client1")
+
+    def test_invalid_params(self):
+        for query in ("", "group_by=summ", "group_by=client,client", "group_by=client&date_from=01.01.2022",
+                      "group_by=client&min_fraud_score=2", "group_by=client&max_fraud_score=x"):
+            response = self.api_client.get("/api/bills/stats/?{}".format(query))
+            self.assertEqual(response.status_code, 400, query)
+
+    @unittest.skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN есть только в SQLite")
+    def test_stats_use_indexes(self):
+        for group_by in ("client", "organization", "service_class"):
+            with CaptureQueriesContext(connection) as queries:
+                self.stats("group_by={}".format(group_by))
+            with connection.cursor() as cursor:
+                cursor.execute("EXPLAIN QUERY PLAN " + queries.captured_queries[0]["sql"])
+                plan = [row[-1] for row in cursor.fetchall()]
+            self.assertNotIn("SCAN main_app_bill", plan, (group_by, plan))
+            self.assertNotIn("USE TEMP B-TREE FOR GROUP BY", plan, (group_by, plan))
+
+
+class GeneratedFilesImportTestCase(TestCase):
+    def test_import_generated_files_with_stage_timings(self):
+        out = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, out, ignore_errors=True)
+        files = generate.generate_files(out, clients=5, organizations=20, bills=200, invalid_share=0.2, seed=1)
+
+        timings = {}
+        with open(files["client_org.xlsx"]["path"], "rb") as file_obj:
+            result = importers.import_clients(file_obj, timings=timings)
+        self.assertEqual(set(timings), {importers.STAGE_PARSE, importers.STAGE_RESOLVE, importers.STAGE_INSERT})
+        self.assertEqual(result.rows_rejected, files["client_org.xlsx"]["invalid_rows"])
+
+        for layout in generate.LAYOUTS:
+            info = files["bills_{}.xlsx".format(layout)]
+            timings = {}
+            with open(info["path"], "rb") as file_obj:
+                result = importers.import_bills(file_obj, timings=timings)
+            self.assertEqual(
+                set(timings),
+                {
+                    importers.STAGE_PARSE, importers.STAGE_VALIDATE, importers.STAGE_RESOLVE,
+                    importers.STAGE_SCORE, importers.STAGE_INSERT,
+                },
+            )
+            self.assertEqual(result.rows_processed, 200)
+            self.assertGreaterEqual(result.rows_rejected, info["invalid_rows"])
+            self.assertGreater(result.rows_inserted, 0)
+        self.assertEqual(Bill.objects.count(), len(set(Bill.objects.values_list("number", flat=True))))
+
+
+class MetricsTestCase(UploadTestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.registry.clear()
+        self.addCleanup(metrics.registry.clear)
+
+    def test_request_metrics(self):
+        self.assertEqual(self.api_client.get("/api/clients/").status_code, 200)
+        self.assertEqual(metrics.REQUEST_LATENCY.count(view="client-list", method="GET"), 1)
+        self.assertEqual(metrics.REQUESTS.value(view="client-list", method="GET", status=200), 1)
+        self.assertEqual(metrics.REQUEST_QUERIES.count(view="client-list"), 1)
+
+        content = self.api_client.get("/metrics").content.decode("utf-8")
+        self.assertIn('http_requests_total{view="client-list",method="GET",status="200"} 1', content)
+        self.assertIn('http_request_db_queries_bucket{view="client-list",le="+Inf"} 1', content)
+        self.assertIn("# TYPE http_request_duration_seconds histogram", content)
+        self.assertEqual(self.api_client.get("/metrics", REMOTE_ADDR="10.0.0.1").status_code, 403)
+
+    def test_slow_request_log(self):
+        with override_settings(SLOW_REQUEST_SECONDS=0), self.assertLogs("my_logger", "WARNING") as logs:
+            self.api_client.get("/api/bills/?client=client1")
+        self.assertIn("Медленный запрос GET /api/bills/?client=client1 (bill-list)", logs.output[0])
+        self.assertIn('FROM "main_app_client"', logs.output[0])
+
+    def test_import_stage_metrics(self):
+        xlsx_obj = make_xlsx({"client": [{"name": "client1"}], "organization": []}, "client_org.xlsx")
+        self.api_client.post("/api/clients/upload/", {"file": xlsx_obj}, format="multipart")
+        self.assertEqual(metrics.IMPORT_SECONDS.count(kind=ImportJob.KIND_CLIENTS, state=ImportJob.STATE_DONE), 1)
+        self.assertEqual(
+            metrics.IMPORT_STAGE_SECONDS.count(kind=ImportJob.KIND_CLIENTS, stage=importers.STAGE_INSERT), 1
+        )
+        self.assertEqual(metrics.IMPORT_ROWS.value(kind=ImportJob.KIND_CLIENTS, outcome="inserted"), 1)
+
+
+class ConstantBillScorer(BillScorer):
+    """
+    Оценщик для тестов: одинаковая оценка для всех счетов, вызовы записываются в calls
+    """
+    version = "constant"
+    calls = []
+
+    def score(self, services):
+        self.calls.append(list(services))
+        size = len(services)
+        return BillScores(
+            fraud_score=np.full(size, 0.95),
+            service_class=np.full(size, 4, dtype=np.int64),
+            service_name=np.full(size, SERVICE_TYPES[4], dtype=object),
+        )
+
+
+class BillScoringTestCase(TestCase):
+    def test_random_scorer_is_vectorized_and_seedable(self):
+        services = ["лечение"] * 50
+        first, second = RandomBillScorer(seed=7).score(services), RandomBillScorer(seed=7).score(services)
+        for column, other in zip(first, second):
+            self.assertEqual(len(column), 50)
+            np.testing.assert_array_equal(column, other)
+        self.assertTrue(((first.fraud_score >= 0) & (first.fraud_score < 1)).all())
+        self.assertEqual(first.service_class.dtype, np.int64)
+        self.assertEqual(
+            [SERVICE_TYPES[service_class] for service_class in first.service_class], list(first.service_name)
+        )
+
+    def test_process_pool_scorer(self):
+        services = ["лечение"] * 35
+        scorers = [ProcessPoolBillScorer(RandomBillScorer(seed=3), workers=2, chunk_size=10) for _ in range(2)]
+        for scorer in scorers:
+            self.addCleanup(scorer.shutdown)
+        first, second = (scorer.score(services) for scorer in scorers)
+        self.assertEqual(len(first.fraud_score), 35)
+        np.testing.assert_array_equal(first.fraud_score, second.fraud_score)
+        # части колонки оцениваются независимыми генераторами
+        self.assertFalse(np.array_equal(first.fraud_score[:10], first.fraud_score[10:20]))
+
+    @override_settings(BILL_SCORER="main_app.tests.ConstantBillScorer", BILL_SCORER_OPTIONS={})
+    def test_import_scores_each_chunk_once(self):
+        ConstantBillScorer.calls = []
+        client = Client.objects.create(name="client1")
+        Organization.objects.create(name="org1", address="", client=client)
+        xlsx_obj = make_xlsx({"bills": [
+            {"client_name": "client1", "client_org": "org1", "№": number, "sum": 10,
+             "date": datetime.datetime(2022, 1, 1), "service": "лечение {}".format(number)}
+            for number in range(1, 4)
+        ]}, "bills.xlsx")
+        result = importers.import_bills(xlsx_obj)
+        self.assertEqual(result.rows_inserted, 3)
+        self.assertEqual(ConstantBillScorer.calls, [["лечение 1", "лечение 2", "лечение 3"]])
+        self.assertEqual(
+            set(Bill.objects.values_list("fraud_score", "service_class", "service_name")),
+            {(0.95, 4, SERVICE_TYPES[4])},
+        )
+
+
+class CountingBillScorer(BillScorer):
+    """
+    Оценщик для тестов: оценка зависит от длины нормализованного текста, вызовы записываются в calls
+    """
+    version = "counting-1"
+
+    def __init__(self):
+        self.calls = []
+
+    def score(self, services):
+        self.calls.append(list(services))
+        lengths = np.array([len(" ".join(text.split())) for text in services])
+        return BillScores(
+            fraud_score=lengths / 100,
+            service_class=lengths % 5 + 1,
+            service_name=np.array([SERVICE_TYPES[length % 5 + 1] for length in lengths], dtype=object),
+        )
+
+
+class UnversionedBillScorer(CountingBillScorer):
+    version = ""
+
+
+class ServiceScoreCacheTestCase(TestCase):
+    def test_memory_then_database_tiers(self):
+        model = CountingBillScorer()
+        scorer = CachedBillScorer(model, lru_size=10)
+        scores = scorer.score(["Лечение", " лечение ", "анализ крови"])
+        self.assertEqual(model.calls, [["Лечение", "анализ крови"]])
+        self.assertEqual(scores.fraud_score.tolist(), [0.07, 0.07, 0.12])
+        self.assertEqual(scores.service_class.tolist(), [3, 3, 3])
+        self.assertEqual(ServiceScore.objects.filter(scorer_version="counting-1").count(), 2)
+        self.assertEqual(scorer.hit_ratio, 0.0)
+
+        self.assertEqual(scorer.score(["ЛЕЧЕНИЕ"]).fraud_score.tolist(), [0.07])
+        self.assertEqual(len(model.calls), 1)
+        self.assertEqual(scorer.lookups, {"memory": 1, "database": 0, "miss": 2})
+
+        restarted = CachedBillScorer(model, lru_size=1)
+        with self.assertNumQueries(1):
+            restarted.score(["лечение", "анализ крови"])
+        self.assertEqual(len(model.calls), 1)
+        self.assertEqual(restarted.hit_ratio, 1.0)
+        self.assertEqual(len(restarted._lru), 1)
+
+    def test_scorer_version_and_invalidation(self):
+        CachedBillScorer(CountingBillScorer(), lru_size=10).score(["лечение"])
+        model = CountingBillScorer()
+        model.version = "counting-2"
+        CachedBillScorer(model, lru_size=10).score(["лечение"])
+        self.assertEqual(len(model.calls), 1)
+
+        self.assertEqual(invalidate_service_scores(keep_version="counting-2"), 1)
+        self.assertEqual(list(ServiceScore.objects.values_list("scorer_version", flat=True)), ["counting-2"])
+        self.assertEqual(invalidate_service_scores(), 1)
+
+    def test_get_scorer_caches_only_cacheable_scorers(self):
+        with override_settings(BILL_SCORER="main_app.tests.CountingBillScorer", BILL_SCORER_OPTIONS={}):
+            self.assertIsInstance(get_scorer(), CachedBillScorer)
+        with override_settings(BILL_SCORER="main_app.scoring.RandomBillScorer", BILL_SCORER_OPTIONS={}):
+            self.assertIsInstance(get_scorer(), RandomBillScorer)
+        with override_settings(BILL_SCORER="main_app.tests.CountingBillScorer", BILL_SCORE_CACHE_SIZE=0):
+            self.assertIsInstance(get_scorer(), CountingBillScorer)
+
+    def test_get_scorer_requires_version(self):
+        with override_settings(BILL_SCORER="main_app.tests.UnversionedBillScorer", BILL_SCORER_OPTIONS={}):
+            with self.assertRaisesMessage(ImproperlyConfigured, "must define a non-empty version"):
+                get_scorer()
+
+    @override_settings(BILL_SCORER="main_app.tests.CountingBillScorer", BILL_SCORER_OPTIONS={})
+    def test_import_uses_cache_of_get_scorer(self):
+        client = Client.objects.create(name="client1")
+        Organization.objects.create(name="org1", address="", client=client)
+
+        def bills_file(numbers):
+            return make_csv([
+                {"client_name": "client1", "client_org": "org1", "№": number, "sum": "10", "date": "2022-01-01",
+                 "service": "лечение" if number % 2 else "анализ крови"}
+                for number in numbers
+            ], "bills.csv")
+
+        importers.import_bills(bills_file([1, 2, 3]))
+        model = get_scorer().scorer
+        self.assertEqual(model.calls, [["лечение", "анализ крови"]])
+        self.assertEqual(ServiceScore.objects.filter(scorer_version="counting-1").count(), 2)
+
+        # новые счета с уже оцененными услугами не вызывают модель
+        importers.import_bills(bills_file([4, 5]))
+        self.assertEqual(len(model.calls), 1)
+        self.assertEqual(get_scorer().lookups["memory"], 2)
+        self.assertEqual(
+            sorted(Bill.objects.values_list("number", "fraud_score")),
+            [(1, 0.07), (2, 0.12), (3, 0.07), (4, 0.12), (5, 0.07)],
+        )
+
+
+@override_settings(IMPORT_FAST_LOADER=True)
+class FastLoaderBillsUploadTestCase(BillsUploadTestCase):
+    """
+    Те же проверки загрузки счетов при записи быстрым загрузчиком SQLite
+    """
+
+
+@override_settings(IMPORT_FAST_LOADER=True)
+class FastLoaderClientsUploadTestCase(ClientsUploadTestCase):
+    """
+    Те же проверки загрузки клиентов при записи быстрым загрузчиком SQLite
+    """
+
+
+class SQLiteLoaderTestCase(TransactionTestCase):
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f"PRAGMA {name}")
+            return cursor.fetchone()[0]
+
+    def test_write_optimized_restores_pragmas(self):
+        before = [self.pragma(name) for name in ("synchronous", "cache_size", "temp_store")]
+        with sqlite_loader.write_optimized():
+            self.assertEqual(self.pragma("synchronous"), 1)
+            self.assertEqual(self.pragma("cache_size"), -65536)
+            self.assertEqual(self.pragma("temp_store"), 2)
+        self.assertEqual([self.pragma(name) for name in ("synchronous", "cache_size", "temp_store")], before)
+
+    def test_bulk_load_defers_secondary_indexes(self):
+        indexes = sqlite_loader.secondary_indexes(Bill)
+        self.assertTrue({"bill_date_idx", "bill_client_date_idx", "bill_organization_date_idx"} <= set(indexes))
+        client = Client.objects.create(name="client1")
+        organization = Organization.objects.create(name="org1", address="", client=client)
+        bills = [
+            Bill(number=number, summ=100, date=datetime.date(2022, 1, number), service="лечение", fraud_score=0.5,
+                 service_class=2, service_name="лечение", client=client, organization=organization)
+            for number in (1, 2)
+        ]
+        with sqlite_loader.bulk_load([Bill]):
+            self.assertEqual(sqlite_loader.secondary_indexes(Bill), {})
+            sqlite_loader.insert_objects(Bill, bills)
+            sqlite_loader.insert_objects(Bill, bills, ignore_conflicts=True)
+        self.assertEqual(sqlite_loader.secondary_indexes(Bill), indexes)
+        self.assertEqual(list(Bill.objects.order_by("number").values_list("number", "date")), [
+            (1, datetime.date(2022, 1, 1)), (2, datetime.date(2022, 1, 2)),
+        ])
+
+        with self.assertRaises(IntegrityError), sqlite_loader.bulk_load([Bill]):
+            sqlite_loader.insert_objects(Bill, bills)
+        self.assertEqual(sqlite_loader.secondary_indexes(Bill), indexes)
+
+        bills[0].id, bills[0].summ = Bill.objects.get(number=1).id, 150
+        sqlite_loader.update_objects(Bill, bills[:1], ("summ",))
+        self.assertEqual(Bill.objects.get(number=1).summ, 150)
+
+
+class ConcurrentImportsTestCase(TransactionTestCase):
+    """
+    Тесты импортов, одновременно записывающих в базу из разных потоков (как воркеры IMPORT_JOBS_WORKERS)
+    """
+
+    def setUp(self):
+        for name in ("client1", "client2"):
+            Organization.objects.create(name="org1", address="", client=Client.objects.create(name=name))
+
+    def make_file(self, numbers) -> io.BytesIO:
+        rows = [
+            {"client_name": f"client{number % 2 + 1}", "client_org": "org1", "№": number, "sum": 100,
+             "date": "2022-01-01", "service": "лечение"}
+            for number in numbers
+        ]
+        file_obj = io.BytesIO(pd.DataFrame(rows).to_csv(index=False).encode("utf-8"))
+        file_obj.name = "bills.csv"
+        return file_obj
+
+    def import_concurrently(self, files, on_conflict):
+        """
+        Импортирует файлы одновременно в отдельных потоках, возвращает результаты импортов и ошибки
+        """
+        results, errors = [], []
+        barrier = threading.Barrier(len(files))
+
+        def run(file_obj):
+            try:
+                barrier.wait()
+                results.append(importers.import_bills(file_obj, on_conflict=on_conflict, chunk_size=50, batch_size=10))
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(file_obj,)) for file_obj in files]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_concurrent_imports_bump_data_version(self):
+        version = response_cache.get_data_version()
+        results, errors = self.import_concurrently(
+            [self.make_file(range(1, 501)), self.make_file(range(1001, 1501))], ImportJob.ON_CONFLICT_ERROR
+        )
+        self.assertEqual(errors, [])
+        self.assertEqual([result.rows_inserted for result in results], [500, 500])
+        self.assertEqual(Bill.objects.count(), 1000)
+        self.assertNotEqual(response_cache.get_data_version(), version)
+
+    def test_concurrent_imports_of_same_rows(self):
+        for on_conflict in (ImportJob.ON_CONFLICT_SKIP, ImportJob.ON_CONFLICT_UPDATE):
+            Bill.objects.all().delete()
+            ClientStats.objects.update(bills_count=0, total_summ=0)
+            results, errors = self.import_concurrently(
+                [self.make_file(range(1, 501)), self.make_file(range(1, 501))], on_conflict
+            )
+            self.assertEqual(errors, [])
+            # каждый счет добавлен одним из импортов, второй его пропустил или обновил
+            self.assertEqual(sum(result.rows_inserted for result in results), 500)
+            self.assertEqual(
+                sum(result.rows_skipped + result.rows_updated + result.rows_unchanged for result in results), 500
+            )
+            self.assertEqual(Bill.objects.count(), 500)
+            self.assertEqual(sum(ClientStats.objects.values_list("bills_count", flat=True)), 500)
+
+    def test_write_transaction_takes_write_lock_first(self):
+        with CaptureQueriesContext(connection) as queries, sqlite_loader.write_transaction():
+            Client.objects.exists()
+            with sqlite_loader.write_transaction():
+                Client.objects.create(name="client3")
+        self.assertEqual(queries[0]["sql"], "BEGIN IMMEDIATE")
+        self.assertFalse(any(query["sql"] == "BEGIN" for query in queries))
+        self.assertNotIn("_start_transaction_under_autocommit", vars(connections[DEFAULT_DB_ALIAS]))
+
+    def test_failed_data_version_bump_does_not_fail_import(self):
+        with mock.patch(
+                "main_app.response_cache.bump_data_version", side_effect=OperationalError("database is locked")
+        ), self.assertLogs("my_logger", level="ERROR"):
+            result = importers.import_bills(self.make_file(range(1, 11)))
+        self.assertEqual(result.rows_inserted, 10)
+        self.assertEqual(Bill.objects.count(), 10)
+
+
+class MultiFileUploadTestCase(UploadTestCase):
+    def setUp(self):
+        super().setUp()
+        Organization.objects.create(name="OOO Org", address="", client=Client.objects.create(name="client1"))
+
+    def bills_xlsx(self, name, numbers, client_name="client1"):
+        rows = [
+            {"client_name": client_name, "client_org": "OOO Org", "№": number, "sum": 100,
+             "date": pd.Timestamp("2022-01-01"), "service": "лечение"}
+            for number in numbers
+        ]
+        return make_xlsx({"Sheet1": rows}, name)
+
+    def zip_archive(self, files, name="bills.zip"):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as archive:
+            for path, content in files.items():
+                archive.writestr(path, content)
+        return SimpleUploadedFile(name, buffer.getvalue())
+
+    def upload(self, files):
+        return self.api_client.post("/api/bills/upload/", {"file": files}, format="multipart")
+
+    def summary(self, response):
+        return [
+            (entry["file_name"], entry["state"], entry["rows_processed"], entry["rows_accepted"])
+            for entry in response.data["files"]
+        ]
+
+    @override_settings(IMPORT_PARSE_WORKERS=0)
+    def test_upload_zip_archive(self):
+        archive = self.zip_archive({
+            "march/a.xlsx": self.bills_xlsx("a.xlsx", [1, 2]).read(),
+            "march/b.xlsx": self.bills_xlsx("b.xlsx", [3, 4, 5], client_name="client3").read(),
+            "march/readme.txt": b"",
+            "__MACOSX/march/._a.xlsx": b"",
+        })
+        response = self.upload(archive)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.summary(response), [("a.xlsx", "done", 2, 2), ("b.xlsx", "done", 3, 0)])
+        self.assertEqual(sorted(Bill.objects.values_list("number", flat=True)), [1, 2])
+
+    def test_upload_several_files_parsed_in_process_pool(self):
+        with override_settings(IMPORT_PARSE_WORKERS=2):
+            self.addCleanup(jobs.shutdown_parse_executor)
+            response = self.upload([
+                self.bills_xlsx("a.xlsx", [1, 2]),
+                self.bills_xlsx("b.xlsx", [3, 4, 5]),
+                make_xlsx({"Sheet1": [{"unknown": 1}]}, "c.xlsx"),
+            ])
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(sorted(self.summary(response)), [
+            ("a.xlsx", "done", 2, 2), ("b.xlsx", "done", 3, 3), ("c.xlsx", "failed", 0, 0),
+        ])
+        self.assertIn("Unknown bills file format", ImportJob.objects.get(file_name="c.xlsx").error)
+        self.assertEqual(sorted(Bill.objects.values_list("number", flat=True)), [1, 2, 3, 4, 5])
+
+    def test_broken_process_pool_resets_once_and_retries_other_files(self):
+        class FakePool:
+            # пул процессов, в котором файл "crash" аварийно завершает процесс вместе со всеми файлами пула
+            def __init__(self):
+                self.futures = {}
+                self.shut_down = False
+
+            def submit(self, func, path, *args):
+                assert not self.shut_down
+                future = Future()
+                self.futures[future] = path
+                return future
+
+            def run(self):
+                running = {future: path for future, path in self.futures.items() if not future.done()}
+                crashed = "crash" in running.values()
+                for future, path in running.items():
+                    if crashed:
+                        future.set_exception(BrokenProcessPool("worker died"))
+                    else:
+                        future.set_result(([], {}))
+
+            def shutdown(self):
+                self.shut_down = True
+
+        pools = []
+
+        def get_pool():
+            if not pools or pools[-1].shut_down:
+                pools.append(FakePool())
+            return pools[-1]
+
+        def fake_wait(futures, return_when):
+            for pool in pools:
+                pool.run()
+            return {future for future in futures if future.done()}, set()
+
+        parsed_jobs = [ImportJob(id=number, file_name=name) for number, name in enumerate(("a", "crash", "b"), 1)]
+        with mock.patch("main_app.jobs.wait", side_effect=fake_wait):
+            results = {
+                job.file_name: future.exception()
+                for job, future in jobs._iter_parsed_files(
+                    parsed_jobs, paths=lambda job: job.file_name, window=3,
+                    get_pool=get_pool, reset_pool=lambda: pools[-1].shutdown(),
+                )
+            }
+        self.assertIsNone(results["a"])
+        self.assertIsNone(results["b"])
+        self.assertIsInstance(results["crash"], BrokenProcessPool)
+        # пул пересоздается один раз на каждую аварию: при первом чтении трех файлов и при повторном чтении "crash"
+        self.assertEqual([sorted(pool.futures.values()) for pool in pools], [["a", "b", "crash"], ["a", "crash"], ["b"]])
+
+    def test_invalid_archives(self):
+        response = self.upload(SimpleUploadedFile("bills.zip", b"not a zip"))
+        self.assertEqual(response.status_code, 400)
+        response = self.upload(self.zip_archive({"readme.txt": b""}))
+        self.assertEqual(response.status_code, 400)
+        with override_settings(IMPORT_UPLOAD_MAX_FILES=1):
+            response = self.upload([self.bills_xlsx("a.xlsx", [1]), self.bills_xlsx("b.xlsx", [2])])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ImportJob.objects.exists())
+
+    def test_archive_size_limits(self):
+        content = b"0" * 100000
+        archive = self.zip_archive({"a.csv": content, "b.csv": content})
+        for limits in (
+                dict(IMPORT_UPLOAD_MAX_FILE_SIZE=len(content) - 1),
+                dict(IMPORT_UPLOAD_MAX_UNPACKED_SIZE=2 * len(content) - 1),
+        ):
+            archive.seek(0)
+            with override_settings(**limits), mock.patch.object(zipfile.ZipFile, "read") as read:
+                response = self.upload(archive)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("too large", response.data["detail"])
+            read.assert_not_called()
+        self.assertFalse(ImportJob.objects.exists())
+
+
+class ImportCommandsTestCase(TestCase):
+    def setUp(self):
+        response_cache.get_cache().clear()
+        Organization.objects.create(name="OOO Org", address="", client=Client.objects.create(name="client1"))
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder, ignore_errors=True)
+
+    def write_csv(self, name, rows):
+        path = f"{self.folder}/{name}"
+        pd.DataFrame(rows).to_csv(path, index=False)
+        return path
+
+    def write_bills(self, name, numbers):
+        return self.write_csv(name, [
+            {"client_name": "client1", "client_org": "OOO Org", "№": number, "sum": "100", "date": "2022-01-01",
+             "service": "лечение"}
+            for number in numbers
+        ])
+
+    def import_bills(self, *args):
+        stdout = io.StringIO()
+        call_command("import_bills", *args, stdout=stdout, stderr=io.StringIO())
+        return stdout.getvalue()
+
+    def test_import_bills_directory(self):
+        self.write_bills("a.csv", [1, 2, "x"])
+        self.write_bills("b.csv", [3, 4, 5])
+        self.write_csv("readme.txt", [{"a": 1}])
+        self.addCleanup(jobs.shutdown_parse_executor)
+        output = self.import_bills(self.folder, "--workers", "1", "--chunk-size", "2")
+        self.assertIn("a.csv: 3 rows, 1 rejected | ", output)
+        self.assertIn("rows/s", output)
+        self.assertIn("Imported 2 files", output)
+        self.assertEqual(sorted(Bill.objects.values_list("number", flat=True)), [1, 2, 3, 4, 5])
+        self.assertEqual(
+            sorted(ImportJob.objects.values_list("file_name", "state", "rows_processed", "rows_rejected")),
+            [(f"{self.folder}/a.csv", "done", 3, 1), (f"{self.folder}/b.csv", "done", 3, 0)],
+        )
+
+        output = self.import_bills(f"{self.folder}/b.csv", "--workers", "0")
+        self.assertIn("already imported by job", output)
+        self.assertEqual(ImportJob.objects.count(), 2)
+
+        with self.assertRaisesMessage(CommandError, "File not found"):
+            self.import_bills(f"{self.folder}/missing.csv")
+
+    def test_resume_bills_import(self):
+        path = self.write_bills("bills.csv", [1, 2, 3, 4, 5])
+        save_bills = importers.save_bills
+        calls = []
+
+        def fail_second_chunk(bills, **kwargs):
+            calls.append([bill.number for bill in bills])
+            if len(calls) == 2:
+                raise IntegrityError("interrupted")
+            return save_bills(bills, **kwargs)
+
+        with mock.patch("main_app.importers.save_bills", side_effect=fail_second_chunk):
+            with self.assertRaisesMessage(CommandError, "rerun with --resume"):
+                self.import_bills(path, "--workers", "0", "--chunk-size", "2")
+        job = ImportJob.objects.get()
+        self.assertEqual((job.state, job.rows_processed, job.error), (ImportJob.STATE_FAILED, 2, "interrupted"))
+        self.assertEqual(sorted(Bill.objects.values_list("number", flat=True)), [1, 2])
+
+        # первые две строки уже записаны и не читаются повторно, даже если части файла другого размера
+        calls.clear()
+
+        def record(bills, **kwargs):
+            calls.append([bill.number for bill in bills])
+            return save_bills(bills, **kwargs)
+
+        with mock.patch("main_app.importers.save_bills", side_effect=record):
+            output = self.import_bills(path, "--workers", "0", "--chunk-size", "3", "--resume")
+        self.assertIn(f"resuming job #{job.id} after 2 rows", output)
+        self.assertEqual(calls, [[3], [4, 5]])
+        job.refresh_from_db()
+        self.assertEqual(
+            (job.state, job.rows_processed, job.rows_inserted, job.error), (ImportJob.STATE_DONE, 5, 5, "")
+        )
+        self.assertEqual(ImportJob.objects.count(), 1)
+        self.assertEqual(sorted(Bill.objects.values_list("number", flat=True)), [1, 2, 3, 4, 5])
+
+    def test_resume_skips_job_running_in_other_process(self):
+        path = self.write_bills("bills.csv", [1, 2])
+        job, started = jobs.open_file_job(ImportJob.KIND_BILLS, path, ImportJob.ON_CONFLICT_ERROR)
+        self.assertTrue(started)
+
+        for args in ((), ("--resume",)):
+            stderr = io.StringIO()
+            call_command("import_bills", path, "--workers", "0", *args, stdout=io.StringIO(), stderr=stderr)
+            self.assertIn(f"is being imported by job #{job.id} (running), skipped", stderr.getvalue())
+        self.assertEqual(list(ImportJob.objects.values_list("id", "state")), [(job.id, ImportJob.STATE_RUNNING)])
+        self.assertFalse(Bill.objects.exists())
+
+        # процесс, выполнявший задачу, давно не сохранял прогресс: задача считается прерванной
+        ImportJob.objects.filter(id=job.id).update(
+            heartbeat_at=timezone.now() - datetime.timedelta(seconds=settings.IMPORT_JOB_STALE_SECONDS + 1)
+        )
+        self.import_bills(path, "--workers", "0", "--resume")
+        self.assertEqual(list(ImportJob.objects.values_list("id", "state")), [(job.id, ImportJob.STATE_DONE)])
+        self.assertEqual(sorted(Bill.objects.values_list("number", flat=True)), [1, 2])
+
+    def test_import_clients(self):
+        rows = [
+            {"client_name": "client2", "name": "org1", "address": ""},
+            {"client_name": "client2", "name": "org2", "address": ""},
+            {"client_name": "client3", "name": "org3", "address": ""},
+        ]
+        path = self.write_csv("clients.csv", rows)
+        stdout = io.StringIO()
+        call_command("import_clients", path, stdout=stdout)
+        self.assertIn("processed 5, accepted 5", stdout.getvalue())
+        self.assertEqual(Organization.objects.filter(client__name__in=["client2", "client3"]).count(), 3)
+
+        # продолжение после клиентов и первой организации: записываются только остальные организации
+        Organization.objects.filter(client__name__in=["client2", "client3"]).exclude(name="org1").delete()
+        with open(path, "rb") as file_obj:
+            result = importers.import_clients(file_obj, chunk_size=2, skip_rows=3)
+        self.assertEqual((result.rows_processed, result.rows_inserted), (2, 2))
+        self.assertEqual(Organization.objects.filter(client__name__in=["client2", "client3"]).count(), 3)
+
+
+class AsyncViewsTestCase(TransactionTestCase):
+    """
+    Тесты async-представлений (запросы через ASGI): запросы к базе выполняются в пуле потоков,
+    поэтому данные должны быть зафиксированы, а не находиться в транзакции теста
+    """
+
+    def setUp(self):
+        self.api_client = APIClient()
+        self.async_client = AsyncClient()
+        response_cache.get_cache().clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root, IMPORT_JOBS_EAGER=True)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        for name in ("client1", "client2"):
+            client = Client.objects.create(name=name)
+            organization = Organization.objects.create(name="org1", address="", client=client)
+            for number in range(1, 4):
+                Bill.objects.create(
+                    number=number, summ=100, date=datetime.date(2022, 1, number), service="лечение",
+                    fraud_score=0.1, service_class=1, service_name="лечение", client=client, organization=organization,
+                )
+
+    def test_asgi_urlconf_routes_lists_to_async_views(self):
+        for path in ("/api/clients/", "/api/bills/", "/api/bills/upload/"):
+            self.assertTrue(asyncio.iscoroutinefunction(resolve(path, urlconf=settings.ASGI_URLCONF).func))
+        self.assertFalse(asyncio.iscoroutinefunction(resolve("/api/bills/export/", urlconf=settings.ASGI_URLCONF).func))
+
+    async def test_lists_match_sync_views(self):
+        urls = [
+            "/api/clients/?page_size=1",
+            "/api/bills/?client=client1&page_size=2",
+            "/api/bills/?client=unknown",
+            "/api/bills/?cursor=garbage",
+        ]
+        for url in urls:
+            await sync_to_async(response_cache.get_cache().clear)()
+            expected = await sync_to_async(self.api_client.get)(url)
+            await sync_to_async(response_cache.get_cache().clear)()
+            response = await self.async_client.get(url)
+            self.assertEqual(response.status_code, expected.status_code)
+            self.assertEqual(response.content, expected.content)
+            self.assertEqual(response["Content-Type"], expected["Content-Type"])
+            if response.status_code != 200:
+                continue
+            cached = await self.async_client.get(url)
+            self.assertEqual(cached.content, response.content)
+            self.assertEqual(cached["ETag"], response["ETag"])
+            not_modified = await self.async_client.get(url, **{"If-None-Match": response["ETag"]})
+            self.assertEqual(not_modified.status_code, 304)
+
+        page = json.loads((await self.async_client.get("/api/bills/?client=client1&page_size=2")).content)
+        page = json.loads((await self.async_client.get(page["next"])).content)
+        self.assertEqual([bill["number"] for bill in page["results"]], [3])
+        self.assertIsNone(page["next"])
+
+    async def test_permissions_and_errors_match_sync_views(self):
+        class DenyThrottle(BaseThrottle):
+            def allow_request(self, request, view):
+                return False
+
+        cases = [
+            (ClientsViewSet, "permission_classes", [IsAuthenticated], 403),
+            (ClientsViewSet, "throttle_classes", [DenyThrottle], 429),
+            (BillsViewSet, "get_queryset", mock.Mock(side_effect=NotFound("no bills")), 404),
+        ]
+        for viewset, attribute, value, status_code in cases:
+            url = "/api/clients/" if viewset is ClientsViewSet else "/api/bills/"
+            with mock.patch.object(viewset, attribute, value):
+                await sync_to_async(response_cache.get_cache().clear)()
+                expected = await sync_to_async(self.api_client.get)(url)
+                await sync_to_async(response_cache.get_cache().clear)()
+                response = await self.async_client.get(url)
+            self.assertEqual(expected.status_code, status_code)
+            self.assertEqual(response.status_code, status_code)
+            self.assertEqual(response.content, expected.content)
+
+        # необработанная ошибка не превращается в ответ, как и в синхронном представлении
+        with mock.patch.object(BillsViewSet, "get_queryset", side_effect=RuntimeError("broken")):
+            with self.assertRaisesMessage(RuntimeError, "broken"):
+                await self.async_client.get("/api/bills/")
+
+    async def test_upload_runs_in_executor(self):
+        xlsx_obj = make_xlsx({"client": [{"name": "client3"}], "organization": []}, "client_org.xlsx")
+        # AsyncClient в Django 3.2 не читает multipart-тело, поэтому запрос передается ASGIHandler напрямую
+        status, _, body = await serving.asgi_request(
+            ASGIHandler(), "POST", "/api/clients/upload/",
+            headers=[("Content-Type", MULTIPART_CONTENT)], body=encode_multipart(BOUNDARY, {"file": xlsx_obj}),
+        )
+        self.assertEqual(status, 202)
+        self.assertEqual(json.loads(body)["state"], "done")
+        self.assertTrue(await sync_to_async(Client.objects.filter(name="client3").exists)())
+
+        response = await self.async_client.get("/api/clients/")
+        self.assertEqual([client["name"] for client in json.loads(response.content)["results"]], [
+            "client1", "client2", "client3",
+        ])
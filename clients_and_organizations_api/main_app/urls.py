@@ -1,7 +1,12 @@
 from rest_framework import routers
 
-from main_app.views import ClientsViewSet, BillsViewSet
+from main_app import async_views
+from main_app.views import ClientsViewSet, BillsViewSet, ImportJobsViewSet
 
 router = routers.SimpleRouter()
 router.register(r'clients', ClientsViewSet)
 router.register(r'bills', BillsViewSet)
+router.register(r'imports', ImportJobsViewSet)
+
+# Адреса для запросов через ASGI (см. middleware.ASGIURLConfMiddleware): списки и загрузка файлов - async-представления
+async_urlpatterns = async_views.async_urlpatterns(router.urls)
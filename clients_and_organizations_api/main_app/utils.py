@@ -1,12 +1,34 @@
 import datetime
+import itertools
 import random
-from typing import TypedDict, List, Dict, Union
+from typing import TypedDict, List, Dict, Union, Iterable, Iterator, Tuple, Mapping, Optional, NamedTuple, Type, IO
 
+import openpyxl
 import pandas as pd
 from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.db import IntegrityError
+from django.db.models import Case, When, Value, F, IntegerField, Model
 from pandas import Timestamp
 from pydantic import BaseModel, validator
 
+from main_app import readers, sqlite_loader
+from main_app.formats import BillFormatRegistry, bill_formats
+from main_app.models import Client, Organization, ImportJob
+from main_app.scoring import SERVICE_TYPES
+
+# Максимальное количество параметров в одном IN-запросе (ограничение SQLite на число переменных)
+IN_QUERY_BATCH_SIZE = 500
+# Количество попыток записи в upsert_objects, если параллельный импорт добавил записи с теми же ключами
+UPSERT_ATTEMPTS = 3
+# Количество строк файла (xlsx, csv или parquet), которое читается и обрабатывается за один раз
+XLSX_CHUNK_SIZE = 5000
+# Колонки CSV/Parquet файла с клиентами и организациями (у xlsx файла - листы client и organization)
+ORGANIZATION_COLUMNS = ("client_name", "name", "address")
+# Порог fraud_score, начиная с которого счет увеличивает fraud_weight организации
+FRAUD_SCORE_THRESHOLD = 0.9
+# Классы услуг для service_classificator
+SERVICE_CLASSES = list(SERVICE_TYPES)
+
 
 class BillsData(TypedDict):
     bill_obj: Union["BillObj1", "BillObj2", "BillObj3"]
@@ -64,16 +86,8 @@ def service_classificator() -> ServiceClassificator:
     dict
         словарь с ключами service_class и service_name
     """
-    service_types = {
-        1: "консультация",
-        2: "лечение",
-        3: "стационар",
-        4: "диагностика",
-        5: "лаборатория",
-    }
-    random_key = random.choice(list(service_types.keys()))
-    random_value = service_types[random_key]
-    return dict(service_class=random_key, service_name=random_value)
+    random_key = random.choice(SERVICE_CLASSES)
+    return dict(service_class=random_key, service_name=SERVICE_TYPES[random_key])
 
 
 def prepare_address(address: Union[str, None]) -> Union[str, None]:
@@ -97,14 +111,165 @@ def prepare_address(address: Union[str, None]) -> Union[str, None]:
     return "Адрес: {}".format(address) if len(address) != 0 else address
 
 
-def get_clients_and_organizations_data(xlsx_obj: InMemoryUploadedFile) -> ClientsAndOrganizations:
+def make_frame(rows: List, columns: Iterable[str]) -> pd.DataFrame:
     """
-    Функция для получения данных клиентов и организаций из xlsx файла
+    Функция для построения DataFrame из строк файла.
+    Типы колонок выводятся только для однородных значений: колонка, где вместе с датами
+    встречаются строки, остается object и строки не превращаются в даты.
+
+    Параметры
+    ---------
+    rows: List
+        строки файла (кортежи или словари)
+    columns: Iterable[str]
+        имена колонок
+
+    Возвращаемое значение
+    ---------------------
+    pd.DataFrame
+        DataFrame со строками файла
+    """
+    return pd.DataFrame(rows, columns=list(columns), dtype=object).infer_objects()
+
+
+def iter_xlsx_chunks(
+        xlsx_obj: InMemoryUploadedFile,
+        sheet_name: Optional[str] = None,
+        chunk_size: int = XLSX_CHUNK_SIZE,
+) -> Iterator[pd.DataFrame]:
+    """
+    Генератор для потокового чтения листа xlsx файла частями фиксированного размера.
+    Файл читается через openpyxl в режиме read_only, поэтому потребление памяти
+    ограничено размером одной части и не зависит от количества строк в файле.
+    Заголовок читается один раз и используется как имена колонок всех частей.
 
     Параметры
     ---------
     xlsx_obj: InMemoryUploadedFile
         объект загруженного xlsx файла
+    sheet_name: str, None
+        имя листа, если не указано - читается первый лист
+    chunk_size: int
+        количество строк в одной части
+
+    Возвращаемое значение
+    ---------------------
+    Iterator[pd.DataFrame]
+        части листа в виде DataFrame с колонками из заголовка
+    """
+    xlsx_obj.seek(0)
+    workbook = openpyxl.load_workbook(xlsx_obj, read_only=True, data_only=True)
+    try:
+        sheet = workbook[sheet_name] if sheet_name is not None else workbook.worksheets[0]
+        rows = sheet.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        header = [
+            column if column is not None else "Unnamed: {}".format(idx)
+            for idx, column in enumerate(header)
+        ]
+        chunk = []
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            chunk.append(row[:len(header)])
+            if len(chunk) == chunk_size:
+                yield make_frame(chunk, columns=header)
+                chunk = []
+        if chunk:
+            yield make_frame(chunk, columns=header)
+    finally:
+        workbook.close()
+
+
+def chunk_to_records(chunk: pd.DataFrame) -> List[Dict]:
+    """
+    Функция для преобразования части листа в список словарей, где пустые значения заменены на None
+
+    Параметры
+    ---------
+    chunk: pd.DataFrame
+        часть листа xlsx файла
+
+    Возвращаемое значение
+    ---------------------
+    List[Dict]
+        список словарей со строками листа
+    """
+    return chunk.astype(object).where(pd.notnull(chunk), None).to_dict('records')
+
+
+def iter_clients_chunks(file_obj: IO, chunk_size: int = XLSX_CHUNK_SIZE) -> Iterator[List]:
+    """
+    Генератор для потокового чтения имён клиентов: из листа client xlsx файла
+    или из колонки client_name CSV/Parquet файла (каждое имя - один раз, в порядке первого появления)
+
+    Параметры
+    ---------
+    file_obj: IO
+        объект загруженного файла (.xlsx, .csv или .parquet)
+    chunk_size: int
+        количество строк в одной части
+
+    Возвращаемое значение
+    ---------------------
+    Iterator[List]
+        части списка имён клиентов
+    """
+    file_format = readers.detect_file_format(file_obj)
+    if file_format == readers.FORMAT_XLSX:
+        for chunk in iter_xlsx_chunks(file_obj, sheet_name="client", chunk_size=chunk_size):
+            yield chunk["name"].to_list()
+        return
+    seen = set()
+    for chunk in readers.iter_columnar_chunks(file_obj, file_format, chunk_size, columns=("client_name",)):
+        names = [name for name in dict.fromkeys(chunk["client_name"]) if name is not None and name not in seen]
+        seen.update(names)
+        if names:
+            yield names
+
+
+def iter_organizations_chunks(file_obj: IO, chunk_size: int = XLSX_CHUNK_SIZE) -> Iterator[List[Dict]]:
+    """
+    Генератор для потокового чтения данных организаций: из листа organization xlsx файла
+    или из строк CSV/Parquet файла с заполненной колонкой name (строки без name только объявляют клиента)
+
+    Параметры
+    ---------
+    file_obj: IO
+        объект загруженного файла (.xlsx, .csv или .parquet)
+    chunk_size: int
+        количество строк в одной части
+
+    Возвращаемое значение
+    ---------------------
+    Iterator[List[Dict]]
+        части списка словарей с данными организаций
+    """
+    file_format = readers.detect_file_format(file_obj)
+    if file_format == readers.FORMAT_XLSX:
+        for chunk in iter_xlsx_chunks(file_obj, sheet_name="organization", chunk_size=chunk_size):
+            yield chunk_to_records(chunk)
+        return
+    header = readers.read_columnar_header(file_obj, file_format)
+    columns = [column for column in ORGANIZATION_COLUMNS if column in header]
+    for chunk in readers.iter_columnar_chunks(file_obj, file_format, chunk_size, columns=columns):
+        if "name" not in chunk:
+            continue
+        records = chunk_to_records(chunk[chunk["name"].notna()])
+        if records:
+            yield records
+
+
+def get_clients_and_organizations_data(file_obj: IO) -> ClientsAndOrganizations:
+    """
+    Функция для получения данных клиентов и организаций из файла (.xlsx, .csv или .parquet)
+
+    Параметры
+    ---------
+    file_obj: IO
+        объект загруженного файла
 
     Возвращаемое значение
     ---------------------
@@ -112,105 +277,396 @@ def get_clients_and_organizations_data(xlsx_obj: InMemoryUploadedFile) -> Client
         словарь с ключами clients_data и organizations_data,
         значения которых это список клиентов и данные об организациях соответственно
     """
-    client_data = pd.read_excel(xlsx_obj, sheet_name="client")
-    clients_data = client_data["name"].to_list()
-    organization_data = pd.read_excel(xlsx_obj, sheet_name="organization")
-    organizations_data = organization_data.to_dict('records')
+    clients_data = list(itertools.chain.from_iterable(iter_clients_chunks(file_obj)))
+    organizations_data = list(itertools.chain.from_iterable(iter_organizations_chunks(file_obj)))
     return dict(clients_data=clients_data, organizations_data=organizations_data)
 
 
-def prepare_bill(bill_type: int, bill_data: Dict) -> Dict:
+def iter_bills_frames(
+        file_obj: IO,
+        chunk_size: int = XLSX_CHUNK_SIZE,
+        formats: BillFormatRegistry = bill_formats,
+) -> Iterator[pd.DataFrame]:
     """
-    Функция для приведения разных структур словаря данных о счёте к общей структуре
+    Генератор для потокового чтения данных счетов из файла (.xlsx, .csv или .parquet) частями в виде DataFrame
+    с колонками общей структуры (BILL_FIELDS). Индекс DataFrame - номер строки данных в файле, начиная с 1.
+    Формат клиента определяется один раз по заголовку файла с помощью реестра форматов,
+    а каждая часть приводится к общей структуре переименованием колонок.
+    Из CSV и Parquet файлов читаются только колонки формата клиента, а даты приводятся
+    к pd.Timestamp (readers.parse_dates), как у дат xlsx файла.
 
     Параметры
     ---------
-    bill_type: int
-        список заголовков xlsx файла
-    bill_data: Dict
-        словарь с данными о счёте
+    file_obj: IO
+        объект загруженного файла
+    chunk_size: int
+        количество строк в одной части
+    formats: BillFormatRegistry
+        реестр форматов файлов со счетами
 
     Возвращаемое значение
     ---------------------
-    new_bill_data: Dict
-        словарь с данными о счете с общей структурой
+    Iterator[pd.DataFrame]
+        части данных о счетах
+
+    Исключения
+    ----------
+    UnknownBillFormatError
+        если формат файла не удалось определить по заголовку
     """
-    new_bill_data = {
-        "client_name": None,
-        "client_org": None,
-        "number": None,
-        "summ": None,
-        "date": None,
-        "service": None,
-    }
-    if bill_type == 1:
-        new_bill_data["client_name"] = bill_data.get("client_name")
-        new_bill_data["client_org"] = bill_data.get("client_org")
-        new_bill_data["number"] = bill_data.get("№")
-        new_bill_data["summ"] = bill_data.get("sum")
-        new_bill_data["date"] = bill_data.get("date")
-        new_bill_data["service"] = bill_data.get("service")
-    elif bill_type == 2:
-        new_bill_data["client_name"] = bill_data.get("client")
-        new_bill_data["client_org"] = bill_data.get("organization")
-        new_bill_data["number"] = bill_data.get("bill_number")
-        new_bill_data["summ"] = bill_data.get("total_sum")
-        new_bill_data["date"] = bill_data.get("created_date")
-        new_bill_data["service"] = bill_data.get("service_name")
+    file_format = readers.detect_file_format(file_obj)
+    if file_format == readers.FORMAT_XLSX:
+        chunks = iter_xlsx_chunks(file_obj, chunk_size=chunk_size)
+        bill_format = None
     else:
-        new_bill_data["client_name"] = bill_data.get("client_code")
-        new_bill_data["client_org"] = bill_data.get("client_org_name")
-        new_bill_data["number"] = bill_data.get("number")
-        new_bill_data["summ"] = bill_data.get("total")
-        new_bill_data["date"] = bill_data.get("created")
-        new_bill_data["service"] = bill_data.get("service")
-    return new_bill_data
+        bill_format = formats.detect(readers.read_columnar_header(file_obj, file_format))
+        chunks = readers.iter_columnar_chunks(file_obj, file_format, chunk_size, columns=list(bill_format.columns))
+    offset = 0
+    for chunk in chunks:
+        if bill_format is None:
+            bill_format = formats.detect(chunk.columns)
+        frame = bill_format.normalize(chunk)
+        if file_format != readers.FORMAT_XLSX:
+            frame = frame.assign(date=readers.parse_dates(frame["date"]))
+        frame.index = pd.RangeIndex(offset + 1, offset + 1 + len(frame))
+        offset += len(frame)
+        yield frame
+
+
+def get_bills_data(file_obj: IO) -> List[Dict]:
+    """
+    Функция для получения данных счетов из файла (.xlsx, .csv или .parquet)
+
+    Параметры
+    ---------
+    file_obj: IO
+        объект загруженного файла
+
+    Возвращаемое значение
+    ---------------------
+    List[Dict]
+        список словарей с данными о счетах
+    """
+    return list(itertools.chain.from_iterable(chunk_to_records(frame) for frame in iter_bills_frames(file_obj)))
 
 
-def get_bill_type(header: List) -> int:
+def chunked(items: List, size: int) -> Iterable[List]:
     """
-    Функция для определения типа структуры клиента
+    Генератор, разбивающий список на части фиксированного размера
 
     Параметры
     ---------
-    header: List
-        список заголовков xlsx файла
+    items: List
+        исходный список
+    size: int
+        размер одной части
 
     Возвращаемое значение
     ---------------------
-    bill_type: int
-        номер типа структуры клиента
+    Iterable[List]
+        части исходного списка
     """
-    if "client_name" in header and "client_org" in header:
-        bill_type = 1
-    elif "client" in header and "organization" in header:
-        bill_type = 2
-    else:
-        bill_type = 3
-    return bill_type
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
 
 
-def get_bills_data(xlsx_obj: InMemoryUploadedFile) -> List[Dict]:
+def resolve_clients(names: Iterable[str]) -> Dict[str, int]:
     """
-    Функция для получения данных счетов из xlsx файла
+    Функция для массового сопоставления имён клиентов с их id в базе данных
+    (IN-запросы с разбиением на части по IN_QUERY_BATCH_SIZE)
 
     Параметры
     ---------
-    xlsx_obj: InMemoryUploadedFile
-        объект загруженного xlsx файла
+    names: Iterable[str]
+        имена клиентов, могут повторяться
 
     Возвращаемое значение
     ---------------------
-    List[Dict]
-        список словарей с данными о счетах
+    Dict[str, int]
+        словарь вида {client_name: client_id}, в который попадают только найденные в базе клиенты
+    """
+    client_ids = {}
+    for names_chunk in chunked(list(set(names)), IN_QUERY_BATCH_SIZE):
+        client_ids.update(Client.objects.filter(name__in=names_chunk).values_list("name", "id"))
+    return client_ids
+
+
+def resolve_clients_and_organizations(pairs: Iterable[Tuple[str, str]]) -> Dict[Tuple[str, str], Tuple[int, int]]:
+    """
+    Функция для массового сопоставления пар (имя клиента, имя организации) с их id в базе данных.
+    Вместо запросов на каждую строку файла выполняется по одному IN-запросу
+    на клиентов и на организации (с разбиением на части по IN_QUERY_BATCH_SIZE).
+    Организация ищется по паре (client, name), как того требует Organization.Meta.unique_together.
+
+    Параметры
+    ---------
+    pairs: Iterable[Tuple[str, str]]
+        пары (client_name, client_org)
+
+    Возвращаемое значение
+    ---------------------
+    Dict[Tuple[str, str], Tuple[int, int]]
+        словарь вида {(client_name, client_org): (client_id, organization_id)},
+        в который попадают только найденные в базе пары
+    """
+    pairs = set(pairs)
+    org_names = list({org_name for _, org_name in pairs})
+
+    client_ids = resolve_clients(client_name for client_name, _ in pairs)
+    if not client_ids:
+        return {}
+
+    organization_ids = {}
+    known_client_ids = set(client_ids.values())
+    for names in chunked(org_names, IN_QUERY_BATCH_SIZE):
+        organization_ids.update(
+            {
+                (client_id, name): pk
+                for pk, client_id, name in Organization.objects.filter(name__in=names).values_list(
+                    "id", "client_id", "name"
+                )
+                if client_id in known_client_ids
+            }
+        )
+
+    resolved = {}
+    for client_name, org_name in pairs:
+        client_id = client_ids.get(client_name)
+        organization_id = organization_ids.get((client_id, org_name))
+        if client_id is not None and organization_id is not None:
+            resolved[(client_name, org_name)] = (client_id, organization_id)
+    return resolved
+
+
+def increment_fields(model: Type[Model], increments: Mapping[int, Mapping[str, int]], fast: bool = False) -> None:
+    """
+    Функция для увеличения числовых полей сразу у многих записей одним UPDATE-запросом
+    (CASE/WHEN по первичному ключу, с разбиением на части по IN_QUERY_BATCH_SIZE)
+
+    Параметры
+    ---------
+    model: Type[Model]
+        модель
+    increments: Mapping[int, Mapping[str, int]]
+        словарь вида {pk: {поле: на сколько увеличить}}, значения могут быть отрицательными
+    fast: bool
+        обновлять записи через executemany (sqlite_loader)
+    """
+    if fast:
+        sqlite_loader.increment_objects(model, increments)
+        return
+    pks = [pk for pk, deltas in increments.items() if any(deltas.values())]
+    fields = sorted({field for pk in pks for field in increments[pk]})
+    for ids in chunked(pks, IN_QUERY_BATCH_SIZE):
+        model.objects.filter(pk__in=ids).update(**{
+            field: F(field) + Case(
+                *[When(pk=pk, then=Value(increments[pk][field])) for pk in ids if increments[pk].get(field)],
+                default=Value(0),
+                output_field=IntegerField(),
+            )
+            for field in fields
+        })
+
+
+def increment_fraud_weights(increments: Mapping[int, int], fast: bool = False) -> None:
+    """
+    Функция для увеличения fraud_weight сразу у многих организаций одним UPDATE-запросом
+
+    Параметры
+    ---------
+    increments: Mapping[int, int]
+        словарь вида {organization_id: на сколько увеличить fraud_weight}
+    fast: bool
+        обновлять записи через executemany (sqlite_loader)
+    """
+    increment_fields(
+        Organization, {pk: {"fraud_weight": increment} for pk, increment in increments.items()}, fast=fast
+    )
+
+
+def fetch_existing(
+        model: Type[Model],
+        key_fields: Tuple[str, ...],
+        keys: List[Tuple],
+        fields: Tuple[str, ...],
+) -> Dict[Tuple, Tuple]:
+    """
+    Функция для получения уже существующих в базе записей по их ключам
+    (IN-запросы по каждому полю ключа с разбиением на части по IN_QUERY_BATCH_SIZE)
+
+    Параметры
+    ---------
+    model: Type[Model]
+        модель
+    key_fields: Tuple[str, ...]
+        поля ключа (имена колонок, например organization_id)
+    keys: List[Tuple]
+        искомые ключи
+    fields: Tuple[str, ...]
+        поля, значения которых нужно получить
+
+    Возвращаемое значение
+    ---------------------
+    Dict[Tuple, Tuple]
+        словарь вида {ключ: значения полей fields} для найденных записей
+    """
+    existing = {}
+    for keys_chunk in chunked(keys, IN_QUERY_BATCH_SIZE):
+        wanted = set(keys_chunk)
+        lookups = {
+            "{}__in".format(field): {key[idx] for key in keys_chunk}
+            for idx, field in enumerate(key_fields)
+        }
+        for row in model.objects.filter(**lookups).values_list(*key_fields, *fields):
+            key = row[:len(key_fields)]
+            if key in wanted:
+                existing[key] = row[len(key_fields):]
+    return existing
+
+
+def exclude_unchanged(model: Type[Model], objects: List[Model], key_fields: Tuple[str, ...]) -> Tuple[List[Model], int]:
+    """
+    Функция для отбора новых и измененных объектов: объект не изменился, если в базе есть запись
+    с тем же ключом key_fields и тем же хешем строки файла (поле row_hash)
+
+    Параметры
+    ---------
+    model: Type[Model]
+        модель с полем row_hash
+    objects: List[Model]
+        объекты с заполненными полями ключа и row_hash
+    key_fields: Tuple[str, ...]
+        поля ключа уникальности (имена колонок)
+
+    Возвращаемое значение
+    ---------------------
+    Tuple[List[Model], int]
+        новые и измененные объекты и количество неизмененных
+    """
+    if not objects:
+        return objects, 0
+    keys = {tuple(getattr(obj, field) for field in key_fields) for obj in objects}
+    existing = fetch_existing(model, key_fields, list(keys), ("row_hash",))
+    changed = [
+        obj for obj in objects
+        if existing.get(tuple(getattr(obj, field) for field in key_fields), (None,))[0] != obj.row_hash
+    ]
+    return changed, len(objects) - len(changed)
+
+
+class UpsertResult(NamedTuple):
+    """
+    Класс, представляющий результат записи объектов с учетом конфликтов
+
+    Атрибуты
+    ---------
+    inserted: List[Model]
+        добавленные объекты
+    updated: List[Model]
+        обновленные объекты
+    skipped: int
+        количество пропущенных объектов (уже есть в базе или повторяются в файле)
+    previous: Dict[Tuple, Tuple]
+        значения полей fetch_fields обновленных и пропущенных записей до записи, по ключу
+    """
+    inserted: List[Model]
+    updated: List[Model]
+    skipped: int
+    previous: Dict[Tuple, Tuple]
+
+
+def upsert_objects(
+        model: Type[Model],
+        objects: List[Model],
+        key_fields: Tuple[str, ...],
+        update_fields: Tuple[str, ...] = (),
+        on_conflict: str = ImportJob.ON_CONFLICT_ERROR,
+        batch_size: Optional[int] = None,
+        fetch_fields: Tuple[str, ...] = (),
+        fast: bool = False,
+) -> UpsertResult:
+    """
+    Функция для массовой записи объектов с обработкой конфликтов по ключу key_fields.
+    Существующие записи ищутся пакетными запросами, новые объекты добавляются через bulk_create,
+    а существующие (в режиме update) обновляются через bulk_update, частями по batch_size.
+    Если параллельный импорт добавил запись с тем же ключом после поиска существующих,
+    запись повторяется (не больше UPSERT_ATTEMPTS раз), и такие объекты считаются существующими.
+    Функцию нужно вызывать внутри транзакции.
+
+    Параметры
+    ---------
+    model: Type[Model]
+        модель
+    objects: List[Model]
+        объекты для записи
+    key_fields: Tuple[str, ...]
+        поля ключа уникальности (имена колонок)
+    update_fields: Tuple[str, ...]
+        поля, обновляемые в режиме update
+    on_conflict: str
+        поведение при конфликте: error - ошибка IntegrityError, skip - существующие записи пропускаются,
+        update - существующие записи обновляются (ImportJob.ON_CONFLICT_CHOICES)
+    batch_size: int, None
+        количество объектов в одном INSERT/UPDATE запросе
+    fetch_fields: Tuple[str, ...]
+        поля существующих записей, значения которых нужно вернуть в UpsertResult.previous
+    fast: bool
+        записывать через executemany (sqlite_loader) вместо bulk_create/bulk_update
+
+    Возвращаемое значение
+    ---------------------
+    UpsertResult
+        добавленные и обновленные объекты, количество пропущенных объектов
     """
-    header = pd.read_excel(xlsx_obj, nrows=0).columns.to_list()
-    bill_type = get_bill_type(header=header)
-    bills_data = pd.read_excel(xlsx_obj)
-    bills_data = bills_data.astype(object).where(pd.notnull(bills_data), None)
-    bills_data = bills_data.to_dict('records')
-    bills_data = [prepare_bill(bill_type=bill_type, bill_data=bill) for bill in bills_data]
-    return bills_data
+    if on_conflict == ImportJob.ON_CONFLICT_ERROR:
+        if fast:
+            sqlite_loader.insert_objects(model, objects)
+        else:
+            model.objects.bulk_create(objects, batch_size=batch_size)
+        return UpsertResult(inserted=objects, updated=[], skipped=0, previous={})
+
+    update = on_conflict == ImportJob.ON_CONFLICT_UPDATE and bool(update_fields)
+    unique = {}
+    for obj in objects:
+        key = tuple(getattr(obj, field) for field in key_fields)
+        if update or key not in unique:
+            unique[key] = obj
+    duplicates = len(objects) - len(unique)
+
+    # запись, добавленная параллельным импортом после поиска существующих, вызывает IntegrityError:
+    # запись откатывается до точки сохранения и повторяется с заново найденными существующими записями,
+    # поэтому в результате остаются только действительно добавленные объекты.
+    # Вызов внутри транзакции должен начинать ее через sqlite_loader.write_transaction: иначе в SQLite
+    # запись после поиска при параллельном импорте завершается ошибкой "database is locked", а не IntegrityError
+    for attempt in range(1, UPSERT_ATTEMPTS + 1):
+        existing = fetch_existing(model, key_fields, list(unique), ("id",) + tuple(fetch_fields))
+        inserted, updated, skipped = [], [], duplicates
+        for key, obj in unique.items():
+            if key not in existing:
+                inserted.append(obj)
+            elif update:
+                obj.id = existing[key][0]
+                updated.append(obj)
+            else:
+                skipped += 1
+        try:
+            with sqlite_loader.write_transaction():
+                if fast:
+                    sqlite_loader.insert_objects(model, inserted)
+                    sqlite_loader.update_objects(model, updated, update_fields)
+                else:
+                    model.objects.bulk_create(inserted, batch_size=batch_size)
+                    if updated:
+                        model.objects.bulk_update(updated, update_fields, batch_size=batch_size)
+        except IntegrityError:
+            if attempt == UPSERT_ATTEMPTS:
+                raise
+            for obj in inserted:
+                obj.pk = None
+            continue
+        break
+    previous = {key: row[1:] for key, row in existing.items()}
+    return UpsertResult(inserted=inserted, updated=updated, skipped=skipped, previous=previous)
 
 
 class BillObjModel(BaseModel):
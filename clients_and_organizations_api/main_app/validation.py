@@ -0,0 +1,162 @@
+import datetime
+from typing import NamedTuple, Dict
+
+import numpy as np
+import pandas as pd
+
+from main_app.formats import BILL_FIELDS
+
+# Целое число в строке в том виде, в котором его принимает int()
+INT_PATTERN = r"^\s*[+-]?\d+(?:_\d+)*\s*$"
+
+
+class BillsValidation(NamedTuple):
+    """
+    Класс, представляющий результат колоночной валидации части файла со счетами
+
+    Атрибуты
+    ---------
+    accepted: pd.Series
+        булева маска валидных строк с тем же индексом, что и у проверяемого DataFrame
+    reasons: pd.DataFrame
+        таблица причин отказа только для невалидных строк:
+        колонки - поля счета, True - поле не прошло проверку
+    """
+    accepted: pd.Series
+    reasons: pd.DataFrame
+
+
+def _is_type(column: pd.Series, types: tuple) -> pd.Series:
+    """
+    Возвращает маску значений колонки, являющихся экземплярами types.
+    Для колонок с однородным типом проверка делается по dtype, без обхода значений.
+    """
+    if column.dtype != object:
+        if issubclass(column.dtype.type, (np.number, np.bool_)):
+            return column.notna() & any(issubclass(t, (int, float)) for t in types)
+        if pd.api.types.is_datetime64_any_dtype(column):
+            return column.notna() & any(issubclass(t, datetime.datetime) for t in types)
+    return column.map(lambda v: isinstance(v, types)).astype(bool)
+
+
+def _text_not_empty(column: pd.Series, strip_chars: str = None) -> pd.Series:
+    """
+    Проверка строкового поля: значение приводится к str (как это делает pydantic) и не должно быть пустым
+    """
+    text = column.astype(object).where(_is_type(column, (str, int, float)))
+    text = text.astype(str).where(text.notna(), "").str.strip()
+    if strip_chars is not None:
+        text = text.str.strip(strip_chars)
+    return text.str.len() > 0
+
+
+def _is_int(column: pd.Series) -> pd.Series:
+    """
+    Проверка поля типа int: число (дробная часть отбрасывается) или строка с целым числом
+    """
+    numbers = pd.to_numeric(column.astype(object).where(_is_type(column, (int, float))), errors="coerce")
+    strings = column.astype(object).where(_is_type(column, (str,)))
+    return np.isfinite(numbers.astype(float)) | strings.str.match(INT_PATTERN).fillna(False).astype(bool)
+
+
+def _is_number(column: pd.Series) -> pd.Series:
+    """
+    Проверка числового поля: число или строка с числом, бесконечность и NaN не допускаются
+    """
+    numbers = pd.to_numeric(column.astype(object).where(_is_type(column, (int, float, str))), errors="coerce")
+    return pd.Series(np.isfinite(numbers.astype(float)), index=column.index)
+
+
+def _is_full_date(column: pd.Series) -> pd.Series:
+    """
+    Проверка даты: значение должно быть датой со временем (день, месяц и год есть у любого такого значения)
+    """
+    return _is_type(column, (pd.Timestamp, datetime.datetime)) & column.notna()
+
+
+def validate_bills_frame(frame: pd.DataFrame) -> BillsValidation:
+    """
+    Функция для колоночной валидации данных о счетах.
+    Применяет к целым колонкам те же правила, что и BillObjModel к одной строке:
+    - summ является числом
+    - number имеет тип int
+    - client_name и client_org не пустые
+    - service не пустой и не состоит из знака "-"
+    - date - корректная дата (есть день, месяц и год)
+    В отличие от BillObjModel, значения NaN и бесконечность в summ считаются невалидными.
+
+    Параметры
+    ---------
+    frame: pd.DataFrame
+        часть файла со счетами с колонками из BILL_FIELDS
+
+    Возвращаемое значение
+    ---------------------
+    BillsValidation
+        маска валидных строк и таблица причин отказа для невалидных строк
+    """
+    valid = pd.DataFrame({
+        "client_name": _text_not_empty(frame["client_name"]),
+        "client_org": _text_not_empty(frame["client_org"]),
+        "number": _is_int(frame["number"]),
+        "summ": _is_number(frame["summ"]),
+        "date": _is_full_date(frame["date"]),
+        "service": _text_not_empty(frame["service"], strip_chars="-"),
+    }, index=frame.index, columns=list(BILL_FIELDS))
+    accepted = valid.all(axis=1)
+    return BillsValidation(accepted=accepted, reasons=~valid[~accepted])
+
+
+def format_reasons(reasons: pd.DataFrame) -> Dict:
+    """
+    Функция для представления таблицы причин отказа в виде, удобном для логирования
+
+    Параметры
+    ---------
+    reasons: pd.DataFrame
+        таблица причин отказа из BillsValidation
+
+    Возвращаемое значение
+    ---------------------
+    Dict
+        словарь вида {индекс строки: "поле1, поле2"}
+    """
+    columns = np.array(reasons.columns)
+    return {
+        idx: ", ".join(columns[row])
+        for idx, row in zip(reasons.index, reasons.to_numpy(dtype=bool))
+    }
+
+
+def _to_integer(column: pd.Series) -> pd.Series:
+    """
+    Приводит колонку с числами или строками с числами к int, отбрасывая дробную часть, как это делает int()
+    """
+    values = column.astype(object)
+    is_string = _is_type(values, (str,))
+    values = values.where(~is_string, values[is_string].astype(str).str.replace("_", "", regex=False).str.strip())
+    return np.trunc(pd.to_numeric(values).astype(float)).astype(np.int64)
+
+
+def normalize_bills_frame(frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    Функция для приведения значений валидных строк к типам полей модели Bill
+
+    Параметры
+    ---------
+    frame: pd.DataFrame
+        валидные строки (прошедшие validate_bills_frame) с колонками из BILL_FIELDS
+
+    Возвращаемое значение
+    ---------------------
+    pd.DataFrame
+        данные о счетах с приведенными типами и тем же индексом
+    """
+    return pd.DataFrame({
+        "client_name": frame["client_name"].astype(str),
+        "client_org": frame["client_org"].astype(str),
+        "number": _to_integer(frame["number"]),
+        "summ": _to_integer(frame["summ"]),
+        "date": pd.to_datetime(frame["date"]).dt.date,
+        "service": frame["service"].astype(str),
+    }, index=frame.index, columns=list(BILL_FIELDS))
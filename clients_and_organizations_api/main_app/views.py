@@ -1,37 +1,233 @@
 import logging
+import os
+import zipfile
+from typing import List, Tuple
 
-from django.db.models import Count, Sum, F
-from pydantic import ValidationError
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import UploadedFile
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.http import HttpResponse, HttpResponseForbidden, StreamingHttpResponse
 from rest_framework import viewsets, status, mixins
 from rest_framework.decorators import action
-from rest_framework.exceptions import UnsupportedMediaType
+from rest_framework.exceptions import ParseError, UnsupportedMediaType
 from rest_framework.response import Response
 
+from main_app import analytics
+from main_app import fingerprints
+from main_app import jobs
+from main_app import metrics
+from main_app import readers
 from main_app import models
-from main_app import utils
-from main_app.models import Client, Organization, Bill
-from main_app.serializers import ClientSerializer, BillSerializer
-from main_app.utils import BillObjModel
+from main_app.models import ImportJob
+from main_app.pagination import ClientsPagination, BillsPagination
+from main_app.renderers import CSVStreamingRenderer, NDJSONStreamingRenderer
+from main_app.response_cache import CachedListMixin, get_cache, make_response_key
+from main_app.serializers import ClientSerializer, BillSerializer, BillListSerializer, ImportJobSerializer
 
 my_logger = logging.getLogger("my_logger")
 
+# Количество строк, читаемых из базы за один запрос при выгрузке счетов
+EXPORT_CHUNK_SIZE = 2000
+# Query-параметры, от которых зависит ответ /api/bills/stats/
+STATS_QUERY_PARAMS = (
+    "group_by", "date_from", "date_to", "min_fraud_score", "max_fraud_score", "client", "organization",
+)
 
-class ClientsViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+
+def is_supported_file(name: str) -> bool:
+    """
+    Возвращает True, если файл с именем name можно импортировать (.xlsx, .csv или .parquet)
+    """
+    return os.path.splitext(name)[1].lower() in readers.supported_extensions()
+
+
+def get_upload_files(request) -> Tuple[List[UploadedFile], bool]:
+    """
+    Функция для получения загруженных файлов из поля file: поле может повторяться,
+    а zip-архивы разворачиваются в входящие в них файлы.
+
+    Параметры
+    ---------
+    request: Request
+        объект запроса
+
+    Возвращаемое значение
+    ---------------------
+    Tuple[List[UploadedFile], bool]
+        список файлов (.xlsx, .csv или .parquet) и признак загрузки группы файлов (несколько файлов или архив)
+
+    Исключения
+    ----------
+    ParseError
+        если файлов нет, их больше IMPORT_UPLOAD_MAX_FILES или архив поврежден, слишком велик после распаковки
+        либо не содержит файлов для импорта
+    UnsupportedMediaType
+        если загружен файл не в формате .xlsx, .csv, .parquet или .zip
+    """
+    uploaded = request.FILES.getlist("file")
+    if not uploaded:
+        raise ParseError("Empty \"file\" field")
+    files = []
+    for file_obj in uploaded:
+        if is_supported_file(file_obj.name):
+            files.append(file_obj)
+        elif file_obj.name.endswith(".zip"):
+            files.extend(extract_upload_files(file_obj))
+        else:
+            raise UnsupportedMediaType(
+                file_obj.content_type,
+                detail="File must be one of: {}".format(", ".join(readers.supported_extensions() + [".zip"])),
+            )
+        if len(files) > settings.IMPORT_UPLOAD_MAX_FILES:
+            raise ParseError("Too many files, maximum is {}".format(settings.IMPORT_UPLOAD_MAX_FILES))
+    return files, len(uploaded) > 1 or len(files) != len(uploaded)
+
+
+def extract_upload_files(archive: UploadedFile) -> List[ContentFile]:
+    """
+    Функция для извлечения файлов для импорта (.xlsx, .csv, .parquet) из zip-архива
+    (служебные файлы и папки пропускаются).
+    Размеры файлов после распаковки проверяются по заголовкам архива до чтения: zipfile не распаковывает
+    больше указанного в заголовке размера, поэтому небольшой архив не займет всю память процесса.
+
+    Параметры
+    ---------
+    archive: UploadedFile
+        загруженный zip-архив
+
+    Возвращаемое значение
+    ---------------------
+    List[ContentFile]
+        файлы архива с именами без пути
+
+    Исключения
+    ----------
+    ParseError
+        если архив поврежден, не содержит файлов для импорта, содержит больше IMPORT_UPLOAD_MAX_FILES файлов,
+        файл больше IMPORT_UPLOAD_MAX_FILE_SIZE или файлы больше IMPORT_UPLOAD_MAX_UNPACKED_SIZE в сумме
+    """
+    try:
+        with zipfile.ZipFile(archive) as zip_file:
+            members = []
+            for info in zip_file.infolist():
+                name = os.path.basename(info.filename)
+                if info.is_dir() or name.startswith(".") or info.filename.startswith("__MACOSX/"):
+                    continue
+                if not is_supported_file(name):
+                    my_logger.warning(f"Файл {info.filename} архива {archive.name} пропущен: формат не поддерживается")
+                    continue
+                if len(members) == settings.IMPORT_UPLOAD_MAX_FILES:
+                    raise ParseError("Too many files, maximum is {}".format(settings.IMPORT_UPLOAD_MAX_FILES))
+                if info.file_size > settings.IMPORT_UPLOAD_MAX_FILE_SIZE:
+                    raise ParseError("File {} of archive {} is too large, maximum is {} bytes".format(
+                        info.filename, archive.name, settings.IMPORT_UPLOAD_MAX_FILE_SIZE,
+                    ))
+                members.append((info, name))
+            if sum(info.file_size for info, _ in members) > settings.IMPORT_UPLOAD_MAX_UNPACKED_SIZE:
+                raise ParseError("Archive {} is too large when unpacked, maximum is {} bytes".format(
+                    archive.name, settings.IMPORT_UPLOAD_MAX_UNPACKED_SIZE,
+                ))
+            files = [ContentFile(zip_file.read(info), name=name) for info, name in members]
+    except zipfile.BadZipFile:
+        raise ParseError("Broken zip archive {}".format(archive.name))
+    if not files:
+        raise ParseError("Archive {} contains no files to import".format(archive.name))
+    return files
+
+
+def create_import_jobs(request, kind: str) -> Response:
+    """
+    Функция для сохранения загруженных файлов и постановки задач на их импорт в очередь (по задаче на файл).
+    Поле on_conflict в теле запроса задает поведение при конфликте с существующими записями:
+    error (по умолчанию), skip или update.
+    Файл, содержимое которого уже импортировано (или импортируется) с тем же on_conflict, повторно не импортируется:
+    для него сразу создается выполненная задача со ссылкой duplicate_of на задачу, импортировавшую файл.
+    Если загружен один файл, в ответе - данные его задачи, иначе - сводка по файлам
+    {"files": [данные задачи каждого файла]}, а файлы импортируются группой (jobs.run_job_group).
+
+    Параметры
+    ---------
+    request: Request
+        объект запроса
+    kind: str
+        тип импорта (ImportJob.KIND_BILLS или ImportJob.KIND_CLIENTS)
+
+    Возвращаемое значение
+    ---------------------
+    Response
+        ответ со статус-кодом 202 и данными созданных задач
+        (200, если все файлы уже были импортированы и в очередь ничего не поставлено)
+    """
+    files, group = get_upload_files(request)
+    on_conflict = request.data.get("on_conflict", ImportJob.ON_CONFLICT_ERROR)
+    if on_conflict not in dict(ImportJob.ON_CONFLICT_CHOICES):
+        return Response(
+            dict(detail="\"on_conflict\" must be one of: {}".format(", ".join(dict(ImportJob.ON_CONFLICT_CHOICES)))),
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    created, queued = [], []
+    for file_obj in files:
+        content_hash = fingerprints.file_hash(file_obj)
+        imported_by = fingerprints.find_imported_job(kind, content_hash, on_conflict)
+        if imported_by is not None:
+            now = timezone.now()
+            job = ImportJob.objects.create(
+                kind=kind, file_name=file_obj.name, on_conflict=on_conflict, state=ImportJob.STATE_DONE,
+                started_at=now, finished_at=now, duplicate_of=imported_by,
+            )
+            my_logger.info(f"Файл {file_obj.name} уже импортирован задачей {imported_by}, создана задача {job}")
+            created.append(job)
+            continue
+        job = ImportJob.objects.create(kind=kind, file=file_obj, file_name=file_obj.name, on_conflict=on_conflict)
+        fingerprints.register_batch(job, content_hash)
+        my_logger.info(f"Создана задача импорта {job} для файла {file_obj.name}")
+        created.append(job)
+        queued.append(job)
+    if group and queued:
+        jobs.enqueue_group(queued)
+    elif queued:
+        jobs.enqueue(queued[0])
+    summary = ImportJobSerializer(ImportJob.objects.filter(id__in=[job.id for job in created]), many=True).data
+    response_status = status.HTTP_202_ACCEPTED if queued else status.HTTP_200_OK
+    if not group:
+        return Response(summary[0], status=response_status)
+    return Response(dict(files=summary), status=response_status)
+
+
+def metrics_view(request):
     """
-    ClientsViewSet - вьюсет для выдачи списка клиентов и для загрузки данных о клиентах и их организациях
+    Функция-представление для выдачи метрик процесса в текстовом формате Prometheus.
+    Доступно только с адресов из настройки METRICS_ALLOWED_IPS.
+    """
+    if request.META.get("REMOTE_ADDR") not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+class ClientsViewSet(CachedListMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
+    """
+    ClientsViewSet - вьюсет для выдачи списка клиентов и для загрузки данных о клиентах и их организациях.
+    Список клиентов разбит на страницы курсорной пагинацией по id.
+    Ответы списка кешируются до следующего импорта и отдаются с ETag.
     """
     serializer_class = ClientSerializer
-    queryset = models.Client.objects.prefetch_related("organizations", "bill")
+    pagination_class = ClientsPagination
+    queryset = models.Client.objects.all()
 
     def get_queryset(self):
         """
-        Переопределенный метод get_queryset с аннотацией для агрегации данных клиента:
+        Переопределенный метод get_queryset с агрегированными данными клиента из таблицы ClientStats
+        (обновляется при импорте, поэтому счета и организации при запросе не агрегируются):
         1. organizations_count - количество всех организаций, принадлежащих клиенту
-        2. all_sums - сумма по счетам всех организаций клиента
+        2. all_sums - сумма по счетам всех организаций клиента (null, если у клиента нет счетов,
+           как у SUM по пустому набору счетов)
         """
         return models.Client.objects.annotate(
-            organizations_count=Count('organizations'),
-            all_sums=Sum('bill__summ'),
+            organizations_count=Coalesce('stats__organizations_count', Value(0)),
+            all_sums=Case(When(stats__bills_count__gt=0, then=F('stats__total_summ')), default=None),
         )
 
     @action(
@@ -42,73 +238,77 @@ class ClientsViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
     )
     def upload_xlsx(self, request):
         """
-        Метод upload_xlsx предназначен для загрузки данных о клиентах и их организациях из .xlsx файла в базу данных.
+        Метод upload_xlsx предназначен для загрузки данных о клиентах и их организациях из файла в базу данных.
 
-        Метод ожидает в теле POST запроса поле file с прикрепленным файлом в формате .xlsx.
+        Метод ожидает в теле POST запроса поле file с прикрепленным файлом в формате .xlsx, .csv
+        или .parquet (если установлен pyarrow).
+        Поле file может повторяться, также можно загрузить zip-архив с такими файлами.
         - Если файла нет - возвращается ответ со статус-кодом 400 и сообщением, что поле file пустое.
-        - Если файл не в формате .xlsx - возвращается ответ со статус-кодом 415 и сообщением,
-        что файл должен быть с расширением .xlsx.
-        - Если все хорошо, то возвращается пустой ответ со статус-кодом 201
+        - Если формат файла не поддерживается - возвращается ответ со статус-кодом 415 и сообщением
+        со списком допустимых расширений.
+        - Необязательное поле on_conflict задает поведение при конфликте с существующими записями:
+        error (по умолчанию), skip - пропускать, update - обновлять.
+        - Если все хорошо, то каждый файл сохраняется и ставится в очередь на импорт,
+        возвращается ответ со статус-кодом 202 и данными задачи импорта
+        (для нескольких файлов - {"files": [данные задачи каждого файла]}).
+        Состояние задачи доступно по адресу /api/imports/<id>/
+        - Если файл с тем же содержимым уже импортирован с тем же on_conflict, он не импортируется повторно:
+        возвращается ответ со статус-кодом 200 и выполненной задачей со ссылкой duplicate_of.
+        При импорте строки, которые уже записаны в базу с теми же значениями, пропускаются (rows_unchanged).
         """
-        file_obj = request.FILES.get('file')
-        if not file_obj:
-            return Response(
-                dict(detail="Empty \"file\" field"),
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        if not file_obj.name.endswith(".xlsx"):
-            raise UnsupportedMediaType(file_obj.content_type, detail="File must be .xlsx")
-
-        data = utils.get_clients_and_organizations_data(file_obj)
-        clients_data = data.get("clients_data")
-        organizations_data = data.get("organizations_data")
-
-        clients = [Client(name=client_name) for client_name in clients_data]
-        Client.objects.bulk_create(clients)
-
-        organizations = []
-        for client_obj in Client.objects.all():
-            orgs = list(filter(lambda x: x.get("client_name") == client_obj.name, organizations_data))
-            organizations.extend(
-                list(
-                    map(
-                        lambda x: Organization(
-                            name=x.get("name"),
-                            address=utils.prepare_address(x.get("address")),
-                            client=client_obj,
-                        ),
-                        orgs
-                    )
-                )
-            )
-        Organization.objects.bulk_create(organizations)
+        return create_import_jobs(request, ImportJob.KIND_CLIENTS)
 
-        return Response(status=status.HTTP_201_CREATED)
 
-
-class BillsViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+class BillsViewSet(CachedListMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
     """
     BillsViewSet - вьюсет для выдачи списка счетов и для загрузки данных о счетах.
     Есть возможность фильтрации счетов по имени клиента и имени организации с помощью query-параметров.
+    Список счетов разбит на страницы курсорной пагинацией по (date, id).
+    Ответы списка кешируются до следующего импорта и отдаются с ETag.
     """
     serializer_class = BillSerializer
-    queryset = models.Bill.objects.select_related("client", "organization")
+    pagination_class = BillsPagination
+    queryset = models.Bill.objects.all()
+    cache_query_params = ("client", "organization")
 
     def get_queryset(self):
         """
         Переопределенный метод get_queryset, который фильтрует queryset по имени клиента
-         и/или по имени организации.
+         и/или по имени организации и выбирает строки словарями (values) с именами клиента и организации,
+         которые BillListSerializer сериализует без создания объектов моделей.
+        """
+        queryset = self.filter_by_names(super().get_queryset())
+        return queryset.values(*BillListSerializer.values_fields())
+
+    def filter_by_names(self, queryset):
+        """
+        Метод для фильтрации счетов по имени клиента и/или по имени организации.
         Фильтры передаются в качестве query-параметров client и organization соответственно.
+        Имена заранее сопоставляются с id, поэтому счета фильтруются по индексам
+        (client_id, date) и (organization_id, date), а не по именам в соединенных таблицах.
         """
-        queryset = super().get_queryset()
         client = self.request.query_params.get('client')
         organization = self.request.query_params.get('organization')
-        if client is not None and organization is not None:
-            queryset = queryset.filter(client__name=client, organization__name=organization)
-        elif client is not None:
-            queryset = queryset.filter(client__name=client)
-        elif organization is not None:
-            queryset = queryset.filter(organization__name=organization)
+        if client is None and organization is None:
+            return queryset
+
+        client_id = None
+        if client is not None:
+            client_id = models.Client.objects.filter(name=client).values_list('id', flat=True).first()
+            if client_id is None:
+                return queryset.none()
+            queryset = queryset.filter(client_id=client_id)
+        if organization is not None:
+            organizations = models.Organization.objects.filter(name=organization)
+            if client_id is not None:
+                organizations = organizations.filter(client_id=client_id)
+            organization_ids = list(organizations.values_list('id', flat=True))
+            if not organization_ids:
+                return queryset.none()
+            if len(organization_ids) == 1:
+                queryset = queryset.filter(organization_id=organization_ids[0])
+            else:
+                queryset = queryset.filter(organization_id__in=organization_ids)
         return queryset
 
     @action(
@@ -119,60 +319,87 @@ class BillsViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
     )
     def upload_xlsx(self, request):
         """
-        Метод upload_xlsx предназначен для загрузки данных о счетах из .xlsx файла в базу данных.
+        Метод upload_xlsx предназначен для загрузки данных о счетах из файла в базу данных.
 
-        Метод ожидает в теле POST запроса поле file с прикрепленным файлом в формате .xlsx.
+        Метод ожидает в теле POST запроса поле file с прикрепленным файлом в формате .xlsx, .csv
+        или .parquet (если установлен pyarrow).
+        Поле file может повторяться, также можно загрузить zip-архив с такими файлами.
         - Если файла нет - возвращается ответ со статус-кодом 400 и сообщением, что поле file пустое.
-        - Если файл не в формате .xlsx - возвращается ответ со статус-кодом 415 и сообщением,
-        что файл должен быть с расширением .xlsx.
-        - Если все хорошо, то возвращается пустой ответ со статус-кодом 201
+        - Если формат файла не поддерживается - возвращается ответ со статус-кодом 415 и сообщением
+        со списком допустимых расширений.
+        - Необязательное поле on_conflict задает поведение при конфликте с существующими записями:
+        error (по умолчанию), skip - пропускать, update - обновлять.
+        - Если все хорошо, то каждый файл сохраняется и ставится в очередь на импорт,
+        возвращается ответ со статус-кодом 202 и данными задачи импорта
+        (для нескольких файлов - {"files": [данные задачи каждого файла]}).
+        Состояние задачи доступно по адресу /api/imports/<id>/
+        - Если файл с тем же содержимым уже импортирован с тем же on_conflict, он не импортируется повторно:
+        возвращается ответ со статус-кодом 200 и выполненной задачей со ссылкой duplicate_of.
+        При импорте строки, которые уже записаны в базу с теми же значениями, пропускаются (rows_unchanged).
         """
-        file_obj = request.FILES.get('file')
-        if not file_obj:
-            return Response(
-                dict(detail="Empty \"file\" field"),
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        if not file_obj.name.endswith(".xlsx"):
-            raise UnsupportedMediaType(file_obj.content_type, detail="File must be .xlsx")
-
-        bills_data = utils.get_bills_data(file_obj)
-        bills = []
-        for idx, bill in enumerate(bills_data, start=1):
-            prefix = f"Строка файла xlsx #{idx} "
-            try:
-                bill_obj = BillObjModel(**bill)
-            except ValidationError as e:
-                my_logger.error(f'Строка #{idx} | {e.errors()}')
-            else:
-                client_obj = Client.objects.filter(name=bill_obj.client_name)
-                if not client_obj.exists():
-                    my_logger.warning(f"{prefix} | Клиента {bill_obj.client_name} нет в базе")
-                    continue
-                organization_obj = Organization.objects.filter(name=bill_obj.client_org)
-                if not organization_obj.exists():
-                    my_logger.warning(f"{prefix} | Организации {bill_obj.client_org} нет в базе")
-                    continue
+        return create_import_jobs(request, ImportJob.KIND_BILLS)
 
-                fraud_score = utils.fraud_detector()
-                if fraud_score >= 0.9:
-                    my_logger.info(f"Обновляем поле fraud_weight на 1 у организации {bill_obj.client_org}")
-                    organization_obj.update(fraud_weight=F('fraud_weight') + 1)
-
-                service_classificator = utils.service_classificator()
-                bills.append(
-                    Bill(
-                        number=bill_obj.number,
-                        summ=bill_obj.summ,
-                        date=bill_obj.date,
-                        service=bill_obj.service,
-                        fraud_score=fraud_score,
-                        service_class=service_classificator.get("service_class"),
-                        service_name=service_classificator.get("service_name"),
-                        client=client_obj.first(),
-                        organization=organization_obj.first(),
-                    )
-                )
-
-        Bill.objects.bulk_create(bills)
-        return Response(status=status.HTTP_201_CREATED)
+    @action(
+        methods=["get"],
+        detail=False,
+        url_path="stats",
+        url_name="bills_stats",
+    )
+    def stats(self, request):
+        """
+        Метод stats предназначен для получения агрегатов счетов по группам без выгрузки самих счетов.
+
+        Query-параметры:
+        - group_by - измерения группировки через запятую: client, organization, service_class, month;
+        - date_from, date_to - диапазон дат счетов (YYYY-MM-DD, включительно);
+        - min_fraud_score, max_fraud_score - диапазон fraud_score (включительно);
+        - client, organization - те же фильтры, что и у списка счетов.
+        Для каждой группы возвращаются bills_count, total_summ, avg_fraud_score, high_fraud_bills_count
+        и fraud_rate (доля счетов с fraud_score не ниже порога) в колоночном виде
+        {"group_by": [...], "columns": {колонка: [значения по группам]}}.
+        Агрегаты считаются одним GROUP BY запросом в базе, ответ кешируется до следующего импорта.
+        При неверных параметрах возвращается ответ со статус-кодом 400.
+        """
+        dimensions = analytics.parse_group_by(request.query_params.get("group_by"))
+        key = make_response_key(request, STATS_QUERY_PARAMS)
+        cache = get_cache()
+        data = cache.get(key)
+        if data is None:
+            queryset = analytics.filter_bills(self.filter_by_names(models.Bill.objects.all()), request.query_params)
+            data = analytics.bill_stats(queryset, dimensions)
+            cache.set(key, data)
+        return Response(data)
+
+    @action(
+        methods=["get"],
+        detail=False,
+        url_path="export",
+        url_name="export_bills_data",
+        renderer_classes=[CSVStreamingRenderer, NDJSONStreamingRenderer],
+    )
+    def export(self, request):
+        """
+        Метод export предназначен для выгрузки всех счетов в формате CSV (?format=csv, по умолчанию)
+        или NDJSON (?format=ndjson).
+        Поддерживаются те же фильтры client и organization, что и у списка счетов.
+        Счета читаются из базы частями по EXPORT_CHUNK_SIZE строк в порядке id и сразу отдаются клиенту,
+        поэтому потребление памяти не зависит от количества счетов.
+        """
+        columns = BillListSerializer.columns
+        queryset = self.filter_by_names(models.Bill.objects.all()).order_by("id")
+        rows = queryset.values_list(*(source for _, source in columns)).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.stream([key for key, _ in columns], rows),
+            content_type="{}; charset={}".format(renderer.media_type, renderer.charset),
+        )
+        response["Content-Disposition"] = 'attachment; filename="bills.{}"'.format(renderer.format)
+        return response
+
+
+class ImportJobsViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """
+    ImportJobsViewSet - вьюсет для получения состояния задачи импорта загруженного файла
+    """
+    serializer_class = ImportJobSerializer
+    queryset = models.ImportJob.objects.all()